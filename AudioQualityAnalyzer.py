@@ -29,7 +29,16 @@ class AudioQualityAnalyzer:
         try:
             # Charger l'audio
             audio, sr = librosa.load(audio_path, sr=sample_rate)
-            
+        except Exception as e:
+            return self._analysis_error(e)
+        
+        return self.analyze_audio_array(audio, sr)
+    
+    def analyze_audio_array(self, audio, sr=16000):
+        """
+        Analyse la qualité d'un signal déjà décodé (float32 mono), sans relire le fichier
+        """
+        try:
             # Analyses de qualité
             quality_checks = {
                 "duration": self._check_duration(audio, sr),
@@ -73,14 +82,18 @@ class AudioQualityAnalyzer:
             }
             
         except Exception as e:
-            return {
-                "valid": False,
-                "error": f"خطأ في تحليل الصوت: {str(e)}",
-                "errors": [f"خطأ في تحليل الصوت: {str(e)}"],
-                "warnings": [],
-                "details": {},
-                "student_feedback": f"حدث خطأ أثناء تحليل ملف الصوت. يرجى المحاولة مرة أخرى أو التأكد من صحة الملف.\nتفاصيل الخطأ: {str(e)}"
-            }
+            return self._analysis_error(e)
+    
+    def _analysis_error(self, e):
+        """Résultat d'analyse en cas d'erreur de décodage ou de calcul"""
+        return {
+            "valid": False,
+            "error": f"خطأ في تحليل الصوت: {str(e)}",
+            "errors": [f"خطأ في تحليل الصوت: {str(e)}"],
+            "warnings": [],
+            "details": {},
+            "student_feedback": f"حدث خطأ أثناء تحليل ملف الصوت. يرجى المحاولة مرة أخرى أو التأكد من صحة الملف.\nتفاصيل الخطأ: {str(e)}"
+        }
     
     def _generate_student_feedback(self, quality_checks, is_valid):
         """
@@ -6,6 +6,14 @@ from dataclasses import dataclass
 import logging
 import os
 
+import metrics
+from audio_files import content_address, temp_path
+from fragment_cache import FragmentCache, ReadingCache, assemble
+from speech_synthesis import (AUDIO_FORMATS, PROSODY_RATES, AzureSpeechBackend, FailoverSpeechBackend,
+                              SpeechBackend, SynthesisResult, check_audio_format,
+                              word_spans, words_ssml, write_audio, word_index, save_word_index, load_word_index, remove_word_index,
+                              save_reading_pcm, load_reading_pcm, remove_reading_pcm, time_stretch, word_key)
+
 @dataclass
 class PronunciationError:
     """Classe pour représenter une erreur de prononciation"""
@@ -16,11 +24,38 @@ class PronunciationError:
     error_type: str  # 'missing_diacritics', 'wrong_pronunciation', 'omitted_word'
     position: int
     audio_feedback_path: Optional[str] = None
+    asr_confidence: Optional[float] = None  # Confiance ASR du mot transcrit (None si inconnue)
+    asr_uncertain: bool = False  # True si l'ASR n'était pas sûr: pas de synthèse de correction
+
+# Phrases fixes du feedback audio, synthétisées une fois puis assemblées à partir du cache de fragments
+FEEDBACK_NO_ERRORS = "أحسنت! لا توجد أخطاء في النطق. استمر في التدريب."
+FEEDBACK_INTRO = "الأخطاء في النطق هي:"
+FEEDBACK_OMITTED = "كلمة مفقودة:"
+FEEDBACK_CORRECT_PRONUNCIATION = "النطق الصحيح لكلمة"
+FEEDBACK_IS = "هو"
+FEEDBACK_DIACRITICS = "انتبه للحركات في كلمة"
+FEEDBACK_CLOSING = "حاول مرة أخرى مع التركيز على الحركات."
+
+# Texte constant des instructions de la séquence d'apprentissage (son audio est mis en cache)
+LEARNING_INSTRUCTIONS = (
+    "مرحباً بك في جلسة تعلم النطق. "
+    "أولاً، استمع للقراءة البطيئة وركز على الحركات. "
+    "ثانياً، استمع للقراءة العادية وحاول المتابعة. "
+    "ثالثاً، استمع للقراءة السريعة لتحسين الطلاقة. "
+    "كرر هذه العملية حتى تتقن النطق الصحيح."
+)
 
 class AzurePronunciationCorrector:
     """Correcteur de prononciation utilisant Azure Speech Services"""
     
-    def __init__(self, subscription_key: str, region: str, language: str = "ar-SA"):
+    def __init__(self, subscription_key: str, region: str, language: str = "ar-SA", min_asr_confidence: float = 0.6,
+                 speech_backend: Optional[SpeechBackend] = None, batch_synthesis: bool = True,
+                 clips_from_reading: bool = True, audio_format: str = "wav",
+                 compression_level: Optional[float] = None, content_addressed: bool = True,
+                 fragment_cache: Optional[FragmentCache] = None, time_stretch_variants: bool = True,
+                 synthesizer_pool_size: int = 4, fallback_backend: Optional[SpeechBackend] = None,
+                 latency_budget: float = 3.0, min_gop_score: Optional[float] = None,
+                 reading_cache: Optional[ReadingCache] = None):
         """
         Initialise le correcteur de prononciation Azure
         
@@ -28,10 +63,32 @@ class AzurePronunciationCorrector:
             subscription_key: Clé d'abonnement Azure Speech
             region: Région Azure (ex: "eastus", "westeurope")
             language: Code de langue (ar-SA pour l'arabe saoudien)
+            min_asr_confidence: Confiance ASR minimale pour générer un audio de correction
+            speech_backend: Backend de synthèse en mémoire (Azure par défaut, FakeSpeechBackend pour les tests)
+            batch_synthesis: Synthétise tous les mots à corriger en un seul appel (signets SSML)
+            clips_from_reading: Découpe les audios de correction dans la lecture complète quand c'est possible
+            audio_format: Format des fichiers audio générés ("wav", "ogg" pour Opus, "mp3")
+            compression_level: Niveau de compression (0-1) de l'encodage local Opus/MP3
+            content_addressed: Renomme les fichiers générés avec l'empreinte de leur contenu
+                (<nom>.<empreinte>.<ext>), pour qu'ils soient servis comme immuables
+            fragment_cache: Cache PCM des phrases fixes et des mots pour assembler le feedback audio
+            time_stretch_variants: Séquence d'apprentissage: lectures lente et rapide dérivées de la lecture
+                normale par étirement temporel local, au lieu de deux synthèses supplémentaires
+            synthesizer_pool_size: Synthétiseurs Azure connectés gardés entre deux appels
+            fallback_backend: Moteur local (par ex. EspeakSpeechBackend) utilisé quand la synthèse
+                principale échoue ou dépasse latency_budget secondes
+            min_gop_score: Score acoustique (GOP, 0-1) en dessous duquel un mot correctement
+                transcrit est quand même signalé comme mal prononcé (None: désactivé)
+            reading_cache: Lectures complètes (PCM et index des mots) réutilisées d'un envoi à
+                l'autre pour un même texte vocalisé et une même voix (None: synthèse à chaque envoi)
         """
+        # Un format que libsndfile ne sait pas encoder échouerait à chaque fichier: refusé dès ici
+        check_audio_format(audio_format)
         self.subscription_key = subscription_key
         self.region = region
         self.language = language
+        self.min_asr_confidence = min_asr_confidence
+        self.min_gop_score = min_gop_score
         
         # Configuration Azure Speech
         self.speech_config = speechsdk.SpeechConfig(
@@ -45,7 +102,26 @@ class AzurePronunciationCorrector:
         self.speech_config.speech_synthesis_voice_name = "ar-SA-HamedNeural"  # Voix masculine
         # Alternative: "ar-SA-ZariyahNeural" pour voix féminine
         
-        self.synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.speech_config)
+        # Format des fichiers: toutes les synthèses rendent du PCM, encodé localement à l'écriture
+        self.audio_format = audio_format
+        self.audio_extension = AUDIO_FORMATS[audio_format]["extension"]
+        self.compression_level = compression_level
+        self.content_addressed = content_addressed
+        
+        # Synthèse groupée: un document SSML pour tous les mots, découpé localement aux signets
+        self.batch_synthesis = batch_synthesis
+        self.clips_from_reading = clips_from_reading
+        # Toutes les synthèses passent par ce backend (pool de synthétiseurs sur cette SpeechConfig)
+        self.speech_backend = speech_backend or AzureSpeechBackend(
+            subscription_key, region, language, self.speech_config.speech_synthesis_voice_name,
+            speech_config=self.speech_config, pool_size=synthesizer_pool_size
+        )
+        if fallback_backend is not None:
+            self.speech_backend = FailoverSpeechBackend(self.speech_backend, fallback_backend,
+                                                        latency_budget=latency_budget)
+        self.fragment_cache = fragment_cache or FragmentCache()
+        self.reading_cache = reading_cache
+        self.time_stretch_variants = time_stretch_variants
         
         # Dictionnaire des diacritiques arabes courantes
         self.arabic_diacritics = {
@@ -119,20 +195,33 @@ class AzurePronunciationCorrector:
         
         return similarity > 0.7, similarity
 
-    def identify_pronunciation_errors(self, original_text: str, transcribed_text: str) -> List[PronunciationError]:
+    @metrics.timed("identify_errors")
+    def identify_pronunciation_errors(self, original_text: str, transcribed_text: str,
+                                      word_confidences: Optional[List[float]] = None,
+                                      diacritized_text: Optional[str] = None) -> List[PronunciationError]:
         """
         Identifie les erreurs de prononciation en comparant le texte original et la transcription
+        
+        Args:
+            word_confidences: Confiance ASR de chaque mot transcrit (même ordre que la transcription).
+                Les erreurs sur des mots en dessous de min_asr_confidence sont marquées asr_uncertain.
+            diacritized_text: Texte original déjà vocalisé (évite de le recalculer)
         """
         errors = []
         
         # Ajouter les diacritiques au texte original
-        original_with_diacritics = self.add_diacritics_to_text(original_text)
+        original_with_diacritics = diacritized_text or self.add_diacritics_to_text(original_text)
         
         # Diviser en mots
         original_words = original_text.split()
         transcribed_words = transcribed_text.split()
         original_diac_words = original_with_diacritics.split()
         
+        # Les confiances ne sont utilisables que si elles correspondent mot à mot à la transcription
+        if word_confidences is not None and len(word_confidences) != len(transcribed_words):
+            self.logger.warning("Confiances ASR ignorées: nombre de mots différent de la transcription")
+            word_confidences = None
+        
         # Comparaison mot par mot
         max_len = max(len(original_words), len(transcribed_words))
         
@@ -160,26 +249,101 @@ class AzurePronunciationCorrector:
                 
                 if not is_similar or score < 0.8:
                     error_type = "wrong_pronunciation" if score > 0.3 else "missing_diacritics"
+                    confidence = float(word_confidences[i]) if word_confidences is not None else None
                     errors.append(PronunciationError(
                         word_original=original_word,
                         word_transcribed=transcribed_word,
                         word_with_diacritics=diac_word,
                         pronunciation_score=score,
                         error_type=error_type,
-                        position=i
+                        position=i,
+                        asr_confidence=confidence,
+                        asr_uncertain=confidence is not None and confidence < self.min_asr_confidence
                     ))
         
         return errors
 
-    def generate_audio_feedback(self, word_with_diacritics: str, output_path: str) -> bool:
-     try:
-        audio_config = speechsdk.audio.AudioOutputConfig(filename=output_path)
-        synthesizer = speechsdk.SpeechSynthesizer(
-            speech_config=self.speech_config,
-            audio_config=audio_config
-        )
+    @metrics.timed("identify_errors")
+    def identify_errors_from_alignment(self, original_text: str, reference_alignment: List[Dict],
+                                       diacritized_text: Optional[str] = None) -> List[PronunciationError]:
+        """
+        Construit les erreurs à partir de l'alignement produit par le décodage contraint
+        (mots lus / substitués / omis), sans comparaison positionnelle des chaînes
+        """
+        errors = []
+        original_words = original_text.split()
+        original_diac_words = (diacritized_text or self.add_diacritics_to_text(original_text)).split()
+        
+        for entry in reference_alignment:
+            if entry["status"] == "match":
+                continue
+            
+            i = entry["reference_index"]
+            original_word = original_words[i]
+            diac_word = original_diac_words[i] if i < len(original_diac_words) else original_word
+            confidence = entry.get("confidence")
+            
+            if entry["status"] == "omitted":
+                errors.append(PronunciationError(
+                    word_original=original_word,
+                    word_transcribed="",
+                    word_with_diacritics=diac_word,
+                    pronunciation_score=0.0,
+                    error_type="omitted_word",
+                    position=i
+                ))
+                continue
+            
+            _, score = self.compare_words(original_word, entry["word"])
+            errors.append(PronunciationError(
+                word_original=original_word,
+                word_transcribed=entry["word"],
+                word_with_diacritics=diac_word,
+                pronunciation_score=score,
+                error_type="wrong_pronunciation" if score > 0.3 else "missing_diacritics",
+                position=i,
+                asr_confidence=confidence,
+                asr_uncertain=confidence is not None and confidence < self.min_asr_confidence
+            ))
+        
+        return errors
 
+    def apply_pronunciation_scores(self, errors: List[PronunciationError], pronunciation_scores: List[Dict],
+                                   original_text: str, diacritized_text: str) -> List[PronunciationError]:
+        """
+        Remplace le score de similarité des erreurs par le score acoustique (GOP) du mot attendu
+
+        Avec min_gop_score, les mots bien transcrits mais mal notés acoustiquement sont ajoutés
+        comme erreurs de prononciation.
+        """
+        scores = {entry["reference_index"]: entry["score"] for entry in pronunciation_scores}
+        for error in errors:
+            if error.error_type != "omitted_word" and error.position in scores:
+                error.pronunciation_score = scores[error.position]
+
+        if self.min_gop_score is not None:
+            original_words = original_text.split()
+            original_diac_words = diacritized_text.split()
+            flagged = {error.position for error in errors}
+            for position, score in scores.items():
+                if position in flagged or score >= self.min_gop_score or position >= len(original_words):
+                    continue
+                errors.append(PronunciationError(
+                    word_original=original_words[position],
+                    word_transcribed=original_words[position],
+                    word_with_diacritics=(original_diac_words[position] if position < len(original_diac_words)
+                                          else original_words[position]),
+                    pronunciation_score=score,
+                    error_type="wrong_pronunciation",
+                    position=position
+                ))
+            errors.sort(key=lambda error: error.position)
+        return errors
 
+    @metrics.timed("tts_word")
+    def synthesize_word(self, word_with_diacritics: str) -> Optional[SynthesisResult]:
+     """Synthèse lente d'un mot, en mémoire (None en cas d'échec)"""
+     try:
         ssml_text = f"""
          <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{self.language}">
           <voice name="{self.speech_config.speech_synthesis_voice_name}">
@@ -190,21 +354,148 @@ class AzurePronunciationCorrector:
           </speak>
         """
 
-
-        result = synthesizer.speak_ssml_async(ssml_text).get()
-
-        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            self.logger.info(f"Audio généré avec succès: {output_path}")
-            return True
-        else:
-            self.logger.error(f"Erreur de synthèse: {result.reason}")
-            return False
+        return self.speech_backend.synthesize_ssml(ssml_text)
      except Exception as e:
         self.logger.error(f"Exception dans la synthèse: {str(e)}")
-        return False
+        return None
+
+    def generate_audio_feedback(self, word_with_diacritics: str, output_path: str) -> bool:
+        """Audio de correction d'un mot: synthèse en mémoire, puis écriture dans output_path"""
+        result = self.synthesize_word(word_with_diacritics)
+        if result is None:
+            return False
+        try:
+            write_audio(output_path, result.pcm, result.sample_rate, self.audio_format, self.compression_level)
+        except Exception as e:
+            self.logger.error(f"Encodage de {output_path} impossible: {str(e)}")
+            return False
+        if result.cacheable:
+            self.fragment_cache.put(word_with_diacritics, self.speech_config.speech_synthesis_voice_name, "slow",
+                                    result.pcm)
+        self.logger.info(f"Audio généré avec succès: {output_path}")
+        return True
+
+
+    @metrics.timed("tts_batch")
+    def generate_audio_feedback_batch(self, words: List[str], output_paths: List[str]) -> List[str]:
+        """
+        Génère les audios de correction de plusieurs mots en un seul appel de synthèse
+        
+        Les mots sont placés dans un document SSML entre des signets, puis l'audio PCM est
+        découpé localement aux positions des signets (ou des limites de mots).
+        
+        Returns:
+            List[str]: Chemins des fichiers générés (vide si la synthèse a échoué; un extrait
+                impossible à encoder est seulement omis)
+        """
+        try:
+            ssml = words_ssml(words, self.language, self.speech_config.speech_synthesis_voice_name)
+            result = self.speech_backend.synthesize_ssml(ssml)
+            spans = word_spans(result, len(words))
+            if spans is None:
+                self.logger.error("Synthèse groupée: signets et limites de mots introuvables")
+                return []
+            
+            voice_name = self.speech_config.speech_synthesis_voice_name
+            written = []
+            for word, (start, end), output_path in zip(words, spans, output_paths):
+                if result.cacheable:
+                    self.fragment_cache.put(word, voice_name, "slow", result.slice(start, end))
+                try:
+                    write_audio(output_path, result.slice(start, end), result.sample_rate,
+                                self.audio_format, self.compression_level)
+                    written.append(output_path)
+                except Exception as e:
+                    self.logger.error(f"Encodage de {output_path} impossible: {str(e)}")
+            self.logger.info(f"{len(written)} audios de correction générés en un appel")
+            return written
+        except Exception as e:
+            self.logger.error(f"Exception dans la synthèse groupée: {str(e)}")
+            return []
+
+    def clips_from_cache(self, words: List[str], output_paths: List[str]) -> List[str]:
+        """
+        Audios de correction déjà synthétisés (débit lent) pris dans le cache de fragments,
+        par exemple préchargés par le prefetcher
+
+        Returns:
+            List[str]: Chemins des fichiers écrits (les mots absents du cache sont ignorés)
+        """
+        voice_name = self.speech_config.speech_synthesis_voice_name
+        written = []
+        for word, output_path in zip(words, output_paths):
+            pcm = self.fragment_cache.get(word, voice_name, "slow")
+            metrics.cache_lookup("tts_clip", pcm is not None)
+            if pcm is None:
+                continue
+            try:
+                write_audio(output_path, pcm, audio_format=self.audio_format, compression_level=self.compression_level)
+                written.append(output_path)
+            except Exception as e:
+                self.logger.error(f"Encodage de {output_path} impossible: {str(e)}")
+        return written
+
+    @metrics.timed("clips_from_reading")
+    def cut_word_clips(self, reading_path: str, clips: List[Tuple[int, str, str]], margin: float = 0.05) -> List[str]:
+        """
+        Découpe des audios de correction dans une lecture complète déjà synthétisée
+        
+        Args:
+            reading_path: Source de la lecture complète rendue par generate_corrected_text_audio
+                (avec son index .words.json)
+            clips: (position du mot dans le texte, mot vocalisé attendu, chemin de sortie)
+            margin: Marge ajoutée avant et après chaque mot (secondes)
+        
+        Returns:
+            List[str]: Chemins des extraits écrits (les mots absents de l'index sont ignorés)
+        """
+        index = load_word_index(reading_path)
+        if not index:
+            return []
+        try:
+            pcm, sample_rate = load_reading_pcm(reading_path)
+        except Exception as e:
+            self.logger.error(f"Lecture complète illisible: {str(e)}")
+            return []
+        
+        generated = []
+        for position, word, output_path in clips:
+            entry = index.get(position)
+            if entry is None or word_key(entry["text"]) != word_key(word):
+                continue
+            start = max(0, int((entry["offset"] - margin) * sample_rate))
+            end = min(len(pcm), int((entry["offset"] + entry["duration"] + margin) * sample_rate))
+            # Même débit que le feedback: l'extrait resservira pour l'assembler sans synthèse
+            self.fragment_cache.put(word, self.speech_config.speech_synthesis_voice_name, "medium", pcm[start:end])
+            try:
+                # Vue sur le fichier projeté en mémoire: seul l'extrait est lu puis écrit
+                write_audio(output_path, pcm[start:end], sample_rate, self.audio_format, self.compression_level)
+                generated.append(output_path)
+            except Exception as e:
+                self.logger.error(f"Encodage de {output_path} impossible: {str(e)}")
+        return generated
 
+    @metrics.timed("tts_full_text")
+    def synthesize_reading(self, corrected_text: str, speed: str = "medium") -> Optional[SynthesisResult]:
+        """Lecture complète d'un texte vocalisé, en mémoire (None en cas d'échec)"""
+        # Créer le texte SSML pour une meilleure prononciation avec pauses
+        ssml_text = f"""
+        <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{self.language}">
+            <voice name="{self.speech_config.speech_synthesis_voice_name}">
+                <prosody rate="{speed}" pitch="medium" volume="loud">
+                    {corrected_text}
+                </prosody>
+            </voice>
+        </speak>
+        """
+        try:
+            return self.speech_backend.synthesize_ssml(ssml_text)
+        except Exception as e:
+            self.logger.error(f"Erreur lors de la synthèse de la lecture complète: {str(e)}")
+            return None
 
-    def generate_corrected_text_audio(self, original_text: str, output_path: str, speed: str = "medium") -> bool:
+    def generate_corrected_text_audio(self, original_text: str, output_path: str, speed: str = "medium",
+                                      diacritized_text: Optional[str] = None) -> Optional[str]:
         """
         Génère un fichier audio avec la lecture complète du texte corrigé
         
@@ -212,73 +503,106 @@ class AzurePronunciationCorrector:
             original_text: Le texte original à corriger et lire
             output_path: Chemin du fichier audio de sortie
             speed: Vitesse de lecture ("slow", "medium", "fast")
+            diacritized_text: Texte déjà vocalisé (évite de le recalculer)
         
         Returns:
-            bool: True si la génération a réussi, False sinon
+            Optional[str]: Source PCM à découper (avec son index .words.json): l'entrée du cache
+                des lectures, ou le fichier écrit et ses fichiers voisins; None en cas d'échec
         """
         try:
             # Ajouter les diacritiques au texte complet
-            corrected_text = self.add_diacritics_to_text(original_text)
+            corrected_text = diacritized_text or self.add_diacritics_to_text(original_text)
+            voice_name = self.speech_config.speech_synthesis_voice_name
             
-            # Configuration pour sauvegarder dans un fichier
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=output_path)
-            synthesizer = speechsdk.SpeechSynthesizer(
-                speech_config=self.speech_config, 
-                audio_config=audio_config
-            )
+            # Même texte vocalisé et même voix qu'un envoi précédent: pas de nouvelle synthèse
+            if self.reading_cache is not None:
+                source = self.reading_cache.get(corrected_text, voice_name, speed)
+                metrics.cache_lookup("tts_reading", source is not None)
+                if source is not None:
+                    try:
+                        pcm, sample_rate = load_reading_pcm(source)
+                        write_audio(output_path, pcm, sample_rate, self.audio_format, self.compression_level)
+                        return source
+                    except Exception as e:
+                        # Entrée évincée entre-temps ou illisible: nouvelle synthèse
+                        self.logger.error(f"Lecture en cache illisible: {str(e)}")
             
-            # Créer le texte SSML pour une meilleure prononciation avec pauses
-            ssml_text = f"""
-            <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{self.language}">
-                <voice name="{self.speech_config.speech_synthesis_voice_name}">
-                    <prosody rate="{speed}" pitch="medium" volume="loud">
-                        {corrected_text}
-                    </prosody>
-                </voice>
-            </speak>
-            """
-            
-            
-            # Synthétiser la parole
-            result = synthesizer.speak_ssml_async(ssml_text).get()
+            # Synthétiser la parole en mémoire, avec les limites de mots
+            result = self.synthesize_reading(corrected_text, speed)
+            if result is None:
+                return None
+            write_audio(output_path, result.pcm, result.sample_rate, self.audio_format, self.compression_level)
             
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                self.logger.info(f"Audio de lecture complète généré avec succès: {output_path}")
-                return True
-            else:
-                self.logger.error(f"Erreur lors de la génération de l'audio complet: {result.reason}")
-                return False
+            # Index des mots (position dans le texte -> offset), pour découper les corrections ensuite;
+            # vide pour une lecture du moteur de secours, dont les extraits ne doivent pas entrer en cache
+            index = word_index(corrected_text.split(), result.word_boundaries) if result.cacheable else []
+            if self.reading_cache is not None and index:
+                try:
+                    return self.reading_cache.put(corrected_text, voice_name, speed, result.pcm, index,
+                                                  result.sample_rate)
+                except OSError as e:
+                    self.logger.error(f"Lecture non gardée en cache: {str(e)}")
+            save_reading_pcm(output_path, result.pcm)
+            save_word_index(output_path, index, result.sample_rate)
+            self.logger.info(f"Audio de lecture complète généré avec succès: {output_path}")
+            return output_path
                 
         except Exception as e:
             self.logger.error(f"Erreur lors de la génération de l'audio complet: {str(e)}")
-            return False
+            return None
+
+    @staticmethod
+    def feedback_segments(errors: List[PronunciationError]) -> List[Tuple[str, int]]:
+        """
+        Fragments du feedback audio (phrase fixe ou mot) et pause en ms après chacun
+        """
+        if not errors:
+            return [(FEEDBACK_NO_ERRORS, 0)]
+        segments = [(FEEDBACK_INTRO, 300)]
+        for error in errors[:5]:  # Limiter à 5 erreurs pour éviter un audio trop long
+            if error.error_type == "omitted_word":
+                segments += [(FEEDBACK_OMITTED, 100), (error.word_with_diacritics, 400)]
+            elif error.error_type == "wrong_pronunciation":
+                segments += [(FEEDBACK_CORRECT_PRONUNCIATION, 100), (error.word_original, 100),
+                             (FEEDBACK_IS, 100), (error.word_with_diacritics, 400)]
+            else:
+                segments += [(FEEDBACK_DIACRITICS, 100), (error.word_with_diacritics, 400)]
+        segments.append((FEEDBACK_CLOSING, 0))
+        return segments
 
+    @metrics.timed("feedback_audio")
     def generate_comprehensive_feedback_audio(self, errors: List[PronunciationError], output_path: str) -> bool:
         """
         Génère un feedback audio complet pour toutes les corrections
+
+        Le message est assemblé à partir de fragments PCM en cache (phrases fixes, extraits des mots):
+        seuls les fragments encore inconnus sont synthétisés, en un appel. Si cette synthèse échoue,
+        le message complet est synthétisé d'un bloc.
         """
+        segments = self.feedback_segments(errors)
         try:
-            if not errors:
-                feedback_text = "أحسنت! لا توجد أخطاء في النطق. استمر في التدريب."
-            else:
-                feedback_text = "الأخطاء في النطق هي: "
-                
-                for error in errors[:5]:  # Limiter à 5 erreurs pour éviter un audio trop long
-                    if error.error_type == "omitted_word":
-                        feedback_text += f"كلمة مفقودة: {error.word_with_diacritics}. "
-                    elif error.error_type == "wrong_pronunciation":
-                        feedback_text += f"النطق الصحيح لكلمة {error.word_original} هو {error.word_with_diacritics}. "
-                    else:
-                        feedback_text += f"انتبه للحركات في كلمة {error.word_with_diacritics}. "
-                
-                feedback_text += "حاول مرة أخرى مع التركيز على الحركات."
-            
-            # Configuration pour sauvegarder dans un fichier
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=output_path)
-            synthesizer = speechsdk.SpeechSynthesizer(
-                speech_config=self.speech_config, 
-                audio_config=audio_config
+            fragments = self.fragment_cache.fetch(
+                [text for text, _ in segments], self.speech_backend, self.language,
+                self.speech_config.speech_synthesis_voice_name
             )
+        except Exception as e:
+            self.logger.error(f"Erreur lors de la synthèse des fragments du feedback: {str(e)}")
+            fragments = None
+        if fragments is None:
+            return self._synthesize_feedback_text(segments, output_path)
+        try:
+            pcm = assemble([fragments[text] for text, _ in segments], [pause for _, pause in segments])
+            write_audio(output_path, pcm, audio_format=self.audio_format, compression_level=self.compression_level)
+            return True
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'écriture du feedback audio: {str(e)}")
+            return False
+
+    @metrics.timed("tts_feedback")
+    def _synthesize_feedback_text(self, segments: List[Tuple[str, int]], output_path: str) -> bool:
+        """Synthèse du message de feedback complet en un seul texte"""
+        try:
+            feedback_text = " ".join(text + ("." if pause >= 400 else "") for text, pause in segments)
             
             # Créer le texte SSML pour le feedback
             ssml_text = f"""
@@ -291,18 +615,33 @@ class AzurePronunciationCorrector:
             </speak>
             """
             
-            result = synthesizer.speak_ssml_async(ssml_text).get()
-            
-            return result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted
+            result = self.speech_backend.synthesize_ssml(ssml_text)
+            write_audio(output_path, result.pcm, result.sample_rate, self.audio_format, self.compression_level)
+            return True
             
         except Exception as e:
             self.logger.error(f"Erreur lors de la génération du feedback audio: {str(e)}")
             return False
 
-    def correct_pronunciation(self, original_text: str, transcribed_text: str, audio_output_dir: str = "audio_corrections") -> Dict:
+    @metrics.timed("correct_pronunciation")
+    def correct_pronunciation(self, original_text: str, transcribed_text: str, audio_output_dir: str = "audio_corrections",
+                              word_confidences: Optional[List[float]] = None,
+                              reference_alignment: Optional[List[Dict]] = None,
+                              pronunciation_scores: Optional[List[Dict]] = None,
+                              diacritized_text: Optional[str] = None, synthesize: bool = True) -> Dict:
         """
         Fonction principale pour corriger la prononciation
         
+        Args:
+            word_confidences: Confiance ASR par mot transcrit; aucune synthèse n'est faite
+                pour les mots où l'ASR n'était pas sûr
+            reference_alignment: Alignement du décodage contraint par le texte; s'il est fourni,
+                il remplace la comparaison mot à mot de la transcription
+            pronunciation_scores: Scores GOP par mot attendu (étape ASR); ils deviennent le
+                pronunciation_score des erreurs
+            diacritized_text: Texte original déjà vocalisé (par ex. depuis le cache des textes)
+            synthesize: Si False, seules les erreurs sont calculées (aucun appel de synthèse vocale)
+        
         Returns:
             Dict contenant les erreurs identifiées et les chemins vers les fichiers audio de correction
         """
@@ -310,33 +649,100 @@ class AzurePronunciationCorrector:
         os.makedirs(audio_output_dir, exist_ok=True)
         
         # Identifier les erreurs
-        errors = self.identify_pronunciation_errors(original_text, transcribed_text)
+        diacritized_text = diacritized_text or self.add_diacritics_to_text(original_text)
+        if reference_alignment:
+            errors = self.identify_errors_from_alignment(original_text, reference_alignment, diacritized_text)
+        else:
+            errors = self.identify_pronunciation_errors(original_text, transcribed_text, word_confidences,
+                                                        diacritized_text)
+        if pronunciation_scores:
+            errors = self.apply_pronunciation_scores(errors, pronunciation_scores, original_text, diacritized_text)
         
         correction_results = {
             "total_errors": len(errors),
             "errors": [],
             "audio_files": [],
-            "corrected_text": self.add_diacritics_to_text(original_text),
+            "corrected_text": diacritized_text,
             "corrected_text_audio": None,
             "feedback_audio": None,
             "summary": {
                 "omitted_word": 0,
                 "wrong_pronunciation": 0,
                 "missing_diacritics": 0
-            }
+            },
+            "skipped_low_confidence": 0
         }
         
-        # Traiter chaque erreur
+        # Audios de correction à générer (sauf si l'erreur vient probablement du bruit ASR).
+        # Chaque fichier est écrit sous un nom temporaire unique à cette exécution, puis renommé
+        # d'après son contenu: deux envois simultanés ne renomment jamais le même fichier
+        pending = []
+        final_names = {}
         for i, error in enumerate(errors):
             # Nom du fichier audio pour cette correction
-            audio_filename = f"correction_{i+1}_{error.word_original.replace(' ', '_')}.wav"
-            audio_path = os.path.join(audio_output_dir, audio_filename)
-            
-            # Générer l'audio de correction
-            if self.generate_audio_feedback(error.word_with_diacritics, audio_path):
-                error.audio_feedback_path = audio_path
-                correction_results["audio_files"].append(audio_path)
-            
+            audio_filename = f"correction_{i+1}_{error.word_original.replace(' ', '_')}.{self.audio_extension}"
+            audio_path = temp_path(os.path.join(audio_output_dir, audio_filename))
+            final_names[audio_path] = os.path.join(audio_output_dir, audio_filename)
+            if error.asr_uncertain:
+                correction_results["skipped_low_confidence"] += 1
+            elif synthesize:
+                pending.append((error, audio_path))
+        
+        # Générer d'abord l'audio de lecture complète corrigée: les mots à corriger y sont déjà prononcés.
+        # Nom unique par exécution: un autre envoi ne peut ni réécrire ni supprimer le fichier
+        # projeté en mémoire, son index ou sa copie PCM pendant le découpage
+        reading_name = os.path.join(audio_output_dir, f"corrected_reading_complete.{self.audio_extension}")
+        corrected_text_audio_path = temp_path(reading_name)
+        reading_source = None
+        if synthesize:
+            reading_source = self.generate_corrected_text_audio(original_text, corrected_text_audio_path,
+                                                                diacritized_text=diacritized_text)
+        if reading_source:
+            correction_results["corrected_text_audio"] = corrected_text_audio_path
+            self.logger.info(f"Audio de lecture complète généré: {corrected_text_audio_path}")
+        
+        generated = set()
+        if pending and self.clips_from_reading and correction_results["corrected_text_audio"]:
+            generated = set(self.cut_word_clips(
+                reading_source,
+                [(error.position, error.word_with_diacritics, audio_path) for error, audio_path in pending]
+            ))
+        # Les extraits sont découpés: l'index et la copie PCM d'une lecture compressée ne servent plus
+        remove_word_index(corrected_text_audio_path)
+        remove_reading_pcm(corrected_text_audio_path)
+        
+        # Puis le cache des audios de correction déjà synthétisés
+        remaining = [(error, audio_path) for error, audio_path in pending if audio_path not in generated]
+        if remaining:
+            generated |= set(self.clips_from_cache([error.word_with_diacritics for error, _ in remaining],
+                                                   [audio_path for _, audio_path in remaining]))
+        
+        # Synthèse seulement pour les mots introuvables dans la lecture complète et dans le cache
+        remaining = [(error, audio_path) for error, audio_path in pending if audio_path not in generated]
+        batch_generated = set()
+        if self.batch_synthesis and len(remaining) > 1:
+            batch_generated = set(self.generate_audio_feedback_batch(
+                [error.word_with_diacritics for error, _ in remaining],
+                [audio_path for _, audio_path in remaining]
+            ))
+        # Un mot, synthèse groupée désactivée ou en échec: un appel par mot restant
+        batch_generated |= {
+            audio_path for error, audio_path in remaining
+            if audio_path not in batch_generated and self.generate_audio_feedback(error.word_with_diacritics, audio_path)
+        }
+        generated |= batch_generated
+        for error, audio_path in pending:
+            if audio_path in generated:
+                error.audio_feedback_path = self._final_path(audio_path, final_names[audio_path])
+                correction_results["audio_files"].append(error.audio_feedback_path)
+        # Renommée seulement maintenant: les extraits ont été découpés à partir de son nom temporaire
+        if correction_results["corrected_text_audio"]:
+            correction_results["corrected_text_audio"] = self._final_path(corrected_text_audio_path, reading_name)
+        # Fichiers temporaires d'écritures en échec (encodage interrompu)
+        self._discard([corrected_text_audio_path] + [audio_path for _, audio_path in pending])
+        
+        # Traiter chaque erreur
+        for error in errors:
             # Ajouter l'erreur aux résultats
             correction_results["errors"].append({
                 "position": error.position,
@@ -345,29 +751,53 @@ class AzurePronunciationCorrector:
                 "correct_pronunciation": error.word_with_diacritics,
                 "pronunciation_score": error.pronunciation_score,
                 "error_type": error.error_type,
-                "audio_file": error.audio_feedback_path
+                "audio_file": error.audio_feedback_path,
+                "asr_confidence": error.asr_confidence,
+                "asr_uncertain": error.asr_uncertain
             })
             
             # Mettre à jour le résumé
             correction_results["summary"][error.error_type] += 1
         
-        # Générer l'audio de lecture complète corrigée
-        corrected_text_audio_path = os.path.join(audio_output_dir, "corrected_reading_complete.wav")
-        if self.generate_corrected_text_audio(original_text, corrected_text_audio_path):
-            correction_results["corrected_text_audio"] = corrected_text_audio_path
-            self.logger.info(f"Audio de lecture complète généré: {corrected_text_audio_path}")
+        if not synthesize:
+            return correction_results
         
         # Générer le feedback audio général
-        feedback_audio_path = os.path.join(audio_output_dir, "pronunciation_feedback.wav")
-        if self.generate_comprehensive_feedback_audio(errors, feedback_audio_path):
-            correction_results["feedback_audio"] = feedback_audio_path
-            self.logger.info(f"Feedback audio généré: {feedback_audio_path}")
+        feedback_name = os.path.join(audio_output_dir, f"pronunciation_feedback.{self.audio_extension}")
+        feedback_audio_path = temp_path(feedback_name)
+        confident_errors = [error for error in errors if not error.asr_uncertain]
+        if self.generate_comprehensive_feedback_audio(confident_errors, feedback_audio_path):
+            correction_results["feedback_audio"] = self._final_path(feedback_audio_path, feedback_name)
+            self.logger.info(f"Feedback audio généré: {correction_results['feedback_audio']}")
+        self._discard([feedback_audio_path])
         
         return correction_results
 
+    def _final_path(self, path: str, name: str) -> str:
+        """
+        Chemin définitif d'un fichier écrit sous un nom temporaire (temp_path) de name: adressé
+        par son contenu si activé, name sinon
+        """
+        if self.content_addressed:
+            return content_address(path, name)
+        os.replace(path, name)
+        return name
+
+    @staticmethod
+    def _discard(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
     def generate_learning_sequence_audio(self, original_text: str, output_dir: str = "learning_sequence") -> Dict:
         """
         Génère une séquence d'apprentissage complète avec différentes vitesses de lecture
+
+        Avec time_stretch_variants, le texte n'est synthétisé qu'une fois (vitesse normale); les
+        lectures lente et rapide en sont dérivées par étirement temporel, qui garde la hauteur de
+        la voix. Les instructions, constantes, viennent du cache de fragments.
         
         Returns:
             Dict contenant les chemins vers les différents fichiers audio générés
@@ -375,47 +805,58 @@ class AzurePronunciationCorrector:
         os.makedirs(output_dir, exist_ok=True)
         
         sequence_files = {}
-        
-        # 1. Lecture très lente pour l'apprentissage
-        slow_path = os.path.join(output_dir, "01_lecture_lente.wav")
-        if self.generate_corrected_text_audio(original_text, slow_path, "slow"):
-            sequence_files["slow_reading"] = slow_path
-        
-        # 2. Lecture normale
-        normal_path = os.path.join(output_dir, "02_lecture_normale.wav")
-        if self.generate_corrected_text_audio(original_text, normal_path, "medium"):
-            sequence_files["normal_reading"] = normal_path
-        
-        # 3. Lecture rapide pour la fluidité
-        fast_path = os.path.join(output_dir, "03_lecture_rapide.wav")
-        if self.generate_corrected_text_audio(original_text, fast_path, "fast"):
-            sequence_files["fast_reading"] = fast_path
+        corrected_text = self.add_diacritics_to_text(original_text)
+        readings = [
+            ("slow_reading", "slow", "01_lecture_lente"),      # Lecture très lente pour l'apprentissage
+            ("normal_reading", "medium", "02_lecture_normale"),  # Lecture normale
+            ("fast_reading", "fast", "03_lecture_rapide")       # Lecture rapide pour la fluidité
+        ]
+        
+        normal = self.synthesize_reading(corrected_text, "medium") if self.time_stretch_variants else None
+        for key, speed, name in readings:
+            path = os.path.join(output_dir, f"{name}.{self.audio_extension}")
+            if normal is not None and self._write_stretched(normal, speed, path):
+                sequence_files[key] = path
+            elif self.generate_corrected_text_audio(original_text, path, speed, diacritized_text=corrected_text):
+                # Mode prosodie Azure, ou étirement impossible
+                remove_reading_pcm(path)
+                sequence_files[key] = path
         
         # 4. Instructions d'apprentissage
-        instructions_path = os.path.join(output_dir, "00_instructions.wav")
-        instructions_text = """
-        مرحباً بك في جلسة تعلم النطق. 
-        أولاً، استمع للقراءة البطيئة وركز على الحركات.
-        ثانياً، استمع للقراءة العادية وحاول المتابعة.
-        ثالثاً، استمع للقراءة السريعة لتحسين الطلاقة.
-        كرر هذه العملية حتى تتقن النطق الصحيح.
-        """
+        instructions_path = os.path.join(output_dir, f"00_instructions.{self.audio_extension}")
+        if self.generate_instructions_audio(instructions_path):
+            sequence_files["instructions"] = instructions_path
         
+        return sequence_files
+
+    def _write_stretched(self, reading: SynthesisResult, speed: str, output_path: str) -> bool:
+        """Écrit la lecture normale étirée au débit de la prosodie speed"""
         try:
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=instructions_path)
-            synthesizer = speechsdk.SpeechSynthesizer(
-                speech_config=self.speech_config, 
-                audio_config=audio_config
-            )
-            
-            result = synthesizer.speak_text_async(instructions_text).get()
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                sequence_files["instructions"] = instructions_path
-                
+            rate = PROSODY_RATES[speed]
+            with metrics.span("time_stretch"):
+                pcm = reading.pcm if rate == 1.0 else time_stretch(reading.pcm, rate)
+            write_audio(output_path, pcm, reading.sample_rate, self.audio_format, self.compression_level)
+            return True
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'étirement temporel ({speed}): {str(e)}")
+            return False
+
+    def generate_instructions_audio(self, output_path: str) -> bool:
+        """
+        Instructions de la séquence d'apprentissage: synthétisées une seule fois puis servies
+        depuis le cache de fragments (persistant si le cache a un dossier)
+        """
+        try:
+            fragments = self.fragment_cache.fetch([LEARNING_INSTRUCTIONS], self.speech_backend, self.language,
+                                                  self.speech_config.speech_synthesis_voice_name)
+            if fragments is None:
+                return False
+            write_audio(output_path, fragments[LEARNING_INSTRUCTIONS], audio_format=self.audio_format,
+                        compression_level=self.compression_level)
+            return True
         except Exception as e:
             self.logger.error(f"Erreur lors de la génération des instructions: {str(e)}")
-        
-        return sequence_files
+            return False
 
 # Exemple d'utilisation
 if __name__ == "__main__":
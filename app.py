@@ -1,6 +1,5 @@
-from flask import Flask, request, jsonify, render_template ,send_from_directory
+from flask import Flask, request, jsonify, render_template
 from werkzeug.utils import secure_filename
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_cors import CORS
 import os
@@ -9,6 +8,18 @@ import numpy as np
 from audio_processor import ArabicAudioProcessor
 from evaluator import ArabicReadingEvaluator
 from AzurePronunciationCorrector import AzurePronunciationCorrector, PronunciationError  # NEW: Import AzurePronunciationCorrector
+from model_executor import ModelExecutor, ExecutorBusyError
+from audio_pipeline import AudioPipeline
+from models import db, Recorder, Texte, CorrectionRun, WordError
+import progress_analytics
+import metrics
+import profiling
+from sqlalchemy.orm import joinedload
+from texte_cache import TexteCache
+from audio_files import send_audio
+from fragment_cache import FragmentCache, ReadingCache
+from tts_prefetcher import TTSPrefetcher
+from speech_synthesis import EspeakSpeechBackend
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'wav', 'ogg', 'mp3', 'm4a'}
@@ -18,25 +29,96 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['AUDIO_CORRECTIONS_FOLDER'] = AUDIO_CORRECTIONS_FOLDER
 CORS(app, origins=["http://localhost:3000"])
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost:3306/agentiai'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'mysql+pymysql://root:@localhost:3306/agentiai')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('mysql'):
+    # Reuse connections across requests; pre-ping and recycle survive MySQL's wait_timeout
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+# Align the CTC output on the expected Texte instead of open-vocabulary greedy decoding
+app.config['REFERENCE_DECODING'] = os.getenv('REFERENCE_DECODING', 'false').lower() == 'true'
+# Acoustic goodness-of-pronunciation scores of the expected Texte, from the same CTC posteriors
+app.config['GOP_SCORING'] = os.getenv('GOP_SCORING', 'true').lower() == 'true'
 
 # Create upload and audio corrections folders
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(AUDIO_CORRECTIONS_FOLDER, exist_ok=True)  # NEW: Create audio corrections folder
 
-db = SQLAlchemy(app)
-processor = ArabicAudioProcessor()
+db.init_app(app)
+metrics.init_app(app)
+# Opt-in call-tree capture (X-Profile: 1 header, or sampled requests slower than PROFILE_SLOW_MS)
+profiling.init_app(
+    app,
+    endpoints={
+        'upload_and_transcribe', 'upload_and_transcribee', 'retry_transcription',
+        'evaluer_lecture_diacritisee_endpoint', 'evaluate_reading_endpoint', 'test_evaluate_reading',
+        'evaluate_reading_quick', 'recompute_corrections'
+    },
+    store=profiling.ProfileStore('profiles', max_profiles=int(os.getenv('PROFILE_MAX_FILES', 50))),
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0.0)),
+    slow_ms=float(os.getenv('PROFILE_SLOW_MS', 5000)),
+    enabled=os.getenv('PROFILING_ENABLED', 'false').lower() == 'true',
+    admin_token=os.getenv('PROFILE_ADMIN_TOKEN')
+)
+
+# Decode, quality analysis and text alignment in a process pool (0 = in the request thread).
+# Created before the model is loaded: the workers are forked from a small, single-threaded process.
+AUDIO_PIPELINE_WORKERS = int(os.getenv('AUDIO_PIPELINE_WORKERS', 0))
+audio_pipeline = AudioPipeline(workers=AUDIO_PIPELINE_WORKERS) if AUDIO_PIPELINE_WORKERS > 0 else None
+
+# Bounded ASR inference: N slots with pinned torch threads, 503 beyond the queue limit
+model_executor = ModelExecutor(
+    slots=int(os.getenv('ASR_INFERENCE_SLOTS', 0)) or None,
+    threads_per_slot=int(os.getenv('ASR_THREADS_PER_SLOT', 0)) or None,
+    max_queue_depth=int(os.getenv('ASR_MAX_QUEUE_DEPTH', 8)),
+    retry_after=int(os.getenv('ASR_RETRY_AFTER', 5))
+)
+processor = ArabicAudioProcessor(executor=model_executor, pipeline=audio_pipeline,
+                                 reference_decoding=app.config['REFERENCE_DECODING'],
+                                 gop_scoring=app.config['GOP_SCORING'],
+                                 # LRU bound of transcription_cache/ (0 = unbounded)
+                                 cache_max_bytes=int(os.getenv('TRANSCRIPTION_CACHE_MAX_MB', 2048)) * 1024 * 1024 or None)
 
 # NEW: Initialize AzurePronunciationCorrector
 try:
     AZURE_SPEECH_KEY = "F2d84URhnc9EhA8UG2QCbAAEWzGIeVnbgmQpyWC21OlXytPzbPxYJQQJ99BEACYeBjFXJ3w3AAAYACOGbTan"
     # AZURE_SPEECH_KEY =os.getenv('AZURE_SPEECH_KEY', 'your-azure-speech-key-here')  # Replace with actual key or use env var
     AZURE_REGION = os.getenv('AZURE_REGION', 'eastus')  # Replace with actual region or use env var
+    # TTS_ENGINE=espeak synthesizes everything locally; otherwise Azure, failing over to espeak-ng
+    # (when installed) past TTS_LATENCY_BUDGET seconds or on errors
+    TTS_ENGINE = os.getenv('TTS_ENGINE', 'azure').lower()
+    local_tts = EspeakSpeechBackend() if EspeakSpeechBackend.available() else None
+    if TTS_ENGINE == 'espeak' and local_tts is None:
+        print("⚠️ TTS_ENGINE=espeak but espeak-ng is not installed, using Azure")
     pronunciation_corrector = AzurePronunciationCorrector(
         subscription_key=AZURE_SPEECH_KEY,
         region=AZURE_REGION,
-        language='ar-SA'
+        language='ar-SA',
+        # One SSML document (with bookmarks) for all correction words instead of one call per word
+        batch_synthesis=os.getenv('TTS_BATCH_SYNTHESIS', 'true').lower() == 'true',
+        # Cut correction clips out of the full-reading audio instead of synthesizing them again
+        clips_from_reading=os.getenv('TTS_CLIPS_FROM_READING', 'true').lower() == 'true',
+        # Format of the generated audio files: wav, ogg (Opus) or mp3
+        audio_format=os.getenv('AUDIO_OUTPUT_FORMAT', 'wav').lower(),
+        # PCM of the fixed feedback phrases and of already spoken words, kept across restarts
+        fragment_cache=FragmentCache(os.getenv('TTS_FRAGMENT_CACHE_DIR', 'tts_fragments')),
+        # Full readings (PCM + word index) by diacritized text and voice, reused across uploads
+        reading_cache=ReadingCache(os.getenv('TTS_READING_CACHE_DIR', 'tts_readings'),
+                                   max_entries=int(os.getenv('TTS_READING_CACHE_MAX_ENTRIES', 256))),
+        # Learning sequence: slow/fast readings time-stretched locally from the normal one
+        time_stretch_variants=os.getenv('LEARNING_SEQUENCE_TIME_STRETCH', 'true').lower() == 'true',
+        # Connected Azure synthesizers kept between calls
+        synthesizer_pool_size=int(os.getenv('TTS_SYNTHESIZER_POOL_SIZE', '4')),
+        speech_backend=local_tts if TTS_ENGINE == 'espeak' else None,
+        fallback_backend=local_tts if TTS_ENGINE != 'espeak' and os.getenv('TTS_FALLBACK', 'true').lower() == 'true' else None,
+        latency_budget=float(os.getenv('TTS_LATENCY_BUDGET', 3.0)),
+        # Words transcribed correctly but with an acoustic score below this are reported too (empty = off)
+        min_gop_score=float(os.getenv('GOP_MIN_SCORE')) if os.getenv('GOP_MIN_SCORE') else None
     )
     print("✅ Azure Pronunciation Corrector initialized successfully")
 except Exception as e:
@@ -56,25 +138,29 @@ except Exception as e:
     reading_evaluator = None
     print(f"❌ Failed to initialize reading evaluator: {e}")
 
-# Updated Recorder model to store pronunciation correction results
-class Recorder(db.Model):
-    __tablename__ = 'recorder'
-    id = db.Column(db.Integer, primary_key=True)
-    id_eleve = db.Column(db.Integer, nullable=False)
-    idTexte = db.Column(db.Integer, nullable=False)
-    file_path = db.Column(db.String(255), nullable=False)
-    transcription = db.Column(db.Text, nullable=True)
-    pronunciation_corrections = db.Column(db.Text, nullable=True)  # NEW: Store JSON of pronunciation corrections
-    date_enregistrement = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Texte(db.Model):
-    __tablename__ = 'texte'
-    idTexte = db.Column(db.Integer, primary_key=True)
-    texteContent = db.Column(db.Text, nullable=False)
+# Reading texts and their diacritized/normalized forms, served from memory
+texte_cache = TexteCache(
+    diacritizer=pronunciation_corrector.add_diacritics_to_text if pronunciation_corrector else None,
+    normalizer=reading_evaluator.normalize_arabic_text if reading_evaluator else None,
+    revalidate_after=float(os.getenv('TEXTE_CACHE_REVALIDATE', 60))
+)
+texte_cache.listen(Texte)
 
 with app.app_context():
     db.create_all()
 
+# Off-peak pre-synthesis of each text's most misread words into the TTS fragment cache
+tts_prefetcher = None
+if pronunciation_corrector:
+    tts_prefetcher = TTSPrefetcher(
+        app, pronunciation_corrector, texte_cache,
+        top_n=int(os.getenv('TTS_PREFETCH_TOP_N', 20)),
+        calls_per_minute=float(os.getenv('TTS_PREFETCH_CALLS_PER_MINUTE', 6)),
+        off_peak_hours=os.getenv('TTS_PREFETCH_HOURS', '0-6')
+    )
+    if os.getenv('TTS_PREFETCH_ENABLED', 'false').lower() == 'true':
+        tts_prefetcher.start()
+
     
 
 def allowed_file(filename):
@@ -95,6 +181,115 @@ def convert_numpy_types(obj):
     else:
         return obj
 
+def save_corrections(record, corrections, original_text, audio_pending=False):
+    """
+    Persist a correct_pronunciation() result; it is folded into the progress aggregates
+    after the commit (progress_analytics.commit_with_progress)
+
+    audio_pending marks a run scored without TTS (synthesize=False): the read endpoints
+    recompute it with audio the first time it is served.
+    """
+    run = CorrectionRun.from_corrections(record, corrections)
+    run.audio_pending = audio_pending
+    db.session.add(run)
+    progress_analytics.queue_progress(record, run, original_text)
+    return run
+
+def latest_correction_run(record_id):
+    return (CorrectionRun.query
+            .filter_by(record_id=record_id)
+            .order_by(CorrectionRun.id.desc())
+            .first())
+
+def current_corrections(record):
+    """Stored corrections for the record's current transcription, or None if they must be computed"""
+    run = (CorrectionRun.query
+           .options(joinedload(CorrectionRun.errors))
+           .filter_by(record_id=record.id, transcription_version=record.transcription_version or 0)
+           .order_by(CorrectionRun.id.desc())
+           .first())
+    if run:
+        # Batch re-score without synthesis: computed again, with audio, on this first read
+        return None if run.audio_pending else run.to_dict()
+    if record.pronunciation_corrections and not record.transcription_version:
+        # Records corrected before the correction_run table existed
+        return json.loads(record.pronunciation_corrections)
+    return None
+
+def compute_corrections(record, texte):
+    """Run the pronunciation correction (with TTS) on the stored transcription and persist it"""
+    corrections = pronunciation_corrector.correct_pronunciation(
+        original_text=texte.texteContent,
+        transcribed_text=record.transcription,
+        audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+        word_confidences=word_confidences_from_record(record),
+        reference_alignment=reference_alignment_from_record(record),
+        pronunciation_scores=pronunciation_scores_from_record(record),
+        diacritized_text=texte.diacritized
+    )
+    save_corrections(record, corrections, texte.texteContent)
+    progress_analytics.commit_with_progress()
+    return corrections
+
+def corrections_for(record, texte):
+    """Corrections computed once per (record, transcription version), then served from storage"""
+    corrections = current_corrections(record)
+    if corrections is None:
+        corrections = compute_corrections(record, texte)
+    return corrections
+
+def load_record_with_texte(record_id):
+    """Read a recording; its reference text comes from the in-memory cache (None if missing)"""
+    record = Recorder.query.get(record_id)
+    if not record:
+        return None, None
+    return record, texte_cache.get(record.idTexte)
+
+def word_confidences_from_record(record):
+    """Per-word ASR confidences stored with the record's word timings, if any"""
+    if not record.word_timings:
+        return None
+    return [word.get("confidence") for word in json.loads(record.word_timings)]
+
+def reference_alignment_from_record(record):
+    """Reference-decoding alignment stored with the record, if any"""
+    if not record.reference_alignment:
+        return None
+    return json.loads(record.reference_alignment)
+
+def pronunciation_scores_from_record(record):
+    """Per-word GOP scores stored with the record, if any"""
+    if not record.pronunciation_scores:
+        return None
+    return json.loads(record.pronunciation_scores)
+
+def decoding_reference(texte):
+    """Expected text passed to the ASR stage when reference decoding or GOP scoring is enabled"""
+    if app.config['REFERENCE_DECODING'] or app.config['GOP_SCORING']:
+        return texte.texteContent
+    return None
+
+def store_asr_result(record, asr_result):
+    """Copy transcription, word timings, reference alignment and GOP scores onto the record"""
+    record.transcription = asr_result.get("transcription", "")
+    record.transcription_version = (record.transcription_version or 0) + 1
+    record.word_timings = json.dumps(asr_result.get("words", []), ensure_ascii=False)
+    alignment = asr_result.get("reference_alignment")
+    record.reference_alignment = json.dumps(alignment, ensure_ascii=False) if alignment else None
+    scores = asr_result.get("pronunciation_scores")
+    record.pronunciation_scores = json.dumps(scores, ensure_ascii=False) if scores else None
+
+def busy_response(retry_after):
+    response = jsonify({"error": "Serveur de transcription saturé, réessayez plus tard"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+@app.errorhandler(ExecutorBusyError)
+def handle_executor_busy(e):
+    db.session.rollback()
+    return busy_response(e.retry_after)
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -110,6 +305,9 @@ def upload_and_transcribe():
     if file.filename == '':
         return jsonify({"error": "Nom de fichier vide"}), 400
     
+    if model_executor.saturated():
+        return busy_response(model_executor.retry_after)
+    
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -120,21 +318,17 @@ def upload_and_transcribe():
             idTexte = int(request.form.get("idTexte", 1))
             
             # Retrieve original text from Texte table
-            texte = Texte.query.filter_by(idTexte=idTexte).first()
+            texte = texte_cache.get(idTexte)
             if not texte:
                 return jsonify({"error": f"Texte avec idTexte={idTexte} non trouvé"}), 404
             
-            # Create database record
+            # Process audio with quality analysis (no transaction held open meanwhile)
+            result = processor.process_audio(filepath, reference_text=decoding_reference(texte))
+            
+            # Create database record; flush assigns the id, the single commit happens at the end
             record = Recorder(id_eleve=id_eleve, idTexte=idTexte, file_path=filepath)
             db.session.add(record)
-            db.session.commit()
-            
-            # Process audio with quality analysis
-            result = processor.process_audio(record.file_path)
-            
-            # Debug: Print result type and content
-            print(f"DEBUG - Type de result: {type(result)}")
-            print(f"DEBUG - Contenu de result: {result}")
+            db.session.flush()
             
             response_data = {
                 "success": False,
@@ -157,9 +351,10 @@ def upload_and_transcribe():
                     corrections = pronunciation_corrector.correct_pronunciation(
                         original_text=texte.texteContent,
                         transcribed_text=result,
-                        audio_output_dir=AUDIO_CORRECTIONS_FOLDER
+                        audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                        diacritized_text=texte.diacritized
                     )
-                    record.pronunciation_corrections = json.dumps(corrections, ensure_ascii=False)
+                    save_corrections(record, corrections, texte.texteContent)
                     response_data["pronunciation_corrections"] = corrections
             
             elif isinstance(result, dict):
@@ -167,8 +362,9 @@ def upload_and_transcribe():
                 response_data["quality_analysis"] = quality_analysis
                 
                 if result.get("success", False):
-                    record.transcription = result.get("transcription", "")
+                    store_asr_result(record, result)
                     response_data["transcription"] = result.get("transcription", "")
+                    response_data["pronunciation_scores"] = result.get("pronunciation_scores")
                     response_data["success"] = True
                     response_data["message"] = "Fichier enregistré et transcrit avec succès"
                     
@@ -177,9 +373,13 @@ def upload_and_transcribe():
                         corrections = pronunciation_corrector.correct_pronunciation(
                             original_text=texte.texteContent,
                             transcribed_text=result.get("transcription", ""),
-                            audio_output_dir=AUDIO_CORRECTIONS_FOLDER
+                            audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                            word_confidences=result.get("word_confidences"),
+                            reference_alignment=result.get("reference_alignment"),
+                            pronunciation_scores=result.get("pronunciation_scores"),
+                            diacritized_text=texte.diacritized
                         )
-                        record.pronunciation_corrections = json.dumps(corrections, ensure_ascii=False)
+                        save_corrections(record, corrections, texte.texteContent)
                         response_data["pronunciation_corrections"] = corrections
                 else:
                     response_data["success"] = False
@@ -190,9 +390,11 @@ def upload_and_transcribe():
                     db.session.commit()
                     return jsonify(response_data), 422
             
-            db.session.commit()
+            progress_analytics.commit_with_progress()
             return jsonify(response_data)
             
+        except ExecutorBusyError:
+            raise
         except Exception as e:
             db.session.rollback()
             return jsonify({"error": str(e)}), 500
@@ -209,6 +411,9 @@ def upload_and_transcribee():
     if file.filename == '':
         return jsonify({"error": "Nom de fichier vide"}), 400
     
+    if model_executor.saturated():
+        return busy_response(model_executor.retry_after)
+    
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -219,45 +424,50 @@ def upload_and_transcribee():
             idTexte = int(request.form.get("idTexte", 1))
             
             # Retrieve original text from Texte table
-            texte = Texte.query.filter_by(idTexte=idTexte).first()
+            texte = texte_cache.get(idTexte)
             if not texte:
                 return jsonify({"error": f"Texte avec idTexte={idTexte} non trouvé"}), 404
             
-            # Create database record
-            record = Recorder(id_eleve=id_eleve, idTexte=idTexte, file_path=filepath)
-            db.session.add(record)
-            db.session.commit()
-            
             # Process audio (transcription only, no quality analysis)
-            transcription = processor.transcribe_audio(record.file_path)
+            asr_result = processor.transcribe_audio_detailed(filepath, reference_text=decoding_reference(texte))
             
-            # Debug: Print transcription
-            print(f"DEBUG - Transcription: {transcription}")
+            # Create database record; flush assigns the id, the single commit happens at the end
+            record = Recorder(id_eleve=id_eleve, idTexte=idTexte, file_path=filepath)
+            db.session.add(record)
+            db.session.flush()
+            transcription = asr_result["transcription"]
             
             response_data = {
                 "success": True,
                 "record_id": record.id,
                 "message": "Fichier enregistré et transcrit avec succès",
                 "transcription": transcription,
+                "pronunciation_scores": asr_result.get("pronunciation_scores"),
                 "pronunciation_corrections": {}
             }
             
             # Store transcription in database
-            record.transcription = transcription
+            store_asr_result(record, asr_result)
             
             # Apply pronunciation correction if available
             if pronunciation_corrector and texte:
                 corrections = pronunciation_corrector.correct_pronunciation(
                     original_text=texte.texteContent,
                     transcribed_text=transcription,
-                    audio_output_dir=AUDIO_CORRECTIONS_FOLDER
+                    audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                    word_confidences=asr_result.get("word_confidences"),
+                    reference_alignment=asr_result.get("reference_alignment"),
+                    pronunciation_scores=asr_result.get("pronunciation_scores"),
+                    diacritized_text=texte.diacritized
                 )
-                record.pronunciation_corrections = json.dumps(corrections, ensure_ascii=False)
+                save_corrections(record, corrections, texte.texteContent)
                 response_data["pronunciation_corrections"] = corrections
             
-            db.session.commit()
+            progress_analytics.commit_with_progress()
             return jsonify(response_data)
             
+        except ExecutorBusyError:
+            raise
         except Exception as e:
             db.session.rollback()
             return jsonify({"error": str(e)}), 500
@@ -283,30 +493,41 @@ def analyze_audio_quality(record_id):
 
 @app.route('/audio_corrections/<path:filename>')
 def serve_audio_corrections(filename):
-    return send_from_directory(app.config['AUDIO_CORRECTIONS_FOLDER'], filename)
+    # Content ETag, 304 on revalidation, Range requests; content-addressed names are immutable
+    return send_audio(app.config['AUDIO_CORRECTIONS_FOLDER'], filename)
 
 @app.route("/retry_transcription/<int:record_id>", methods=["POST"])
 def retry_transcription(record_id):
-    record = Recorder.query.get(record_id)
+    if model_executor.saturated():
+        return busy_response(model_executor.retry_after)
+    
+    record, texte = load_record_with_texte(record_id)
     if not record:
         return jsonify({"error": f"Enregistrement avec id={record_id} non trouvé"}), 404
     
     try:
-        transcription = processor.transcribe_audio(record.file_path)
-        record.transcription = transcription
+        asr_result = processor.transcribe_audio_detailed(
+            record.file_path,
+            reference_text=decoding_reference(texte) if texte else None
+        )
+        transcription = asr_result["transcription"]
+        store_asr_result(record, asr_result)
         
         # NEW: Re-run pronunciation correction if available
         if pronunciation_corrector:
-            texte = Texte.query.filter_by(idTexte=record.idTexte).first()
             if texte:
                 corrections = pronunciation_corrector.correct_pronunciation(
                     original_text=texte.texteContent,
                     transcribed_text=transcription,
-                    audio_output_dir=AUDIO_CORRECTIONS_FOLDER
+                    audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                    word_confidences=asr_result.get("word_confidences"),
+                    reference_alignment=asr_result.get("reference_alignment"),
+                    pronunciation_scores=asr_result.get("pronunciation_scores"),
+                    diacritized_text=texte.diacritized
                 )
-                record.pronunciation_corrections = json.dumps(corrections, ensure_ascii=False)
+                save_corrections(record, corrections, texte.texteContent)
         
-        db.session.commit()
+        progress_analytics.commit_with_progress()
         return jsonify({
             "success": True,
             "message": "Transcription forcée réussie",
@@ -314,12 +535,16 @@ def retry_transcription(record_id):
             "transcription": transcription,
             "pronunciation_corrections": corrections if pronunciation_corrector and texte else {}
         })
+    except ExecutorBusyError:
+        raise
     except Exception as e:
+        # The record was already updated in the session: do not leave it half-retried
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @app.route("/evaluer_lecture_diacritisee/<int:record_id>", methods=["GET"])
 def evaluer_lecture_diacritisee_endpoint(record_id):
-    record = Recorder.query.get(record_id)
+    record, texte = load_record_with_texte(record_id)
     if not record:
         return jsonify({"error": f"Enregistrement avec id={record_id} non trouvé"}), 404
     
@@ -329,25 +554,16 @@ def evaluer_lecture_diacritisee_endpoint(record_id):
             "record_id": record.id
         }), 400
     
-    texte = Texte.query.filter_by(idTexte=record.idTexte).first()
     if not texte:
         return jsonify({"error": f"Texte original non trouvé"}), 404
     
-    # NEW: Use AzurePronunciationCorrector for diacritized evaluation
+    # Corrections are computed once per transcription, then read back from storage
     score = 0
     corrections = {}
     if pronunciation_corrector:
-        corrections = pronunciation_corrector.correct_pronunciation(
-            original_text=texte.texteContent,
-            transcribed_text=record.transcription,
-            audio_output_dir=AUDIO_CORRECTIONS_FOLDER
-        )
+        corrections = corrections_for(record, texte)
         # Calculate score based on number of errors
-        total_words = len(texte.texteContent.split())
-        error_count = corrections.get("total_errors", 0)
-        score = max(0, 100 - (error_count / total_words * 100)) if total_words > 0 else 0
-        record.pronunciation_corrections = json.dumps(corrections, ensure_ascii=False)
-        db.session.commit()
+        score = progress_analytics.reading_score(corrections.get("total_errors", 0), texte.texteContent)
     
     return jsonify({
         "record_id": record.id,
@@ -358,6 +574,38 @@ def evaluer_lecture_diacritisee_endpoint(record_id):
         "pronunciation_corrections": corrections
     })
 
+@app.route("/recompute_corrections/<int:record_id>", methods=["POST"])
+def recompute_corrections(record_id):
+    if not pronunciation_corrector:
+        return jsonify({
+            "error": "خدمة تصحيح النطق غير متوفرة. يرجى التأكد من إعداد مفتاح Azure Speech."
+        }), 503
+    
+    record, texte = load_record_with_texte(record_id)
+    if not record:
+        return jsonify({"error": f"Enregistrement avec id={record_id} non trouvé"}), 404
+    
+    if not record.transcription:
+        return jsonify({
+            "error": "Aucune transcription disponible pour cet enregistrement.",
+            "record_id": record.id
+        }), 400
+    
+    if not texte:
+        return jsonify({"error": f"Texte original non trouvé"}), 404
+    
+    try:
+        corrections = compute_corrections(record, texte)
+        return jsonify({
+            "success": True,
+            "record_id": record.id,
+            "transcription_version": record.transcription_version,
+            "pronunciation_corrections": corrections
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "record_id": record.id}), 500
+
 @app.route("/evaluate_reading/<int:record_id>", methods=["POST"])
 def evaluate_reading_endpoint(record_id):
     if not reading_evaluator:
@@ -365,7 +613,7 @@ def evaluate_reading_endpoint(record_id):
             "error": "خدمة تقييم القراءة غير متوفرة. يرجى التأكد من إعداد مفتاح Gemini API."
         }), 503
     
-    record = Recorder.query.get(record_id)
+    record, texte = load_record_with_texte(record_id)
     if not record:
         return jsonify({"error": f"Enregistrement avec id={record_id} non trouvé"}), 404
     
@@ -375,7 +623,6 @@ def evaluate_reading_endpoint(record_id):
             "record_id": record.id
         }), 400
     
-    texte = Texte.query.filter_by(idTexte=record.idTexte).first()
     if not texte:
         return jsonify({"error": f"النص الأصلي مع معرف {record.idTexte} غير موجود"}), 404
     
@@ -383,19 +630,14 @@ def evaluate_reading_endpoint(record_id):
         # Evaluate reading using LLM
         evaluation = reading_evaluator.evaluate_reading(
             transcription=record.transcription,
-            original_text=texte.texteContent
+            original_text=texte.texteContent,
+            word_timings=json.loads(record.word_timings) if record.word_timings else None
         )
         
-        # NEW: Add pronunciation corrections
+        # Stored corrections for this transcription (computed on first use only)
         pronunciation_corrections = {}
         if pronunciation_corrector:
-            pronunciation_corrections = pronunciation_corrector.correct_pronunciation(
-                original_text=texte.texteContent,
-                transcribed_text=record.transcription,
-                audio_output_dir=AUDIO_CORRECTIONS_FOLDER
-            )
-            record.pronunciation_corrections = json.dumps(pronunciation_corrections, ensure_ascii=False)
-            db.session.commit()
+            pronunciation_corrections = corrections_for(record, texte)
         
         evaluation_data = {
             "record_id": record.id,
@@ -473,10 +715,15 @@ def test_evaluate_reading(record_id):
             pronunciation_corrections = pronunciation_corrector.correct_pronunciation(
                 original_text=original_text,
                 transcribed_text=record.transcription,
-                audio_output_dir=AUDIO_CORRECTIONS_FOLDER
+                audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                word_confidences=word_confidences_from_record(record)
             )
-            record.pronunciation_corrections = json.dumps(pronunciation_corrections, ensure_ascii=False)
-            db.session.commit()
+            # Only a run against the record's own text becomes its stored corrections (and is
+            # folded into the progress aggregates); any other text is an ad-hoc test
+            texte = texte_cache.get(record.idTexte)
+            if texte is not None and original_text == texte.texteContent.strip():
+                save_corrections(record, pronunciation_corrections, original_text)
+                progress_analytics.commit_with_progress()
         
         evaluation_data = {
             "record_id": record.id,
@@ -584,21 +831,41 @@ def get_audio_feedback(record_id):
     if not record:
         return jsonify({"error": f"Enregistrement avec id={record_id} non trouvé"}), 404
     
-    if not record.pronunciation_corrections:
+    run = latest_correction_run(record.id)
+    if run and run.audio_pending:
+        # Re-scored without synthesis: generate the audio now, as the other read endpoints do
+        texte = texte_cache.get(record.idTexte)
+        if texte and record.transcription:
+            corrections_for(record, texte)
+            run = latest_correction_run(record.id)
+    if not run and not record.pronunciation_corrections:
         return jsonify({
             "error": "Aucune correction de prononciation disponible pour cet enregistrement.",
             "record_id": record.id
         }), 400
     
     try:
-        corrections = json.loads(record.pronunciation_corrections)
-        audio_files = {
-            "corrected_text_audio": corrections.get("corrected_text_audio"),
-            "feedback_audio": corrections.get("feedback_audio"),
-            "individual_corrections": [
-                error["audio_file"] for error in corrections.get("errors", []) if error.get("audio_file")
+        if run:
+            individual_corrections = [
+                audio_file for (audio_file,) in db.session.query(WordError.audio_file)
+                .filter(WordError.run_id == run.id, WordError.audio_file.isnot(None))
+                .order_by(WordError.position)
             ]
-        }
+            audio_files = {
+                "corrected_text_audio": run.corrected_text_audio,
+                "feedback_audio": run.feedback_audio,
+                "individual_corrections": individual_corrections
+            }
+        else:
+            # Records corrected before the correction_run table existed
+            corrections = json.loads(record.pronunciation_corrections)
+            audio_files = {
+                "corrected_text_audio": corrections.get("corrected_text_audio"),
+                "feedback_audio": corrections.get("feedback_audio"),
+                "individual_corrections": [
+                    error["audio_file"] for error in corrections.get("errors", []) if error.get("audio_file")
+                ]
+            }
         return jsonify({
             "success": True,
             "message": "Fichiers audio de correction récupérés avec succès",
@@ -611,5 +878,53 @@ def get_audio_feedback(record_id):
             "record_id": record.id
         }), 500
 
+@app.route("/texte/<int:idTexte>", methods=["PUT"])
+def update_texte(idTexte):
+    data = request.get_json()
+    if not data or not data.get("texteContent", "").strip():
+        return jsonify({"error": "texteContent est requis"}), 400
+    
+    texte = Texte.query.get(idTexte)
+    if not texte:
+        return jsonify({"error": f"Texte avec idTexte={idTexte} non trouvé"}), 404
+    
+    # The version bump fires the cache invalidation listener
+    texte.texteContent = data["texteContent"].strip()
+    db.session.commit()
+    return jsonify({"idTexte": texte.idTexte, "version": texte.version, "texteContent": texte.texteContent})
+
+@app.route("/progress/student/<int:id_eleve>", methods=["GET"])
+def student_progress(id_eleve):
+    history_limit = request.args.get("history", 20, type=int)
+    return jsonify(progress_analytics.student_progress(id_eleve, history_limit))
+
+@app.route("/progress/student/<int:id_eleve>/weak_words", methods=["GET"])
+def student_weak_words(id_eleve):
+    limit = request.args.get("limit", 10, type=int)
+    return jsonify({
+        "id_eleve": id_eleve,
+        "weak_words": progress_analytics.student_weak_words(id_eleve, limit)
+    })
+
+@app.route("/progress/text/<int:idTexte>", methods=["GET"])
+def text_progress(idTexte):
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify(progress_analytics.text_analytics(idTexte, limit))
+
+@app.cli.command("rebuild-progress")
+def rebuild_progress_command():
+    """Recompute the progress aggregates from all stored correction runs."""
+    processed = progress_analytics.rebuild_progress()
+    print(f"Progress aggregates rebuilt from {processed} correction runs")
+
+@app.cli.command("prefetch-tts")
+def prefetch_tts_command():
+    """Pre-synthesize the most misread words of every text now, ignoring the off-peak window."""
+    if tts_prefetcher is None:
+        print("Azure Pronunciation Corrector not initialized")
+        return
+    synthesized = tts_prefetcher.run_once(ignore_window=True)
+    print(f"{synthesized} word clips pre-synthesized")
+
 if __name__ == "__main__":
     app.run(debug=True,host='127.0.0.1',port=5005)
\ No newline at end of file
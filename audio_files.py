@@ -0,0 +1,102 @@
+"""
+Content-addressed correction audio and HTTP caching when serving it
+
+Generated files are renamed to `<stem>.<digest>.<ext>`, where digest is the start of the
+SHA-256 of their content. A given URL then always returns the same bytes, so it can be
+cached as immutable, and the ETag is read from the name without touching the file.
+Files without a digest in their name (older runs) get an ETag hashed from their content,
+cached by (path, mtime, size), and must be revalidated, which costs a 304 and no body.
+"""
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+DIGEST_LENGTH = 16
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_CONTENT_ADDRESSED_PATTERN = re.compile(r"\.([0-9a-f]{%d})\.\w+$" % DIGEST_LENGTH)
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def name_digest(path):
+    """Digest embedded in a content-addressed file name, or None"""
+    match = _CONTENT_ADDRESSED_PATTERN.search(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def temp_path(path):
+    """Unique per-run name next to path (<stem>.<random>.tmp<ext>), to write a file before addressing it"""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{uuid.uuid4().hex}.tmp{extension}"
+
+
+def content_address(path, name=None):
+    """
+    Rename a generated file to <stem>.<digest><ext> and return the new path
+
+    The stem is taken from name when given (path being a temp_path() of it). Identical
+    content maps to the same name, so an existing target is simply replaced. Write the
+    file under a per-run temp_path(): a fixed source name could be renamed away by a
+    concurrent run. Already addressed paths are returned unchanged; a missing source
+    raises FileNotFoundError.
+    """
+    if name_digest(path):
+        return path
+    stem, extension = os.path.splitext(name or path)
+    target = f"{stem}.{file_digest(path)[:DIGEST_LENGTH]}{extension}"
+    os.replace(path, target)
+    return target
+
+
+class _ETagCache:
+    def __init__(self):
+        self._etags = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            etag = self._etags.get(key)
+        if etag is None:
+            etag = file_digest(path)[:DIGEST_LENGTH]
+            with self._lock:
+                self._etags[key] = etag
+        return etag
+
+
+_etag_cache = _ETagCache()
+
+
+def send_audio(directory, filename):
+    """
+    send_from_directory() with a content ETag, conditional GET (304) and byte ranges (206)
+
+    Content-addressed files are public and immutable for a year; other files are
+    revalidated on every play.
+    """
+    from flask import abort, send_from_directory
+    from werkzeug.security import safe_join
+
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    digest = name_digest(filename)
+    etag = digest or _etag_cache.get(path)
+    response = send_from_directory(directory, filename, etag=etag, conditional=True,
+                                   max_age=IMMUTABLE_MAX_AGE if digest else 0)
+    if digest:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
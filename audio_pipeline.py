@@ -0,0 +1,115 @@
+import os
+from multiprocessing import get_context, resource_tracker, shared_memory
+
+import librosa
+import numpy as np
+
+from AudioQualityAnalyzer import AudioQualityAnalyzer
+from ctc_alignment import gop_scores, reference_word_alignment
+
+# Analyseur propre à chaque processus du pool (créé par _init_worker)
+_analyzer = None
+
+
+def _init_worker():
+    global _analyzer
+    _analyzer = AudioQualityAnalyzer()
+
+
+def _decode_and_analyze(audio_path, sample_rate):
+    """
+    Décode et analyse un fichier dans un processus du pool
+
+    Le signal float32 est copié une fois dans un segment de mémoire partagée dont seul le nom
+    est renvoyé; le processus principal le lit sans copie ni sérialisation du tableau.
+    """
+    try:
+        speech_array, _ = librosa.load(audio_path, sr=sample_rate)
+    except Exception:
+        return None, 0, _analyzer.analyze_audio_quality(audio_path)
+
+    speech_array = np.ascontiguousarray(speech_array, dtype=np.float32)
+    quality_result = _analyzer.analyze_audio_array(speech_array, sample_rate)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(speech_array.nbytes, 1))
+    try:
+        np.ndarray(speech_array.shape, dtype=np.float32, buffer=shm.buf)[:] = speech_array
+    except BaseException:
+        # Le nom n'est jamais renvoyé: personne d'autre ne pourrait libérer le segment
+        shm.close()
+        shm.unlink()
+        raise
+    shm_name = shm.name
+    shm.close()
+    return shm_name, len(speech_array), quality_result
+
+
+class DecodedAudio:
+    """Signal décodé par le pool, vu directement dans la mémoire partagée (à fermer après usage)"""
+
+    def __init__(self, shm_name, length, quality_analysis):
+        self.quality_analysis = quality_analysis
+        self.audio = None
+        self._shm = shared_memory.SharedMemory(name=shm_name) if shm_name else None
+        if self._shm is None:
+            return
+        try:
+            self.audio = np.ndarray((length,), dtype=np.float32, buffer=self._shm.buf)
+        except BaseException:
+            # Aucun DecodedAudio n'est renvoyé à l'appelant: le segment ne serait jamais libéré
+            self.close()
+            raise
+
+    def close(self):
+        """Libère le segment partagé"""
+        self.audio = None
+        if self._shm is None:
+            return
+        try:
+            self._shm.close()
+        except BufferError:
+            # Une vue du signal est encore référencée: le mapping sera libéré à sa destruction
+            pass
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AudioPipeline:
+    """
+    Étages CPU du traitement audio exécutés dans un pool de processus
+
+    Le décodage, l'analyse de qualité et l'alignement sur le texte attendu sont du Python lié
+    au GIL: les exécuter dans des processus séparés laisse les threads Flask et l'inférence
+    libres, et le débit augmente avec le nombre de cœurs. Le pool est créé par fork et doit
+    donc être construit au démarrage, avant le chargement du modèle et des threads du serveur.
+    """
+
+    def __init__(self, workers=None, sample_rate=16000):
+        self.workers = workers or os.cpu_count() or 1
+        self.sample_rate = sample_rate
+        # Un seul resource tracker partagé par le parent et les processus du pool
+        resource_tracker.ensure_running()
+        self._pool = get_context("fork").Pool(processes=self.workers, initializer=_init_worker)
+
+    def decode(self, audio_path):
+        """Décode et analyse un fichier; retourne un DecodedAudio (audio None si illisible)"""
+        shm_name, length, quality_result = self._pool.apply(_decode_and_analyze, (audio_path, self.sample_rate))
+        return DecodedAudio(shm_name, length, quality_result)
+
+    def align(self, log_probs, reference_words, **kwargs):
+        """reference_word_alignment() exécuté dans un processus du pool"""
+        return self._pool.apply(reference_word_alignment, (log_probs, reference_words), kwargs)
+
+    def score(self, log_probs, reference_words, **kwargs):
+        """gop_scores() exécuté dans un processus du pool"""
+        return self._pool.apply(gop_scores, (log_probs, reference_words), kwargs)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -1,56 +1,353 @@
+import hashlib
 import torch
 import librosa
+import numpy as np
 import os
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 from AudioQualityAnalyzer import AudioQualityAnalyzer
+from transcription_cache import TranscriptionCache, hash_audio_file
+from ctc_alignment import gop_scores, greedy_word_segments, log_softmax, reference_word_alignment
+from model_executor import ExecutorBusyError
+import metrics
+
+ASR_MODEL_NAME = "jonatasgrosman/wav2vec2-large-xlsr-53-arabic"
+# Incrémenté quand le contenu des entrées du cache change
+CACHE_SCHEMA_VERSION = 5
+# Champs du résultat ASR stockés comme tableaux NumPy compacts
+ASR_ARRAY_FIELDS = ("frame_confidence", "word_confidences")
 
 class ArabicAudioProcessor:
-    def __init__(self):
-        self.asr_processor = Wav2Vec2Processor.from_pretrained("jonatasgrosman/wav2vec2-large-xlsr-53-arabic")
-        self.asr_model = Wav2Vec2ForCTC.from_pretrained("jonatasgrosman/wav2vec2-large-xlsr-53-arabic")
+    def __init__(self, model_name=ASR_MODEL_NAME, cache_dir="transcription_cache", deviation_margin=0.35,
+                 executor=None, pipeline=None, reference_decoding=True, gop_scoring=True, cache_max_bytes=None):
+        self.model_name = model_name
+        # ModelExecutor optionnel limitant le nombre de passes du modèle en parallèle
+        self.executor = executor
+        # AudioPipeline optionnel: décodage, analyse de qualité et alignement dans un pool de processus
+        self.pipeline = pipeline
+        self.asr_processor = Wav2Vec2Processor.from_pretrained(model_name)
+        self.asr_model = Wav2Vec2ForCTC.from_pretrained(model_name)
         self.quality_analyzer = AudioQualityAnalyzer()
+        self.model_version = self._get_model_version()
+        # Taille maximale du cache de transcriptions (éviction LRU), None pour ne pas la borner
+        self.cache = TranscriptionCache(cache_dir, self.model_version, max_bytes=cache_max_bytes)
+
+        # Informations nécessaires à l'alignement CTC (mots horodatés)
+        tokenizer = self.asr_processor.tokenizer
+        self.id_to_token = np.array(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer)))), dtype=object)
+        self.blank_id = tokenizer.pad_token_id
+        self.delimiter_id = tokenizer.convert_tokens_to_ids(tokenizer.word_delimiter_token)
+        self.special_ids = [i for i in tokenizer.all_special_ids if i != self.blank_id]
+        self.char_to_id = tokenizer.get_vocab()
+        # Écart de log-probabilité moyen par trame au-delà duquel un mot de référence est jugé mal lu
+        self.deviation_margin = deviation_margin
+        # Avec un texte attendu: transcription contrainte par ce texte (sinon gloutonne),
+        # et scores de prononciation GOP calculés sur les mêmes log-probabilités
+        self.reference_decoding = reference_decoding
+        self.gop_scoring = gop_scoring
+        self.inputs_to_logits_ratio = self.asr_model.config.inputs_to_logits_ratio
 
-    def process_audio(self, audio_path):
+    def _get_model_version(self):
         """
-        Traite l'audio avec vérification de qualité avant transcription
+        Identifiant du modèle ASR et du backend d'inférence, utilisé pour invalider le cache
+        """
+        revision = getattr(self.asr_model.config, "_commit_hash", None) or "local"
+        device = next(self.asr_model.parameters()).device.type
+        return f"{self.model_name}@{revision}|torch-{torch.__version__}|{device}|schema-{CACHE_SCHEMA_VERSION}"
+
+    def load_audio(self, audio_path, sample_rate=16000, audio_hash=None):
+        """
+        Décode l'audio en float32 mono, en réutilisant le décodage mis en cache si disponible
+        """
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Audio file {audio_path} not found")
+
+        if audio_hash is not None and sample_rate == 16000:
+            speech_array = self.cache.get_audio(audio_hash)
+            if speech_array is not None:
+                return speech_array
+
+        with metrics.span("decode"):
+            speech_array, _ = librosa.load(audio_path, sr=sample_rate)
+        return speech_array
+
+    def _reference_hash(self, reference_text):
+        if not reference_text:
+            return None
+        if not self.reference_decoding:
+            # Texte attendu utilisé seulement pour le score: entrée distincte du décodage contraint
+            reference_text = f"gop|{reference_text}"
+        return hashlib.sha1(reference_text.encode("utf-8")).hexdigest()
+
+    def _asr_cache_hit(self, cached, reference_text):
+        """Une transcription en cache n'est valable que pour le même mode de décodage"""
+        return (cached is not None and cached.get("transcription") is not None
+                and cached.get("reference_hash") == self._reference_hash(reference_text))
+
+    def process_audio(self, audio_path, use_cache=True, reference_text=None):
         """
-        # Étape 1: Analyser la qualité audio
-        quality_result = self.quality_analyzer.analyze_audio_quality(audio_path)
+        Traite l'audio avec vérification de qualité avant transcription
         
-        if not quality_result["valid"]:
+        Args:
+            reference_text: Texte attendu; s'il est fourni, la transcription est contrainte par ce texte
+                (si reference_decoding) et les mots lus reçoivent un score de prononciation
+        """
+        if not os.path.exists(audio_path):
             return {
                 "success": False,
                 "transcription": None,
-                "quality_analysis": quality_result
+                "quality_analysis": self.quality_analyzer.analyze_audio_quality(audio_path)
             }
-        
-        # Étape 2: Si l'audio est valide, procéder à la transcription
+
+        # Étape 0: Un fichier déjà traité par le même modèle est servi depuis le cache
+        audio_hash = hash_audio_file(audio_path)
+        cached = self.cache.get(audio_hash) if use_cache else None
+        metrics.cache_lookup("transcription", bool(cached) and self._asr_cache_hit(cached, reference_text))
+        if cached and "quality_analysis" in cached:
+            quality_result = cached["quality_analysis"]
+            if not quality_result["valid"]:
+                return {
+                    "success": False,
+                    "transcription": None,
+                    "quality_analysis": quality_result,
+                    "cached": True
+                }
+            if self._asr_cache_hit(cached, reference_text):
+                return {
+                    "success": True,
+                    **self._cached_asr_result(audio_hash, cached),
+                    "quality_analysis": quality_result,
+                    "cached": True
+                }
+
+        # Étape 1: Analyser la qualité audio (un seul décodage, partagé avec la transcription)
+        decoded = None
         try:
-            transcription = self.transcribe_audio(audio_path)
-            return {
-                "success": True,
-                "transcription": transcription,
-                "quality_analysis": quality_result
-            }
-        except Exception as e:
+            speech_array = self.cache.get_audio(audio_hash)
+            if speech_array is None and self.pipeline is not None:
+                # Décodage et analyse dans le pool; le signal arrive par mémoire partagée
+                with metrics.span("decode_quality_pool"):
+                    decoded = self.pipeline.decode(audio_path)
+                speech_array, quality_result = decoded.audio, decoded.quality_analysis
+                if speech_array is None:
+                    return {
+                        "success": False,
+                        "transcription": None,
+                        "quality_analysis": quality_result
+                    }
+            else:
+                if speech_array is None:
+                    speech_array = self.load_audio(audio_path)
+                with metrics.span("quality"):
+                    quality_result = self.quality_analyzer.analyze_audio_array(speech_array)
+        except Exception:
             return {
                 "success": False,
                 "transcription": None,
-                "error": f"Erreur lors de la transcription: {str(e)}",
-                "quality_analysis": quality_result
+                "quality_analysis": self.quality_analyzer.analyze_audio_quality(audio_path)
             }
 
-    def transcribe_audio(self, audio_path, sample_rate=16000):
+        try:
+            self.cache.put(audio_hash, {"quality_analysis": quality_result}, audio=speech_array)
+
+            if not quality_result["valid"]:
+                return {
+                    "success": False,
+                    "transcription": None,
+                    "quality_analysis": quality_result
+                }
+
+            # Étape 2: Si l'audio est valide, procéder à la transcription
+            try:
+                asr_result = self.transcribe_array_detailed(speech_array, reference_text=reference_text)
+                self._cache_asr_result(audio_hash, asr_result)
+                return {
+                    "success": True,
+                    **asr_result,
+                    "quality_analysis": quality_result
+                }
+            except ExecutorBusyError:
+                raise
+            except Exception as e:
+                return {
+                    "success": False,
+                    "transcription": None,
+                    "error": f"Erreur lors de la transcription: {str(e)}",
+                    "quality_analysis": quality_result
+                }
+        finally:
+            speech_array = None
+            if decoded is not None:
+                decoded.close()
+
+    def transcribe_audio(self, audio_path, sample_rate=16000, use_cache=True, reference_text=None):
         """Transcrit l'audio en texte"""
+        return self.transcribe_audio_detailed(audio_path, sample_rate, use_cache, reference_text)["transcription"]
+
+    def transcribe_audio_detailed(self, audio_path, sample_rate=16000, use_cache=True, reference_text=None):
+        """
+        Transcrit l'audio et retourne aussi les mots horodatés
+
+        Returns:
+            Dict {"transcription", "words": [{"word", "start", "end", "confidence"}], "audio_duration",
+                  "frame_confidence" (float16, T), "word_confidences" (float16, un par mot)}
+        """
         if not os.path.exists(audio_path):
             raise FileNotFoundError(f"Audio file {audio_path} not found")
+
+        audio_hash = hash_audio_file(audio_path)
+        if use_cache and sample_rate == 16000:
+            cached = self.cache.get(audio_hash)
+            hit = self._asr_cache_hit(cached, reference_text)
+            metrics.cache_lookup("transcription", hit)
+            if hit:
+                return self._cached_asr_result(audio_hash, cached)
+
+        speech_array = self.load_audio(audio_path, sample_rate, audio_hash=audio_hash)
+        asr_result = self.transcribe_array_detailed(speech_array, sample_rate, reference_text)
+        if sample_rate == 16000:
+            self._cache_asr_result(audio_hash, asr_result)
+        return asr_result
+
+    def _cache_asr_result(self, audio_hash, asr_result):
+        """Sépare les champs JSON des tableaux float16 avant mise en cache"""
+        arrays = {name: asr_result[name] for name in ASR_ARRAY_FIELDS if name in asr_result}
+        entry = {key: value for key, value in asr_result.items() if key not in ASR_ARRAY_FIELDS}
+        self.cache.put(audio_hash, entry, arrays=arrays)
+
+    def _cached_asr_result(self, audio_hash, cached):
+        """Reconstruit un résultat ASR à partir d'une entrée du cache"""
+        asr_result = {
+            "transcription": cached["transcription"],
+            "words": cached.get("words", []),
+            "audio_duration": cached.get("audio_duration"),
+            "decoding": cached.get("decoding", "greedy"),
+            "reference_alignment": cached.get("reference_alignment"),
+            "pronunciation_scores": cached.get("pronunciation_scores")
+        }
+        asr_result.update(self.cache.get_arrays(audio_hash))
+        return asr_result
+
+    def _forward(self, input_values, attention_mask=None):
+        """Passe avant du modèle ASR (logits CTC)"""
+        with metrics.span("asr_forward"), torch.no_grad():
+            return self.asr_model(input_values, attention_mask=attention_mask).logits
+
+    def _run_forward(self, input_values, attention_mask=None):
+        # "asr" inclut l'attente d'un slot d'inférence, "asr_forward" seulement la passe du modèle
+        with metrics.span("asr"):
+            if self.executor is not None:
+                return self.executor.run(self._forward, input_values, attention_mask)
+            return self._forward(input_values, attention_mask)
+
+    def transcribe_array(self, speech_array, sample_rate=16000, reference_text=None):
+        """Transcrit un signal déjà décodé"""
+        return self.transcribe_array_detailed(speech_array, sample_rate, reference_text)["transcription"]
+
+    def transcribe_array_detailed(self, speech_array, sample_rate=16000, reference_text=None):
+        """
+        Transcrit un signal déjà décodé et aligne les mots sur les trames CTC
+        (les logits déjà calculés sont réutilisés, aucun passage supplémentaire du modèle)
         
-        speech_array, _ = librosa.load(audio_path, sr=sample_rate)
+        Si reference_text est fourni, le treillis CTC est aligné de force sur le texte attendu
+        (décodage contraint) au lieu du décodage glouton; "reference_alignment" indique alors
+        pour chaque mot attendu s'il a été lu, substitué ou omis.
+        """
         inputs = self.asr_processor(speech_array, sampling_rate=sample_rate, return_tensors="pt")
-        
-        with torch.no_grad():
-            logits = self.asr_model(inputs.input_values).logits
-            predicted_ids = torch.argmax(logits, dim=-1)
-            transcription = self.asr_processor.batch_decode(predicted_ids)[0]
-        
-        return transcription
\ No newline at end of file
+        logits = self._run_forward(inputs.input_values)
+        return self._decode_log_probs(log_softmax(logits[0].cpu().numpy()), len(speech_array),
+                                      sample_rate, reference_text)
+
+    def transcribe_batch_detailed(self, speech_arrays, sample_rate=16000, reference_texts=None):
+        """
+        Transcrit plusieurs signaux en une seule passe du modèle (signaux complétés par des zéros)
+
+        Le masque d'attention empêche le remplissage d'influencer les logits; les trames de
+        chaque signal sont ensuite tronquées à sa longueur réelle avant le décodage.
+        Retourne un résultat par signal, au même format que transcribe_array_detailed.
+        """
+        reference_texts = reference_texts or [None] * len(speech_arrays)
+        if not self.asr_processor.feature_extractor.return_attention_mask:
+            # Sans masque d'attention, le remplissage modifierait la normalisation: un signal à la fois
+            return [self.transcribe_array_detailed(speech_array, sample_rate, reference_text)
+                    for speech_array, reference_text in zip(speech_arrays, reference_texts)]
+
+        inputs = self.asr_processor(list(speech_arrays), sampling_rate=sample_rate, return_tensors="pt",
+                                    padding=True, return_attention_mask=True)
+        logits = self._run_forward(inputs.input_values, inputs.attention_mask)
+        frame_counts = self.asr_model._get_feat_extract_output_lengths(inputs.attention_mask.sum(-1))
+
+        batch_log_probs = log_softmax(logits.cpu().numpy())
+        return [
+            self._decode_log_probs(batch_log_probs[i, :int(frame_counts[i])], len(speech_array),
+                                   sample_rate, reference_text)
+            for i, (speech_array, reference_text) in enumerate(zip(speech_arrays, reference_texts))
+        ]
+
+    @metrics.timed("ctc_decode")
+    def _decode_log_probs(self, log_probs, num_samples, sample_rate=16000, reference_text=None):
+        """Décodage (contraint ou glouton) et alignement des mots à partir des log-probabilités (T, V)"""
+        frame_confidence = np.exp(log_probs.max(axis=-1))
+        frame_duration = self.inputs_to_logits_ratio / sample_rate
+
+        decoded = None
+        if reference_text and self.reference_decoding:
+            # Alignement Viterbi (CPU) dans le pool de processus s'il est configuré
+            align = self.pipeline.align if self.pipeline is not None else reference_word_alignment
+            decoded = align(
+                log_probs,
+                reference_text.split(),
+                char_to_id=self.char_to_id,
+                id_to_token=self.id_to_token,
+                blank_id=self.blank_id,
+                delimiter_id=self.delimiter_id,
+                frame_duration=frame_duration,
+                special_ids=self.special_ids,
+                deviation_margin=self.deviation_margin
+            )
+
+        if decoded is not None:
+            transcription = decoded["transcription"]
+            words = decoded["words"]
+            reference_alignment = decoded["reference_alignment"]
+            pronunciation_scores = decoded["pronunciation_scores"] if self.gop_scoring else None
+        else:
+            # Décodage glouton (texte de référence absent ou impossible à aligner)
+            predicted_ids = log_probs.argmax(axis=-1)
+            transcription = self.asr_processor.batch_decode(predicted_ids[None, :])[0]
+            words = greedy_word_segments(
+                log_probs,
+                self.id_to_token,
+                blank_id=self.blank_id,
+                delimiter_id=self.delimiter_id,
+                frame_duration=frame_duration,
+                special_ids=self.special_ids
+            )
+            reference_alignment = None
+            pronunciation_scores = None
+            if reference_text and self.gop_scoring and not self.reference_decoding:
+                # Alignement forcé du texte attendu sur les log-probabilités déjà calculées
+                score = self.pipeline.score if self.pipeline is not None else gop_scores
+                with metrics.span("gop"):
+                    pronunciation_scores = score(
+                        log_probs,
+                        reference_text.split(),
+                        char_to_id=self.char_to_id,
+                        id_to_token=self.id_to_token,
+                        blank_id=self.blank_id,
+                        delimiter_id=self.delimiter_id,
+                        special_ids=self.special_ids
+                    )
+
+        return {
+            "transcription": transcription,
+            "words": words,
+            "audio_duration": round(num_samples / sample_rate, 3),
+            "decoding": "reference" if decoded is not None else "greedy",
+            "reference_alignment": reference_alignment,
+            # Score GOP (0-1) de chaque mot attendu et de ses caractères, None sans texte attendu
+            "pronunciation_scores": pronunciation_scores,
+            "reference_hash": self._reference_hash(reference_text),
+            # Postérieurs compacts: probabilité max par trame et confiance moyenne par mot
+            "frame_confidence": frame_confidence.astype(np.float16),
+            "word_confidences": np.array([w["confidence"] for w in words], dtype=np.float16)
+        }
@@ -0,0 +1,244 @@
+"""
+Re-scoring hors ligne des enregistrements archivés (sans passer par HTTP)
+
+Les lignes de `recorder` sont lues par pages (pagination par clé), l'audio est décodé dans
+un pool de processus, transcrit par lots dans une seule passe du modèle, puis aligné et
+noté. Chaque page est écrite dans une seule transaction et un point de reprise est
+enregistré après chaque commit. Avec --resume, les enregistrements en échec (décodage) de
+l'exécution précédente sont retentés d'abord.
+
+Sans --synthesize, les corrections sont enregistrées sans audio et marquées audio_pending:
+les endpoints de lecture les recalculent avec la synthèse au premier accès.
+
+Exemple:
+    python batch_score.py --id-texte 3 --batch-size 8 --workers 4
+    python batch_score.py --resume            # reprend après le dernier commit
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from multiprocessing import get_context
+
+import librosa
+import numpy as np
+
+CHECKPOINT_FILE = "batch_score_checkpoint.json"
+
+
+def decode_audio(job):
+    """Décode un fichier en float32 mono 16 kHz (exécuté dans un processus du pool)"""
+    record_id, file_path = job
+    try:
+        speech_array, _ = librosa.load(file_path, sr=16000)
+        return record_id, speech_array.astype(np.float32), None
+    except Exception as e:
+        return record_id, None, str(e)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    """Écriture atomique: un point de reprise n'est jamais lu à moitié écrit"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def iter_record_pages(after_id, page_size, id_texte=None, id_eleve=None):
+    """Pages de Recorder triées par id; chaque page est une requête courte sur la clé primaire"""
+    from models import Recorder
+
+    while True:
+        query = Recorder.query.filter(Recorder.id > after_id)
+        if id_texte is not None:
+            query = query.filter(Recorder.idTexte == id_texte)
+        if id_eleve is not None:
+            query = query.filter(Recorder.id_eleve == id_eleve)
+        page = query.order_by(Recorder.id).limit(page_size).all()
+        if not page:
+            return
+        yield page
+        after_id = page[-1].id
+
+
+def iter_failed_pages(record_ids, page_size):
+    """Pages des enregistrements en échec d'une exécution précédente, à retenter"""
+    from models import Recorder
+
+    for start in range(0, len(record_ids), page_size):
+        ids = record_ids[start:start + page_size]
+        yield Recorder.query.filter(Recorder.id.in_(ids)).order_by(Recorder.id).all()
+
+
+def score_batch(records, speech_arrays, reference_decoding, synthesize, timings):
+    """Transcription par lot puis alignement et notation de chaque enregistrement"""
+    from app import (processor, pronunciation_corrector, texte_cache, store_asr_result,
+                     save_corrections, AUDIO_CORRECTIONS_FOLDER)
+
+    textes = [texte_cache.get(record.idTexte) for record in records]
+    # Texte attendu aussi sans décodage contraint: il sert au score GOP
+    references = [texte.texteContent if texte and (reference_decoding or processor.gop_scoring) else None
+                  for texte in textes]
+
+    start = time.perf_counter()
+    asr_results = processor.transcribe_batch_detailed(speech_arrays, reference_texts=references)
+    timings["asr"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    scored = 0
+    for record, texte, asr_result in zip(records, textes, asr_results):
+        store_asr_result(record, asr_result)
+        if pronunciation_corrector and texte:
+            corrections = pronunciation_corrector.correct_pronunciation(
+                original_text=texte.texteContent,
+                transcribed_text=asr_result["transcription"],
+                audio_output_dir=AUDIO_CORRECTIONS_FOLDER,
+                word_confidences=asr_result.get("word_confidences"),
+                reference_alignment=asr_result.get("reference_alignment"),
+                pronunciation_scores=asr_result.get("pronunciation_scores"),
+                diacritized_text=texte.diacritized,
+                synthesize=synthesize
+            )
+            # Sans synthèse, la correction est refaite avec l'audio à sa première lecture
+            save_corrections(record, corrections, texte.texteContent, audio_pending=not synthesize)
+            scored += 1
+    timings["scoring"] += time.perf_counter() - start
+    return scored
+
+
+def run_batch_score(batch_size=8, page_size=64, workers=None, checkpoint_path=CHECKPOINT_FILE, resume=False,
+                    id_texte=None, id_eleve=None, reference_decoding=False, synthesize=False, limit=None):
+    """
+    Re-transcrit et re-note les enregistrements, page par page
+
+    Returns:
+        Dict du rapport de débit (enregistrements, secondes d'audio, temps par étape)
+    """
+    import progress_analytics
+    from app import processor
+
+    # Le mode de décodage du lot remplace celui de l'application
+    processor.reference_decoding = reference_decoding
+    state = load_checkpoint(checkpoint_path) if resume else None
+    state = state or {"last_id": 0, "processed": 0, "scored": 0, "failed": [], "audio_seconds": 0.0}
+    timings = {"decode_wait": 0.0, "asr": 0.0, "scoring": 0.0, "commit": 0.0}
+    started = time.perf_counter()
+    processed_this_run = 0
+
+    # Échecs de l'exécution précédente: retentés avant de reprendre après last_id
+    retry_ids = [failure["record_id"] for failure in state["failed"]] if resume else []
+
+    # "spawn": les processus de décodage n'héritent pas de l'état du modèle ni des threads PyTorch
+    with get_context("spawn").Pool(processes=workers or os.cpu_count()) as pool:
+        pages = itertools.chain(
+            ((page, True) for page in iter_failed_pages(retry_ids, page_size)),
+            ((page, False) for page in iter_record_pages(state["last_id"], page_size, id_texte, id_eleve))
+        )
+        for page, retry in pages:
+            if limit is not None and processed_this_run >= limit:
+                break
+            if limit is not None:
+                page = page[:limit - processed_this_run]
+            records = {record.id: record for record in page}
+            if retry:
+                # Retiré de la liste; un nouvel échec l'y remet
+                state["failed"] = [failure for failure in state["failed"] if failure["record_id"] not in records]
+
+            # Le décodage de la page entière avance en parallèle pendant les passes du modèle
+            decoded = pool.imap(decode_audio, [(record.id, record.file_path) for record in page])
+            batch_records, batch_arrays = [], []
+            while True:
+                wait_start = time.perf_counter()
+                item = next(decoded, None)
+                timings["decode_wait"] += time.perf_counter() - wait_start
+                if item is not None:
+                    record_id, speech_array, error = item
+                    if error is not None:
+                        state["failed"].append({"record_id": record_id, "error": error})
+                    else:
+                        batch_records.append(records[record_id])
+                        batch_arrays.append(speech_array)
+                        state["audio_seconds"] += len(speech_array) / 16000
+                if batch_records and (len(batch_records) >= batch_size or item is None):
+                    state["scored"] += score_batch(batch_records, batch_arrays, reference_decoding,
+                                                   synthesize, timings)
+                    batch_records, batch_arrays = [], []
+                if item is None:
+                    break
+
+            # Une transaction par page (agrégats de progression ensuite), puis le point de reprise
+            commit_start = time.perf_counter()
+            progress_analytics.commit_with_progress()
+            timings["commit"] += time.perf_counter() - commit_start
+            processed_this_run += len(page)
+            if not retry:
+                # Les enregistrements retentés ont déjà été comptés et sont avant last_id
+                state["processed"] += len(page)
+                state["last_id"] = page[-1].id
+            save_checkpoint(checkpoint_path, state)
+            print(f"... {state['processed']} enregistrements (dernier id={state['last_id']})", flush=True)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "processed": processed_this_run,
+        "processed_total": state["processed"],
+        "scored_total": state["scored"],
+        "failed_total": len(state["failed"]),
+        "last_id": state["last_id"],
+        "elapsed_s": round(elapsed, 3),
+        "records_per_s": round(processed_this_run / elapsed, 3) if elapsed > 0 else 0,
+        "audio_seconds_total": round(state["audio_seconds"], 1),
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in timings.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-transcription et re-notation en masse des enregistrements")
+    parser.add_argument("--batch-size", type=int, default=8, help="Signaux par passe du modèle")
+    parser.add_argument("--page-size", type=int, default=64, help="Enregistrements par transaction")
+    parser.add_argument("--workers", type=int, default=None, help="Processus de décodage (défaut: nombre de cœurs)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--resume", action="store_true", help="Reprend après le dernier point de reprise (retente d'abord les échecs)")
+    parser.add_argument("--id-texte", type=int, default=None)
+    parser.add_argument("--id-eleve", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximal d'enregistrements pour cette exécution")
+    parser.add_argument("--reference-decoding", action="store_true", help="Décodage contraint par le texte attendu")
+    parser.add_argument("--synthesize", action="store_true", help="Génère aussi les audios de correction (Azure)")
+    parser.add_argument("--json", action="store_true", help="Affiche le rapport en JSON")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        report = run_batch_score(
+            batch_size=args.batch_size,
+            page_size=args.page_size,
+            workers=args.workers,
+            checkpoint_path=args.checkpoint,
+            resume=args.resume,
+            id_texte=args.id_texte,
+            id_eleve=args.id_eleve,
+            reference_decoding=args.reference_decoding,
+            synthesize=args.synthesize,
+            limit=args.limit
+        )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("=== Re-notation en masse ===")
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
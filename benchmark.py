@@ -0,0 +1,355 @@
+"""
+Benchmarks par étape du traitement, comparés à une référence enregistrée
+
+Étapes: décodage, analyse de qualité, passe avant ASR, identify_pronunciation_errors,
+calculate_accuracy_score, synthèse avec un synthétiseur factice (aucun appel Azure), coût par
+appel de synthèse avec et sans pool de synthétiseurs connectés (connexion simulée), encodage
+des audios générés (WAV, Opus/OGG, MP3: durée et taille des fichiers) et /upload de bout en bout
+(client de test Flask sur une base SQLite temporaire).
+Les clips de uploads/ et des textes longs synthétiques (graine fixe) servent de données.
+
+Exemples:
+    python benchmark.py --save-baseline                 # enregistre benchmarks/baseline.json
+    python benchmark.py --stages decode,quality,errors  # compare à la référence (code 1 si régression)
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+STAGES = ("decode", "quality", "asr_forward", "errors", "accuracy", "tts_fake", "tts_connect_per_call",
+          "tts_pooled", "encode_wav", "encode_ogg", "encode_mp3", "upload")
+BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+SEED = 1234
+# Établissement simulé d'une connexion au service de synthèse (TLS + WebSocket)
+FAKE_CONNECT_LATENCY = 0.05
+
+# Texte de base (diacritisé) à partir duquel les textes longs synthétiques sont construits
+BASE_TEXT = ("مَحْمُودٌ وَالِدُ زَيْدٍ وهُوَ يَعْمَلُ فِي شَرِيكَةٍ فِي الْعَاصِمَةِ يَعْمَلُ سَبْعَ سَاعَاتٍ فِي الْيَوْمِ "
+             "وهُوَ يُحِبُّ عَمَلَهُ فاطِمَةُ وَالِدَةُ زَيْدٍ وهِيَ طَبِيبَةٌ فِي مُسْتَشْفَى خَاصٍّ الْمُسْتَشْفَى "
+             "قَرِيبٌ مِنَ الْبَيْتِ وَهِيَ تَعْمَلُ صَبَاحًا فَقَطْ")
+DIACRITICS = "ًٌٍَُِّْ"
+
+
+def synthetic_reading(num_words, seed=SEED, error_rate=0.15):
+    """
+    Texte original de num_words mots et une transcription bruitée reproductible
+    (diacritiques retirées, mots omis ou remplacés)
+    """
+    rng = random.Random(seed + num_words)
+    base_words = BASE_TEXT.split()
+    original = [base_words[i % len(base_words)] for i in range(num_words)]
+    transcribed = []
+    for word in original:
+        draw = rng.random()
+        if draw < error_rate / 3:
+            continue
+        if draw < 2 * error_rate / 3:
+            transcribed.append("".join(c for c in word if c not in DIACRITICS))
+        elif draw < error_rate:
+            transcribed.append(rng.choice(base_words))
+        else:
+            transcribed.append(word)
+    return " ".join(original), " ".join(transcribed)
+
+
+def fake_synthesis_corrector(latency=0.0):
+    """
+    AzurePronunciationCorrector dont toutes les synthèses passent par FakeSpeechBackend (latence
+    fixe par appel): mesure l'orchestration sans le réseau
+    """
+    from AzurePronunciationCorrector import AzurePronunciationCorrector
+    from speech_synthesis import FakeSpeechBackend
+
+    return AzurePronunciationCorrector(subscription_key="benchmark", region="benchmark",
+                                       speech_backend=FakeSpeechBackend(latency=latency))
+
+
+def measure(fn, items, repeat):
+    """Durées (s) de fn(item) pour chaque item, repeat fois"""
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    values = np.array(samples) * 1000
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "min_ms": round(float(values.min()), 3)
+    }
+
+
+class BenchmarkContext:
+    """Ressources partagées entre étapes, créées à la demande (modèle, application, signaux)"""
+
+    def __init__(self, files, text_sizes, workdir):
+        self.files = files
+        self.text_sizes = text_sizes
+        self.workdir = workdir
+        self._audio = None
+        self._app = None
+        self._processor = None
+        self._speech_pcm = None
+        self.encoded_sizes = {}
+
+    @property
+    def audio(self):
+        if self._audio is None:
+            import librosa
+            self._audio = [librosa.load(path, sr=16000)[0] for path in self.files]
+        return self._audio
+
+    @property
+    def speech_pcm(self):
+        """PCM int16 à encoder: les clips de uploads/ (vraie parole), sinon des lectures factices"""
+        if self._speech_pcm is None:
+            if self.files:
+                self._speech_pcm = [(np.clip(audio, -1, 1) * 32767).astype(np.int16) for audio in self.audio]
+            else:
+                from speech_synthesis import FakeSpeechBackend, words_ssml
+                backend = FakeSpeechBackend()
+                self._speech_pcm = [backend.synthesize_ssml(words_ssml(synthetic_reading(size)[0].split(),
+                                                                       "ar-SA", "fake")).pcm
+                                    for size in self.text_sizes]
+        return self._speech_pcm
+
+    @property
+    def app_module(self):
+        """Application Flask sur une base SQLite jetable, synthèse factice, dossiers temporaires"""
+        if self._app is None:
+            os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(self.workdir, 'benchmark.db')}"
+            import app as app_module
+            from transcription_cache import TranscriptionCache
+
+            app_module.app.config["UPLOAD_FOLDER"] = os.path.join(self.workdir, "uploads")
+            app_module.AUDIO_CORRECTIONS_FOLDER = os.path.join(self.workdir, "audio_corrections")
+            os.makedirs(app_module.app.config["UPLOAD_FOLDER"], exist_ok=True)
+            app_module.pronunciation_corrector = fake_synthesis_corrector()
+            processor = app_module.processor
+            processor.cache = TranscriptionCache(os.path.join(self.workdir, "transcription_cache"),
+                                                 processor.model_version)
+            with app_module.app.app_context():
+                app_module.db.session.add(app_module.Texte(idTexte=1, texteContent=BASE_TEXT))
+                app_module.db.session.commit()
+            self._app = app_module
+        return self._app
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            self._processor = self.app_module.processor
+        return self._processor
+
+
+def bench_decode(ctx, repeat):
+    import librosa
+    return measure(lambda path: librosa.load(path, sr=16000), ctx.files, repeat)
+
+
+def bench_quality(ctx, repeat):
+    from AudioQualityAnalyzer import AudioQualityAnalyzer
+    analyzer = AudioQualityAnalyzer()
+    return measure(analyzer.analyze_audio_array, ctx.audio, repeat)
+
+
+def bench_asr_forward(ctx, repeat):
+    processor = ctx.processor
+    inputs = [processor.asr_processor(speech_array, sampling_rate=16000, return_tensors="pt").input_values
+              for speech_array in ctx.audio]
+    processor._forward(inputs[0])  # Première passe (allocations, chargement paresseux) hors mesure
+    return measure(processor._forward, inputs, repeat)
+
+
+def bench_errors(ctx, repeat):
+    corrector = fake_synthesis_corrector()
+    readings = [synthetic_reading(size) for size in ctx.text_sizes]
+    return measure(lambda reading: corrector.identify_pronunciation_errors(*reading), readings, repeat)
+
+
+def bench_accuracy(ctx, repeat):
+    from evaluator import ArabicReadingEvaluator
+    evaluator = ArabicReadingEvaluator(api_key="benchmark")
+    readings = [synthetic_reading(size) for size in ctx.text_sizes]
+    return measure(lambda reading: evaluator.calculate_accuracy_score(reading[1], reading[0]), readings, repeat)
+
+
+def bench_tts_fake(ctx, repeat):
+    corrector = fake_synthesis_corrector()
+    output_dir = os.path.join(ctx.workdir, "tts_fake")
+    readings = [synthetic_reading(size) for size in ctx.text_sizes]
+    return measure(lambda reading: corrector.correct_pronunciation(*reading, audio_output_dir=output_dir),
+                   readings, repeat)
+
+
+def bench_tts_connection(pooled):
+    """Synthèse de mots isolés, connexion établie à chaque appel ou synthétiseurs réutilisés"""
+    def bench(ctx, repeat):
+        from speech_synthesis import FakeSpeechBackend, words_ssml
+        backend = FakeSpeechBackend(connect_latency=FAKE_CONNECT_LATENCY, pooled=pooled)
+        documents = [words_ssml([word], "ar-SA", "fake") for word in BASE_TEXT.split()]
+        return measure(backend.synthesize_ssml, documents, repeat)
+    return bench
+
+
+def bench_encode(audio_format):
+    """Étape d'encodage d'un format; les tailles obtenues sont gardées dans ctx.encoded_sizes"""
+    def bench(ctx, repeat):
+        from speech_synthesis import AUDIO_FORMATS, write_audio
+        extension = AUDIO_FORMATS[audio_format]["extension"]
+        paths = [os.path.join(ctx.workdir, f"encode_{i}.{extension}") for i in range(len(ctx.speech_pcm))]
+        samples = measure(lambda i: write_audio(paths[i], ctx.speech_pcm[i], audio_format=audio_format),
+                          range(len(paths)), repeat)
+        ctx.encoded_sizes[audio_format] = sum(os.path.getsize(path) for path in paths)
+        return samples
+    return bench
+
+
+def size_report(encoded_sizes):
+    """Taille totale par format et rapport au WAV"""
+    wav_size = encoded_sizes.get("wav")
+    return {audio_format: {"bytes": size, "ratio_vs_wav": round(size / wav_size, 3) if wav_size else None}
+            for audio_format, size in encoded_sizes.items()}
+
+
+def bench_upload(ctx, repeat):
+    app_module = ctx.app_module
+    client = app_module.app.test_client()
+    from transcription_cache import hash_audio_file
+    hashes = [hash_audio_file(path) for path in ctx.files]
+    payloads = []
+    for path in ctx.files:
+        with open(path, "rb") as f:
+            payloads.append((os.path.basename(path), f.read()))
+
+    def upload(index):
+        # Cache vidé: chaque requête refait décodage, qualité, ASR et correction
+        app_module.processor.cache.invalidate(hashes[index])
+        filename, payload = payloads[index]
+        response = client.post("/upload", data={
+            "file": (io.BytesIO(payload), filename),
+            "id_eleve": "1",
+            "idTexte": "1"
+        }, content_type="multipart/form-data")
+        if response.status_code not in (200, 422):
+            raise RuntimeError(f"/upload a répondu {response.status_code}: {response.get_data(as_text=True)}")
+
+    return measure(upload, range(len(payloads)), repeat)
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "quality": bench_quality,
+    "asr_forward": bench_asr_forward,
+    "errors": bench_errors,
+    "accuracy": bench_accuracy,
+    "tts_fake": bench_tts_fake,
+    "tts_connect_per_call": bench_tts_connection(pooled=False),
+    "tts_pooled": bench_tts_connection(pooled=True),
+    "encode_wav": bench_encode("wav"),
+    "encode_ogg": bench_encode("ogg"),
+    "encode_mp3": bench_encode("mp3"),
+    "upload": bench_upload
+}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit or None
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Étapes dont le p50 dépasse celui de la référence de plus de tolerance (fraction)"""
+    regressions = []
+    for stage, current in results["stages"].items():
+        reference = baseline.get("stages", {}).get(stage)
+        if not reference or not reference.get("p50_ms"):
+            continue
+        ratio = current["p50_ms"] / reference["p50_ms"]
+        current["baseline_p50_ms"] = reference["p50_ms"]
+        current["ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks par étape du traitement audio")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Étapes séparées par des virgules ({', '.join(STAGES)})")
+    parser.add_argument("--files", default="uploads/*.ogg", help="Motif glob des clips audio")
+    parser.add_argument("--max-files", type=int, default=5)
+    parser.add_argument("--text-words", default="50,200,1000", help="Tailles des textes synthétiques (mots)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Régression tolérée sur le p50 (0.25 = +25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="Enregistre les résultats comme nouvelle référence")
+    parser.add_argument("--output", default=None, help="Écrit les résultats JSON dans ce fichier")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Étapes inconnues: {', '.join(unknown)}")
+    files = sorted(glob.glob(args.files))[:args.max_files]
+    if not files and set(stages) & {"decode", "quality", "asr_forward", "upload"}:
+        parser.error(f"Aucun fichier ne correspond à {args.files}")
+
+    results = {"environment": environment(), "repeat": args.repeat, "files": files,
+               "text_words": [int(size) for size in args.text_words.split(",")], "stages": {}}
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as workdir:
+        ctx = BenchmarkContext(files, results["text_words"], workdir)
+        for stage in stages:
+            print(f"... {stage}", flush=True)
+            results["stages"][stage] = summarize(BENCHMARKS[stage](ctx, args.repeat))
+        if ctx.encoded_sizes:
+            results["audio_formats"] = size_report(ctx.encoded_sizes)
+
+    regressions = []
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Référence enregistrée dans {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    else:
+        print(f"Aucune référence ({args.baseline}); lancez avec --save-baseline pour en créer une")
+    results["regressions"] = regressions
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    print(json.dumps(results["stages"], indent=2))
+    if "audio_formats" in results:
+        print(json.dumps(results["audio_formats"], indent=2))
+    if regressions:
+        print(f"Régressions (> +{args.tolerance:.0%} sur le p50): {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import numpy as np
+
+
+def log_softmax(logits):
+    """Log-softmax sur le dernier axe (logits T x V)"""
+    logits = np.asarray(logits, dtype=np.float32)
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+def frame_runs(predicted_ids):
+    """
+    Regroupe les trames consécutives de même identifiant (chemin CTC glouton)
+
+    Returns:
+        (starts, ends, run_ids): bornes [start, end) de chaque run et son identifiant
+    """
+    predicted_ids = np.asarray(predicted_ids)
+    n_frames = predicted_ids.shape[0]
+    if n_frames == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    change = np.empty(n_frames, dtype=bool)
+    change[0] = True
+    np.not_equal(predicted_ids[1:], predicted_ids[:-1], out=change[1:])
+
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], n_frames)
+    return starts, ends, predicted_ids[starts]
+
+
+def greedy_word_segments(log_probs, id_to_token, blank_id, delimiter_id, frame_duration, special_ids=()):
+    """
+    Calcule les mots du décodage CTC glouton avec leurs temps de début/fin et leur confiance
+
+    Args:
+        log_probs: log-probabilités par trame (T x V)
+        id_to_token: tableau (V,) des tokens du vocabulaire
+        blank_id: identifiant du blank CTC (pad du tokenizer)
+        delimiter_id: identifiant du séparateur de mots ("|")
+        frame_duration: durée d'une trame de sortie en secondes
+        special_ids: autres identifiants à ignorer (<s>, </s>, <unk>...)
+
+    Returns:
+        Liste de dicts {"word", "start", "end", "confidence"}
+    """
+    log_probs = np.asarray(log_probs, dtype=np.float32)
+    predicted_ids = log_probs.argmax(axis=-1)
+    frame_confidence = np.exp(log_probs.max(axis=-1))
+
+    starts, ends, run_ids = frame_runs(predicted_ids)
+    if run_ids.size == 0:
+        return []
+
+    # Chaque séparateur ouvre un nouveau mot
+    word_index = np.cumsum(run_ids == delimiter_id)
+    ignored = np.array([blank_id, delimiter_id, *special_ids])
+    is_char = ~np.isin(run_ids, ignored)
+    if not is_char.any():
+        return []
+
+    char_starts = starts[is_char]
+    char_ends = ends[is_char]
+    char_ids = run_ids[is_char]
+    _, first, inverse = np.unique(word_index[is_char], return_index=True, return_inverse=True)
+
+    # Confiance moyenne sur les trames émettrices de chaque mot
+    cumulative = np.concatenate(([0.0], np.cumsum(frame_confidence, dtype=np.float64)))
+    run_conf = cumulative[char_ends] - cumulative[char_starts]
+    run_len = (char_ends - char_starts).astype(np.float64)
+    word_conf = np.bincount(inverse, weights=run_conf) / np.bincount(inverse, weights=run_len)
+
+    word_start = char_starts[first]
+    word_end = np.maximum.reduceat(char_ends, first)
+    boundaries = np.append(first, char_ids.size)
+
+    tokens = np.asarray(id_to_token, dtype=object)[char_ids]
+    words = []
+    for i in range(first.size):
+        words.append({
+            "word": "".join(tokens[boundaries[i]:boundaries[i + 1]]),
+            "start": round(float(word_start[i] * frame_duration), 3),
+            "end": round(float(word_end[i] * frame_duration), 3),
+            "confidence": round(float(word_conf[i]), 4)
+        })
+    return words
+
+
+def ctc_forced_align(log_probs, target_ids, blank_id):
+    """
+    Alignement forcé CTC (Viterbi) d'une séquence cible sur les trames
+
+    Returns:
+        Tableau (T,) des états étendus (pair = blank, impair = token (s - 1) // 2),
+        ou None si la séquence ne tient pas dans le nombre de trames
+    """
+    log_probs = np.asarray(log_probs, dtype=np.float32)
+    n_frames = log_probs.shape[0]
+    target_ids = np.asarray(target_ids, dtype=np.int64)
+    n_states = 2 * target_ids.size + 1
+    if n_frames == 0 or target_ids.size == 0:
+        return None
+
+    extended = np.full(n_states, blank_id, dtype=np.int64)
+    extended[1::2] = target_ids
+    # Saut de deux états autorisé vers un token différent du token précédent
+    can_skip = np.zeros(n_states, dtype=bool)
+    can_skip[3::2] = extended[3::2] != extended[1:-2:2]
+
+    emissions = log_probs[:, extended]
+    neg_inf = np.float32(-1e30)
+    alpha = np.full(n_states, neg_inf, dtype=np.float32)
+    alpha[0] = emissions[0, 0]
+    alpha[1] = emissions[0, 1]
+    backpointers = np.zeros((n_frames, n_states), dtype=np.int8)
+    candidates = np.full((3, n_states), neg_inf, dtype=np.float32)
+    state_index = np.arange(n_states)
+
+    for t in range(1, n_frames):
+        candidates[0] = alpha
+        candidates[1, 1:] = alpha[:-1]
+        candidates[2, 2:] = np.where(can_skip[2:], alpha[:-2], neg_inf)
+        best = candidates.argmax(axis=0)
+        alpha = candidates[best, state_index] + emissions[t]
+        backpointers[t] = best
+
+    last = n_states - 1 if alpha[-1] >= alpha[-2] else n_states - 2
+    if alpha[last] < neg_inf / 2:
+        return None
+
+    states = np.empty(n_frames, dtype=np.int64)
+    states[-1] = last
+    for t in range(n_frames - 1, 0, -1):
+        states[t - 1] = states[t] - backpointers[t, states[t]]
+    return states
+
+
+def reference_word_alignment(log_probs, reference_words, char_to_id, id_to_token, blank_id, delimiter_id,
+                             frame_duration, special_ids=(), deviation_margin=0.35):
+    """
+    Décodage contraint par le texte de référence
+
+    Le texte attendu est aligné de force sur le treillis CTC. Pour chaque mot, le score du
+    chemin forcé est comparé au meilleur chemin libre sur les mêmes trames: si l'écart moyen
+    par trame dépasse deviation_margin, le mot est considéré comme mal lu. Chaque caractère du
+    chemin libre est attribué à un seul mot (le premier dont son run recouvre des trames): un mot
+    mal lu qui n'a aucun caractère en propre est omis (le chemin forcé a pris les trames d'un
+    voisin), sinon substitué. Les caractères du chemin libre entre deux mots sont rapportés
+    comme insertions.
+
+    Args:
+        reference_words: mots du texte de référence (texte.split())
+        char_to_id: vocabulaire du tokenizer (caractère -> identifiant)
+
+    Returns:
+        Dict {"transcription", "words", "reference_alignment", "pronunciation_scores"}
+        ou None si l'alignement est impossible
+    """
+    log_probs = np.asarray(log_probs, dtype=np.float32)
+    ignored = np.array([blank_id, delimiter_id, *special_ids])
+    target, token_word, word_slots = _reference_target(reference_words, char_to_id, ignored, delimiter_id)
+    if not word_slots:
+        return None
+
+    states = ctc_forced_align(log_probs, target, blank_id)
+    if states is None:
+        return None
+
+    n_frames = log_probs.shape[0]
+    frame_index = np.arange(n_frames)
+    extended = np.full(2 * len(target) + 1, blank_id, dtype=np.int64)
+    extended[1::2] = target
+    forced_logp = log_probs[frame_index, extended[states]]
+    greedy_ids = log_probs.argmax(axis=-1)
+    greedy_logp = log_probs[frame_index, greedy_ids]
+    greedy_conf = np.exp(greedy_logp)
+
+    # Mot de chaque trame (-1 pour blank et délimiteur)
+    token_word = np.asarray(token_word, dtype=np.int64)
+    frame_word = np.where(states % 2 == 1, token_word[(states - 1) // 2], -1)
+    word_frames = np.flatnonzero(frame_word >= 0)
+    _, first = np.unique(frame_word[word_frames], return_index=True)
+    span_start = word_frames[first]
+    span_end = np.maximum.reduceat(word_frames, first) + 1
+
+    forced_cum = np.concatenate(([0.0], np.cumsum(forced_logp, dtype=np.float64)))
+    greedy_cum = np.concatenate(([0.0], np.cumsum(greedy_logp, dtype=np.float64)))
+    conf_cum = np.concatenate(([0.0], np.cumsum(greedy_conf, dtype=np.float64)))
+    span_len = (span_end - span_start).astype(np.float64)
+    forced_score = (forced_cum[span_end] - forced_cum[span_start]) / span_len
+    deviation = (greedy_cum[span_end] - greedy_cum[span_start]) / span_len - forced_score
+
+    # Chaque run du chemin libre appartient à un seul segment: le premier mot dont il recouvre
+    # des trames, sinon l'intervalle entre deux mots (insertion). Un run qui déborde sur le mot
+    # suivant n'y est donc ni répété, ni pris pour la lecture de ce mot.
+    run_starts, run_ends, run_ids = frame_runs(greedy_ids)
+    emitting = ~np.isin(run_ids, ignored)
+    run_starts, run_ends, run_ids = run_starts[emitting], run_ends[emitting], run_ids[emitting]
+    frame_slot = np.full(n_frames + 1, -1, dtype=np.int64)
+    for slot in range(len(word_slots)):
+        frame_slot[span_start[slot]:span_end[slot]] = slot
+    # Première trame d'un mot à partir de chaque trame (n_frames s'il n'y en a plus)
+    next_word_frame = np.where(frame_slot >= 0, np.arange(n_frames + 1), n_frames)
+    next_word_frame = np.minimum.accumulate(next_word_frame[::-1])[::-1]
+    first_word_frame = next_word_frame[run_starts]
+    run_slot = np.where(first_word_frame < run_ends, frame_slot[first_word_frame], -1)
+    run_gap = np.searchsorted(span_start, run_starts, side="right")  # Insertion avant le mot run_gap
+
+    tokens = np.asarray(id_to_token, dtype=object)
+    words, alignment = [], []
+
+    def add_insertion(gap):
+        inserted = np.flatnonzero((run_slot < 0) & (run_gap == gap))
+        if inserted.size:
+            start, end = int(run_starts[inserted[0]]), int(run_ends[inserted[-1]])
+            words.append({
+                "word": "".join(tokens[run_ids[inserted]]),
+                "start": round(float(start * frame_duration), 3),
+                "end": round(float(end * frame_duration), 3),
+                "confidence": round(float((conf_cum[end] - conf_cum[start]) / (end - start)), 4),
+                "status": "inserted"
+            })
+
+    for slot, (reference_index, ids) in enumerate(word_slots):
+        start, end = int(span_start[slot]), int(span_end[slot])
+        add_insertion(slot)
+
+        expected = "".join(tokens[ids])
+        own_runs = np.flatnonzero(run_slot == slot)
+        spoken = "".join(tokens[run_ids[own_runs]])
+        if spoken == expected or (own_runs.size and deviation[slot] <= deviation_margin):
+            status, word, confidence = "match", expected, float(np.exp(forced_score[slot]))
+        elif own_runs.size:
+            status, word = "substituted", spoken
+            confidence = float((conf_cum[end] - conf_cum[start]) / (end - start))
+        else:
+            # Aucun caractère émis en propre sur les trames du mot: le chemin forcé n'a fait
+            # qu'emprunter celles d'un voisin ou du silence
+            status, word, confidence = "omitted", "", 0.0
+
+        entry = {
+            "reference_index": reference_index,
+            "expected": expected,
+            "word": word,
+            "status": status,
+            "start": round(float(start * frame_duration), 3),
+            "end": round(float(end * frame_duration), 3),
+            "confidence": round(confidence, 4)
+        }
+        alignment.append(entry)
+        if word:
+            words.append({key: entry[key] for key in ("word", "start", "end", "confidence", "status")})
+    add_insertion(len(word_slots))
+
+    return {
+        "transcription": " ".join(w["word"] for w in words),
+        "words": words,
+        "reference_alignment": alignment,
+        # Même chemin forcé: le score GOP ne coûte pas un second alignement
+        "pronunciation_scores": _gop_from_states(log_probs, states, target, token_word, word_slots, tokens)
+    }
+
+
+def _reference_target(reference_words, char_to_id, ignored, delimiter_id):
+    """
+    Cible de l'alignement forcé: caractères connus du modèle, mots séparés par le délimiteur
+
+    Returns:
+        (target, token_word, word_slots): identifiants cibles, mot de chaque token (-1 pour
+        le délimiteur) et (indice dans reference_words, identifiants) de chaque mot aligné
+    """
+    target, token_word, word_slots = [], [], []
+    for index, word in enumerate(reference_words):
+        ids = [char_to_id[c] for c in word if c in char_to_id and char_to_id[c] not in ignored]
+        if not ids:
+            continue
+        if target:
+            target.append(delimiter_id)
+            token_word.append(-1)
+        target.extend(ids)
+        token_word.extend([len(word_slots)] * len(ids))
+        word_slots.append((index, ids))
+    return target, token_word, word_slots
+
+
+def _gop_from_states(log_probs, states, target, token_word, word_slots, tokens):
+    """
+    Scores GOP par caractère et par mot à partir d'un chemin forcé
+
+    GOP d'un caractère: moyenne, sur les trames que le chemin forcé lui attribue, de
+    log P(caractère attendu) - max log P (0 quand le caractère attendu est aussi le plus
+    probable). Le score publié est exp(GOP), entre 0 et 1; celui d'un mot est exp de la
+    moyenne des GOP de ses caractères.
+    """
+    n_tokens = len(target)
+    token_frames = np.flatnonzero(states % 2 == 1)
+    token_of_frame = (states[token_frames] - 1) // 2
+    target = np.asarray(target, dtype=np.int64)
+    frame_gop = (log_probs[token_frames, target[token_of_frame]]
+                 - log_probs[token_frames].max(axis=-1)).astype(np.float64)
+    # Chaque token du chemin forcé occupe au moins une trame
+    token_gop = (np.bincount(token_of_frame, weights=frame_gop, minlength=n_tokens)
+                 / np.maximum(np.bincount(token_of_frame, minlength=n_tokens), 1))
+
+    token_word = np.asarray(token_word, dtype=np.int64)
+    is_char = token_word >= 0
+    word_gop = (np.bincount(token_word[is_char], weights=token_gop[is_char], minlength=len(word_slots))
+                / np.bincount(token_word[is_char], minlength=len(word_slots)))
+    char_score = np.exp(token_gop)
+    word_score = np.exp(word_gop)
+
+    char_positions = np.flatnonzero(is_char)
+    word_positions = np.split(char_positions, np.flatnonzero(np.diff(token_word[is_char])) + 1)
+    scores = []
+    for slot, ((reference_index, ids), positions) in enumerate(zip(word_slots, word_positions)):
+        scores.append({
+            "reference_index": reference_index,
+            "expected": "".join(tokens[ids]),
+            "score": round(float(word_score[slot]), 4),
+            "characters": [{"char": tokens[target[p]], "score": round(float(char_score[p]), 4)}
+                           for p in positions]
+        })
+    return scores
+
+
+def gop_scores(log_probs, reference_words, char_to_id, id_to_token, blank_id, delimiter_id, special_ids=()):
+    """
+    Scores de prononciation (goodness of pronunciation) du texte attendu, sans décodage contraint
+
+    Utilisé quand la transcription reste gloutonne: le texte attendu est aligné de force sur
+    les log-probabilités déjà calculées par la passe du modèle (aucune inférence supplémentaire).
+
+    Returns:
+        Liste de dicts {"reference_index", "expected", "score", "characters": [{"char", "score"}]},
+        ou None si le texte ne peut pas être aligné
+    """
+    log_probs = np.asarray(log_probs, dtype=np.float32)
+    ignored = np.array([blank_id, delimiter_id, *special_ids])
+    target, token_word, word_slots = _reference_target(reference_words, char_to_id, ignored, delimiter_id)
+    if not word_slots:
+        return None
+    states = ctc_forced_align(log_probs, target, blank_id)
+    if states is None:
+        return None
+    return _gop_from_states(log_probs, states, target, token_word, word_slots,
+                            np.asarray(id_to_token, dtype=object))
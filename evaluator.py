@@ -3,11 +3,14 @@ import google.generativeai as genai
 import json
 import difflib
 import re
+import numpy as np
 from typing import Dict, List, Any
 import os
 from dataclasses import dataclass
 from enum import Enum
 
+import metrics
+
 class ReadingLevel(Enum):
     EXCELLENT = "ممتاز"
     VERY_GOOD = "جيد جداً"
@@ -66,6 +69,7 @@ class ArabicReadingEvaluator:
         """Remove Arabic diacritics from text"""
         return self.diacritics_pattern.sub('', text)
     
+    @metrics.timed("accuracy_score")
     def calculate_accuracy_score(self, transcription: str, original_text: str) -> Dict[str, Any]:
         """Calculate detailed accuracy metrics"""
         # Normalize both texts
@@ -111,9 +115,17 @@ class ArabicReadingEvaluator:
             "extra_words": max(0, len(trans_words) - total_words)
         }
     
-    def create_evaluation_prompt(self, transcription: str, original_text: str, accuracy_metrics: Dict) -> str:
+    def create_evaluation_prompt(self, transcription: str, original_text: str, accuracy_metrics: Dict,
+                                 reading_statistics: Dict = None) -> str:
         """Create a comprehensive prompt for LLM evaluation"""
         
+        timing_section = ""
+        if reading_statistics and reading_statistics.get("timing_source") == "measured":
+            timing_section = f"""
+- زمن القراءة: {reading_statistics['estimated_reading_time']:.1f} ثانية
+- سرعة القراءة: {reading_statistics['words_per_minute']:.0f} كلمة في الدقيقة
+- عدد الوقفات الطويلة: {reading_statistics['pause_count']}"""
+        
         prompt = f"""
 أنت خبير في تقييم قراءة النصوص العربية للطلاب. قم بتقييم قراءة الطالب بناءً على النص الأصلي والنص المنطوق.
 
@@ -137,7 +149,7 @@ class ArabicReadingEvaluator:
 - إجمالي الكلمات المنطوقة: {accuracy_metrics['total_words_transcribed']}
 - الكلمات الصحيحة: {accuracy_metrics['correct_words']}
 - الكلمات المفقودة: {accuracy_metrics['missing_words']}
-- الكلمات الزائدة: {accuracy_metrics['extra_words']}
+- الكلمات الزائدة: {accuracy_metrics['extra_words']}{timing_section}
 
 المطلوب منك:
 1. تقييم شامل للقراءة مع درجة من 100 لكل معيار
@@ -187,13 +199,21 @@ class ArabicReadingEvaluator:
         else:
             return ReadingLevel.POOR
     
-    def evaluate_reading(self, transcription: str, original_text: str) -> ReadingEvaluation:
+    @metrics.external_call("gemini")
+    def _generate(self, prompt: str):
+        """Single Gemini call (timed and counted in /metrics)"""
+        return self.model.generate_content(prompt)
+    
+    @metrics.timed("evaluate_reading")
+    def evaluate_reading(self, transcription: str, original_text: str,
+                         word_timings: List[Dict[str, Any]] = None) -> ReadingEvaluation:
         """
         Evaluate Arabic reading using LLM
         
         Args:
             transcription: The transcribed audio text
             original_text: The original text that should be read
+            word_timings: Optional per-word timings from the ASR stage
             
         Returns:
             ReadingEvaluation object with detailed assessment
@@ -201,12 +221,13 @@ class ArabicReadingEvaluator:
         try:
             # Calculate accuracy metrics first
             accuracy_metrics = self.calculate_accuracy_score(transcription, original_text)
+            reading_statistics = self.calculate_reading_statistics(transcription, original_text, word_timings)
             
             # Create evaluation prompt
-            prompt = self.create_evaluation_prompt(transcription, original_text, accuracy_metrics)
+            prompt = self.create_evaluation_prompt(transcription, original_text, accuracy_metrics, reading_statistics)
             
             # Generate evaluation using Gemini
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             
             # Extract JSON from response
             response_text = response.text
@@ -242,7 +263,7 @@ class ArabicReadingEvaluator:
                 detailed_feedback={
                     'llm_analysis': llm_evaluation,
                     'accuracy_metrics': accuracy_metrics,
-                    'reading_statistics': self.calculate_reading_statistics(transcription, original_text)
+                    'reading_statistics': reading_statistics
                 },
                 suggestions=llm_evaluation.get('suggestions', []),
                 strengths=llm_evaluation.get('strengths', []),
@@ -345,8 +366,16 @@ class ArabicReadingEvaluator:
         
         return "\n".join(feedback_parts)
     
-    def calculate_reading_statistics(self, transcription: str, original_text: str) -> Dict[str, Any]:
-        """Calculate additional reading statistics"""
+    def calculate_reading_statistics(self, transcription: str, original_text: str,
+                                     word_timings: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Calculate additional reading statistics
+
+        Args:
+            word_timings: Optional per-word timings from the ASR stage
+                ([{"word", "start", "end", "confidence"}, ...]). When given, reading time
+                and words per minute are measured instead of estimated.
+        """
         
         # Clean texts
         clean_trans = self.normalize_arabic_text(transcription)
@@ -360,18 +389,49 @@ class ArabicReadingEvaluator:
         trans_chars = len(self.arabic_letters_pattern.findall(clean_trans))
         orig_chars = len(self.arabic_letters_pattern.findall(clean_orig))
         
-        # Calculate reading speed (assuming 1 word per second as baseline)
-        estimated_reading_time = len(orig_words) * 1.0  # seconds
-        
-        return {
+        statistics = {
             "original_word_count": len(orig_words),
             "transcribed_word_count": len(trans_words),
             "original_char_count": orig_chars,
             "transcribed_char_count": trans_chars,
             "word_completion_rate": (len(trans_words) / len(orig_words) * 100) if orig_words else 0,
             "char_completion_rate": (trans_chars / orig_chars * 100) if orig_chars else 0,
+        }
+        
+        if word_timings:
+            statistics.update(self.calculate_timing_statistics(word_timings))
+            return statistics
+        
+        # Calculate reading speed (assuming 1 word per second as baseline)
+        estimated_reading_time = len(orig_words) * 1.0  # seconds
+        statistics.update({
+            "timing_source": "estimated",
             "estimated_reading_time": estimated_reading_time,
             "words_per_minute": (len(trans_words) / estimated_reading_time * 60) if estimated_reading_time > 0 else 0
+        })
+        return statistics
+    
+    def calculate_timing_statistics(self, word_timings: List[Dict[str, Any]],
+                                    pause_threshold: float = 0.5) -> Dict[str, Any]:
+        """Fluency metrics from measured word start/end times (seconds)"""
+        starts = np.array([w["start"] for w in word_timings], dtype=np.float64)
+        ends = np.array([w["end"] for w in word_timings], dtype=np.float64)
+        
+        reading_time = float(ends[-1] - starts[0])
+        speaking_time = float(np.sum(ends - starts))
+        gaps = starts[1:] - ends[:-1]
+        pauses = gaps[gaps >= pause_threshold]
+        word_count = len(word_timings)
+        
+        return {
+            "timing_source": "measured",
+            "estimated_reading_time": reading_time,
+            "words_per_minute": (word_count / reading_time * 60) if reading_time > 0 else 0,
+            "articulation_rate": (word_count / speaking_time * 60) if speaking_time > 0 else 0,
+            "pause_count": int(pauses.size),
+            "total_pause_time": float(pauses.sum()),
+            "longest_pause": float(pauses.max()) if pauses.size else 0.0,
+            "mean_word_duration": speaking_time / word_count if word_count else 0
         }
     
     def create_fallback_evaluation(self, transcription: str, original_text: str, error_msg: str) -> ReadingEvaluation:
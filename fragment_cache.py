@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import metrics
+from audio_files import temp_path
+from speech_synthesis import SAMPLE_RATE, SpeechBackend, save_word_index, word_index_path, word_spans, words_ssml
+
+
+class FragmentCache:
+    """
+    PCM de fragments déjà synthétisés (phrases fixes du feedback, mots), par voix, débit et texte
+
+    Les fragments sont gardés en mémoire (LRU) et, si directory est fourni, sur disque en .npy:
+    les phrases fixes ne sont synthétisées qu'une fois, même après un redémarrage.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 2048):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _key(text: str, voice_name: str, rate: str) -> str:
+        return hashlib.sha1(f"{voice_name}|{rate}|{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, text: str, voice_name: str, rate: str = "medium") -> Optional[np.ndarray]:
+        key = self._key(text, voice_name, rate)
+        with self._lock:
+            pcm = self._fragments.get(key)
+            if pcm is not None:
+                self._fragments.move_to_end(key)
+                return pcm
+        if self.directory and os.path.exists(self._path(key)):
+            try:
+                pcm = np.load(self._path(key))
+            except (OSError, ValueError):
+                return None
+            self._remember(key, pcm)
+            return pcm
+        return None
+
+    def put(self, text: str, voice_name: str, rate: str, pcm: np.ndarray) -> np.ndarray:
+        key = self._key(text, voice_name, rate)
+        pcm = np.array(pcm, dtype=np.int16)  # Copie: le tampon d'origine peut être une vue ou un memmap
+        self._remember(key, pcm)
+        if self.directory:
+            # Écriture atomique: un autre processus peut lire le même fragment
+            temp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, pcm)
+            os.replace(temp_path, self._path(key))
+        return pcm
+
+    def _remember(self, key: str, pcm: np.ndarray):
+        with self._lock:
+            self._fragments[key] = pcm
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def fetch(self, texts: List[str], backend: SpeechBackend, language: str, voice_name: str,
+              rate: str = "medium") -> Optional[Dict[str, np.ndarray]]:
+        """
+        PCM de chaque texte; les fragments absents du cache sont synthétisés en un seul appel
+        (signets SSML) puis ajoutés au cache. None si cette synthèse échoue.
+        """
+        fragments, missing = {}, []
+        for text in dict.fromkeys(texts):
+            pcm = self.get(text, voice_name, rate)
+            metrics.cache_lookup("tts_fragment", pcm is not None)
+            if pcm is None:
+                missing.append(text)
+            else:
+                fragments[text] = pcm
+
+        if missing:
+            synthesized = self.synthesize(missing, backend, language, voice_name, rate)
+            if synthesized is None:
+                return None
+            fragments.update(synthesized)
+        return fragments
+
+    @metrics.timed("tts_fragments")
+    def synthesize(self, texts: List[str], backend: SpeechBackend, language: str, voice_name: str,
+                   rate: str = "medium") -> Optional[Dict[str, np.ndarray]]:
+        """Synthétise texts en un appel (signets SSML) et les ajoute au cache; None si les signets manquent"""
+        result = backend.synthesize_ssml(words_ssml(texts, language, voice_name, rate=rate, break_ms=300))
+        spans = word_spans(result, len(texts))
+        if spans is None:
+            return None
+        if not result.cacheable:
+            # Moteur de secours: utilisable pour cet appel, mais pas gardé
+            return {text: result.slice(start, end) for text, (start, end) in zip(texts, spans)}
+        return {text: self.put(text, voice_name, rate, result.slice(start, end))
+                for text, (start, end) in zip(texts, spans)}
+
+
+class ReadingCache:
+    """
+    Lectures complètes déjà synthétisées (PCM brut et index des mots), par voix, débit et texte vocalisé
+
+    Un texte n'est synthétisé qu'une fois par voix: les envois suivants projettent en mémoire le
+    même PCM pour écrire leur lecture et découper les extraits. Une entrée est écrite sous un nom
+    temporaire unique puis renommée, l'index en dernier: une entrée dont l'index existe est complète,
+    et un fichier déjà projeté par un autre envoi n'est jamais réécrit.
+    """
+
+    def __init__(self, directory: str = "tts_readings", max_entries: int = 256):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, text: str, voice_name: str, rate: str = "medium") -> str:
+        """Source PCM de la lecture (load_reading_pcm); son index est à côté (word_index_path)"""
+        return os.path.join(self.directory, f"{FragmentCache._key(text, voice_name, rate)}.pcm")
+
+    def get(self, text: str, voice_name: str, rate: str = "medium") -> Optional[str]:
+        path = self.path(text, voice_name, rate)
+        try:
+            os.utime(word_index_path(path))  # Ordre LRU de l'éviction
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, text: str, voice_name: str, rate: str, pcm: np.ndarray, index: List[Dict],
+            sample_rate: int = SAMPLE_RATE) -> str:
+        path = self.path(text, voice_name, rate)
+        temp = temp_path(path)
+        try:
+            np.ascontiguousarray(pcm, dtype=np.int16).tofile(temp)
+            save_word_index(temp, index, sample_rate)
+            os.replace(temp, path)
+            os.replace(word_index_path(temp), word_index_path(path))
+        finally:
+            for leftover in (temp, word_index_path(temp)):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self._evict()
+        return path
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".words.json") and ".tmp" not in name:
+                    try:
+                        entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                    except FileNotFoundError:
+                        pass
+            entries.sort()
+            for _, name in entries[:max(0, len(entries) - self.max_entries)]:
+                # Index d'abord: l'entrée disparaît avant son PCM (un memmap ouvert reste lisible)
+                index_path = os.path.join(self.directory, name)
+                for path in (index_path, index_path[:-len(".words.json")] + ".pcm"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+
+def assemble(fragments: List[np.ndarray], pauses_ms: List[int], sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Concatène des fragments PCM avec un silence de pauses_ms[i] après le fragment i"""
+    chunks = []
+    for pcm, pause_ms in zip(fragments, pauses_ms):
+        chunks.append(pcm)
+        if pause_ms:
+            chunks.append(np.zeros(int(pause_ms * sample_rate / 1000), dtype=np.int16))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
@@ -0,0 +1,128 @@
+"""
+Test de charge de /upload: envoie des fichiers audio en parallèle et affiche la latence p50/p99
+
+Par défaut, chaque requête envoie un contenu unique (octets aléatoires ajoutés après le flux
+audio, ignorés par le décodeur): le cache de transcriptions, indexé par l'empreinte du fichier,
+ne peut donc pas répondre sans inférence, et la latence mesure bien la concurrence sur les
+slots du modèle. --reuse-payloads renvoie les fichiers tels quels pour mesurer le cache.
+
+Exemple:
+    python load_test.py --url http://127.0.0.1:5005/upload --concurrency 8 --requests 64
+"""
+import argparse
+import glob
+import json
+import mimetypes
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def build_multipart(file_path, fields, unique=True):
+    """
+    Construit un corps multipart/form-data (bibliothèque standard uniquement)
+
+    Avec unique, 16 octets aléatoires sont ajoutés au fichier et son nom reçoit un suffixe
+    aléatoire: ni le cache de transcriptions ni un fichier déjà envoyé ne sont réutilisés.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode("utf-8")
+        )
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    with open(file_path, "rb") as f:
+        payload = f.read()
+    filename = os.path.basename(file_path)
+    if unique:
+        payload += os.urandom(16)
+        stem, extension = os.path.splitext(filename)
+        filename = f"{stem}_{uuid.uuid4().hex[:8]}{extension}"
+    parts.append(
+        (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+         f"filename=\"{filename}\"\r\nContent-Type: {content_type}\r\n\r\n").encode("utf-8")
+        + payload + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def send_upload(url, file_path, fields, timeout, unique=True):
+    body, content_type = build_multipart(file_path, fields, unique)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'endpoint /upload")
+    parser.add_argument("--url", default="http://127.0.0.1:5005/upload")
+    parser.add_argument("--files", default="uploads/*.ogg", help="Motif glob des fichiers à envoyer")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--id-eleve", default="1")
+    parser.add_argument("--id-texte", default="1")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--reuse-payloads", action="store_true",
+                        help="Renvoie les fichiers tels quels (réponses servies par le cache de transcriptions)")
+    parser.add_argument("--json", action="store_true", help="Affiche le résumé en JSON")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.files))
+    if not files:
+        parser.error(f"Aucun fichier ne correspond à {args.files}")
+
+    fields = {"id_eleve": args.id_eleve, "idTexte": args.id_texte}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(send_upload, args.url, files[i % len(files)], fields, args.timeout,
+                        not args.reuse_payloads)
+            for i in range(args.requests)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    statuses = np.array([status for status, _ in results])
+    latencies = np.array([latency for status, latency in results if status == 200])
+    summary = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "unique_payloads": not args.reuse_payloads,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 3) if elapsed > 0 else 0,
+        "status_counts": {str(code): int(count) for code, count in zip(*np.unique(statuses, return_counts=True))},
+    }
+    if latencies.size:
+        summary.update({
+            "p50_s": round(float(np.percentile(latencies, 50)), 3),
+            "p90_s": round(float(np.percentile(latencies, 90)), 3),
+            "p99_s": round(float(np.percentile(latencies, 99)), 3),
+            "max_s": round(float(latencies.max()), 3)
+        })
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print("=== Test de charge /upload ===")
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class ExecutorBusyError(Exception):
+    """Levée quand la file d'attente d'inférence est pleine"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _pin_torch_threads(num_threads):
+    # Appelé dans chaque thread d'inférence: le nombre de threads intra-op est fixé par slot
+    torch.set_num_threads(num_threads)
+
+
+class ModelExecutor:
+    """
+    Exécute les passes du modèle ASR sur un nombre fixe de slots d'inférence
+
+    Chaque slot est un thread dédié dont le nombre de threads PyTorch intra-op est fixé,
+    de sorte que slots * threads_per_slot ne dépasse pas le nombre de cœurs, quel que soit
+    le nombre de requêtes Flask concurrentes. Au-delà de max_queue_depth requêtes en
+    attente, ExecutorBusyError est levée au lieu d'allonger la file.
+    """
+
+    def __init__(self, slots=None, threads_per_slot=None, max_queue_depth=8, retry_after=5):
+        cores = os.cpu_count() or 1
+        self.slots = slots or max(1, cores // 4)
+        self.threads_per_slot = threads_per_slot or max(1, cores // self.slots)
+        self.max_queue_depth = max_queue_depth
+        self.retry_after = retry_after
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.slots,
+            thread_name_prefix="asr-slot",
+            initializer=_pin_torch_threads,
+            initargs=(self.threads_per_slot,)
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def saturated(self):
+        """True si une nouvelle requête serait refusée"""
+        with self._lock:
+            return self._pending >= self.slots + self.max_queue_depth
+
+    def run(self, fn, *args, **kwargs):
+        """Exécute fn dans un slot d'inférence et attend son résultat"""
+        with self._lock:
+            if self._pending >= self.slots + self.max_queue_depth:
+                raise ExecutorBusyError(self.retry_after)
+            self._pending += 1
+
+        try:
+            return self._pool.submit(fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "slots": self.slots,
+            "threads_per_slot": self.threads_per_slot,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": min(pending, self.slots),
+            "queued": max(0, pending - self.slots)
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
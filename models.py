@@ -0,0 +1,218 @@
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+# Updated Recorder model to store pronunciation correction results
+class Recorder(db.Model):
+    __tablename__ = 'recorder'
+    id = db.Column(db.Integer, primary_key=True)
+    id_eleve = db.Column(db.Integer, nullable=False)
+    idTexte = db.Column(db.Integer, nullable=False)
+    file_path = db.Column(db.String(255), nullable=False)
+    transcription = db.Column(db.Text, nullable=True)
+    pronunciation_corrections = db.Column(db.Text, nullable=True)  # Legacy JSON blob, superseded by correction_run/word_error
+    word_timings = db.Column(db.Text, nullable=True)  # JSON: per-word start/end/confidence from the ASR stage
+    reference_alignment = db.Column(db.Text, nullable=True)  # JSON: per reference word status from reference decoding
+    pronunciation_scores = db.Column(db.Text, nullable=True)  # JSON: per expected word/character GOP scores (0-1)
+    transcription_version = db.Column(db.Integer, nullable=False, default=0)  # Incremented each time the ASR result is stored
+    date_enregistrement = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Texte(db.Model):
+    __tablename__ = 'texte'
+    idTexte = db.Column(db.Integer, primary_key=True)
+    texteContent = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every UPDATE, used by TexteCache
+
+    __mapper_args__ = {"version_id_col": version}
+
+class CorrectionRun(db.Model):
+    """One pronunciation correction pass over a recording"""
+    __tablename__ = 'correction_run'
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(db.Integer, db.ForeignKey('recorder.id'), nullable=False, index=True)
+    id_eleve = db.Column(db.Integer, nullable=False, index=True)
+    idTexte = db.Column(db.Integer, nullable=False, index=True)
+    transcription_version = db.Column(db.Integer, nullable=False, default=0)  # recorder.transcription_version it was computed from
+    total_errors = db.Column(db.Integer, nullable=False, default=0)
+    skipped_low_confidence = db.Column(db.Integer, nullable=False, default=0)
+    corrected_text = db.Column(db.Text, nullable=True)
+    corrected_text_audio = db.Column(db.String(255), nullable=True)
+    feedback_audio = db.Column(db.String(255), nullable=True)
+    audio_pending = db.Column(db.Boolean, nullable=False, default=False)  # Scored without TTS: synthesized on first read
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    errors = db.relationship('WordError', backref='run',
+                             order_by='WordError.position', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_correction_run_eleve_texte', 'id_eleve', 'idTexte'),
+    )
+
+    @classmethod
+    def from_corrections(cls, record, corrections):
+        """Build a run and its word errors from a correct_pronunciation() result"""
+        run = cls(
+            record_id=record.id,
+            id_eleve=record.id_eleve,
+            idTexte=record.idTexte,
+            transcription_version=record.transcription_version or 0,
+            total_errors=corrections.get("total_errors", 0),
+            skipped_low_confidence=corrections.get("skipped_low_confidence", 0),
+            corrected_text=corrections.get("corrected_text"),
+            corrected_text_audio=corrections.get("corrected_text_audio"),
+            feedback_audio=corrections.get("feedback_audio")
+        )
+        for error in corrections.get("errors", []):
+            run.errors.append(WordError(
+                id_eleve=record.id_eleve,
+                idTexte=record.idTexte,
+                position=error["position"],
+                original_word=error["original_word"],
+                transcribed_word=error.get("transcribed_word"),
+                correct_pronunciation=error.get("correct_pronunciation"),
+                pronunciation_score=error.get("pronunciation_score"),
+                error_type=error["error_type"],
+                audio_file=error.get("audio_file"),
+                asr_confidence=error.get("asr_confidence"),
+                asr_uncertain=bool(error.get("asr_uncertain", False))
+            ))
+        return run
+
+    def to_dict(self):
+        """Same shape as AzurePronunciationCorrector.correct_pronunciation()"""
+        errors = [error.to_dict() for error in self.errors]
+        summary = {"omitted_word": 0, "wrong_pronunciation": 0, "missing_diacritics": 0}
+        for error in errors:
+            summary[error["error_type"]] = summary.get(error["error_type"], 0) + 1
+        return {
+            "total_errors": self.total_errors,
+            "errors": errors,
+            "audio_files": [error["audio_file"] for error in errors if error["audio_file"]],
+            "corrected_text": self.corrected_text,
+            "corrected_text_audio": self.corrected_text_audio,
+            "feedback_audio": self.feedback_audio,
+            "summary": summary,
+            "skipped_low_confidence": self.skipped_low_confidence
+        }
+
+class WordError(db.Model):
+    """One mispronounced or omitted word within a correction run"""
+    __tablename__ = 'word_error'
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('correction_run.id'), nullable=False, index=True)
+    id_eleve = db.Column(db.Integer, nullable=False, index=True)
+    idTexte = db.Column(db.Integer, nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    original_word = db.Column(db.String(100), nullable=False, index=True)
+    transcribed_word = db.Column(db.String(100), nullable=True)
+    correct_pronunciation = db.Column(db.String(150), nullable=True)
+    pronunciation_score = db.Column(db.Float, nullable=True)
+    error_type = db.Column(db.String(32), nullable=False, index=True)
+    audio_file = db.Column(db.String(255), nullable=True)
+    asr_confidence = db.Column(db.Float, nullable=True)
+    asr_uncertain = db.Column(db.Boolean, nullable=False, default=False)
+
+    def to_dict(self):
+        return {
+            "position": self.position,
+            "original_word": self.original_word,
+            "transcribed_word": self.transcribed_word,
+            "correct_pronunciation": self.correct_pronunciation,
+            "pronunciation_score": self.pronunciation_score,
+            "error_type": self.error_type,
+            "audio_file": self.audio_file,
+            "asr_confidence": self.asr_confidence,
+            "asr_uncertain": self.asr_uncertain
+        }
+
+class StudentTextProgress(db.Model):
+    """Running aggregates of one student's attempts at one text"""
+    __tablename__ = 'student_text_progress'
+    id = db.Column(db.Integer, primary_key=True)
+    id_eleve = db.Column(db.Integer, nullable=False, index=True)
+    idTexte = db.Column(db.Integer, nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_errors = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    best_score = db.Column(db.Float, nullable=True)
+    last_score = db.Column(db.Float, nullable=True)
+    wpm_sum = db.Column(db.Float, nullable=False, default=0.0)
+    wpm_count = db.Column(db.Integer, nullable=False, default=0)
+    last_wpm = db.Column(db.Float, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('id_eleve', 'idTexte', name='uq_student_text_progress'),
+    )
+
+    def to_dict(self):
+        return {
+            "id_eleve": self.id_eleve,
+            "idTexte": self.idTexte,
+            "attempts": self.attempts,
+            "total_errors": self.total_errors,
+            "average_score": self.score_sum / self.attempts if self.attempts else None,
+            "best_score": self.best_score,
+            "last_score": self.last_score,
+            "average_wpm": self.wpm_sum / self.wpm_count if self.wpm_count else None,
+            "last_wpm": self.last_wpm,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class StudentWordStat(db.Model):
+    """How often a student got a given word wrong"""
+    __tablename__ = 'student_word_stat'
+    id = db.Column(db.Integer, primary_key=True)
+    id_eleve = db.Column(db.Integer, nullable=False, index=True)
+    word = db.Column(db.String(100), nullable=False)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    last_error_type = db.Column(db.String(32), nullable=True)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('id_eleve', 'word', name='uq_student_word_stat'),
+        db.Index('ix_student_word_stat_eleve_count', 'id_eleve', 'error_count'),
+    )
+
+class TextWordStat(db.Model):
+    """How often a word of a text is misread, across all students"""
+    __tablename__ = 'text_word_stat'
+    id = db.Column(db.Integer, primary_key=True)
+    idTexte = db.Column(db.Integer, nullable=False, index=True)
+    word = db.Column(db.String(100), nullable=False)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('idTexte', 'word', name='uq_text_word_stat'),
+        db.Index('ix_text_word_stat_texte_count', 'idTexte', 'error_count'),
+    )
+
+class ScoreHistory(db.Model):
+    """One score point per recording (its latest correction run), for trends"""
+    __tablename__ = 'score_history'
+    id = db.Column(db.Integer, primary_key=True)
+    id_eleve = db.Column(db.Integer, nullable=False)
+    idTexte = db.Column(db.Integer, nullable=False, index=True)
+    record_id = db.Column(db.Integer, db.ForeignKey('recorder.id'), nullable=False, unique=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('correction_run.id'), nullable=False)  # Run currently folded into the aggregates
+    score = db.Column(db.Float, nullable=False)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    wpm = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_score_history_eleve_date', 'id_eleve', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            "record_id": self.record_id,
+            "idTexte": self.idTexte,
+            "score": self.score,
+            "errors": self.errors,
+            "wpm": self.wpm,
+            "date": self.created_at.isoformat() if self.created_at else None
+        }
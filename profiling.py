@@ -0,0 +1,188 @@
+"""
+Opt-in request profiling with a bounded on-disk ring buffer
+
+A request is profiled when it carries the `X-Profile: 1` header, or when it is picked by
+sampling (PROFILE_SAMPLE_RATE) on one of the profiled endpoints. Sampled profiles are
+only kept if the request took longer than PROFILE_SLOW_MS. pyinstrument (statistical,
+HTML call trees) is used when installed, cProfile (.prof, for pstats/snakeviz) otherwise.
+The /profiles endpoints exist only when profiling is enabled, and require the
+`X-Admin-Token` header to match PROFILE_ADMIN_TOKEN.
+
+Only the request thread is profiled: the wav2vec2 forward pass runs in the ASR executor
+threads and shows up as time spent waiting in ModelExecutor.run.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+try:
+    from pyinstrument import Profiler as _PyinstrumentProfiler
+except ImportError:
+    _PyinstrumentProfiler = None
+
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.(html|prof)$")
+
+
+class ProfileStore:
+    """Keeps the newest max_profiles profile files in directory"""
+
+    def __init__(self, directory="profiles", max_profiles=50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, endpoint, duration, write):
+        """write(path) writes the profile; returns the stored file name"""
+        extension = "html" if _PyinstrumentProfiler is not None else "prof"
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{stamp}_{endpoint}_{int(duration * 1000)}ms.{extension}"
+        write(os.path.join(self.directory, name))
+        self._evict()
+        return name
+
+    def _evict(self):
+        with self._lock:
+            names = sorted(self._names())
+            for name in names[:max(0, len(names) - self.max_profiles)]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _names(self):
+        return [name for name in os.listdir(self.directory) if PROFILE_NAME_PATTERN.match(name)]
+
+    def list(self):
+        profiles = []
+        for name in sorted(self._names(), reverse=True):
+            # <timestamp>_<endpoint>_<duration>ms.<ext>; endpoint names may contain underscores
+            stamp, rest = name.rsplit(".", 1)[0].split("_", 1)
+            endpoint, duration = rest.rsplit("_", 1)
+            profiles.append({
+                "name": name,
+                "endpoint": endpoint,
+                "duration_ms": int(duration[:-2]),
+                "captured_at": datetime.strptime(stamp, "%Y%m%dT%H%M%S%f").isoformat(),
+                "size": os.path.getsize(os.path.join(self.directory, name))
+            })
+        return profiles
+
+    def is_valid_name(self, name):
+        return bool(PROFILE_NAME_PATTERN.match(name))
+
+
+class _RequestProfiler:
+    def __init__(self):
+        if _PyinstrumentProfiler is not None:
+            self._profiler = _PyinstrumentProfiler()
+        else:
+            self._profiler = cProfile.Profile()
+        self.running = False
+
+    def start(self):
+        if _PyinstrumentProfiler is not None:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        if _PyinstrumentProfiler is not None:
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        self.running = False
+
+    def write(self, path):
+        if _PyinstrumentProfiler is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.dump_stats(path)
+
+
+def init_app(app, endpoints, store=None, sample_rate=0.0, slow_ms=5000, enabled=True, admin_token=None):
+    """
+    Profile the given endpoints and serve the ring buffer on /profiles
+
+    Args:
+        endpoints: Flask endpoint names eligible for profiling
+        sample_rate: Fraction of requests profiled without the header (kept only if slow)
+        slow_ms: Minimum duration for a sampled profile to be kept
+        enabled: If False, nothing is profiled, the header is ignored and /profiles is not registered
+        admin_token: Value of the X-Admin-Token header required by /profiles (unset: not registered)
+    """
+    from flask import abort, g, jsonify, request, send_from_directory
+
+    if not enabled:
+        return None
+    store = store or ProfileStore()
+    endpoints = set(endpoints)
+
+    @app.before_request
+    def _start_profiler():
+        if request.endpoint not in endpoints:
+            return
+        forced = request.headers.get("X-Profile") == "1"
+        if not forced and random.random() >= sample_rate:
+            return
+        profiler = _RequestProfiler()
+        try:
+            profiler.start()
+        except Exception as e:
+            # Python 3.12+: only one profiler at a time (ValueError); an overlapping request runs unprofiled
+            app.logger.warning(f"Request not profiled: {e}")
+            return
+        g.profiler = profiler
+        g.profiler_forced = forced
+        g.profiler_start = time.perf_counter()
+
+    @app.after_request
+    def _save_profile(response):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        duration = time.perf_counter() - g.pop("profiler_start")
+        if g.pop("profiler_forced", False) or duration * 1000 >= slow_ms:
+            name = store.save(request.endpoint, duration, profiler.write)
+            response.headers["X-Profile-Name"] = name
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc):
+        # Unhandled exception: after_request did not run, stop without keeping the profile
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.stop()
+
+    if not admin_token:
+        # Profiles expose source paths and request internals: never serve them unauthenticated
+        app.logger.warning("PROFILE_ADMIN_TOKEN is not set: /profiles is disabled")
+        return store
+
+    def _require_admin():
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+            abort(403)
+
+    @app.route("/profiles", methods=["GET"], endpoint="profiles")
+    def _list_profiles():
+        _require_admin()
+        return jsonify({"profiles": store.list(), "max_profiles": store.max_profiles})
+
+    @app.route("/profiles/<name>", methods=["GET"], endpoint="profile_download")
+    def _download_profile(name):
+        _require_admin()
+        if not store.is_valid_name(name):
+            return jsonify({"error": "Nom de profil invalide"}), 400
+        return send_from_directory(os.path.abspath(store.directory), name, as_attachment=True)
+
+    return store
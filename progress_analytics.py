@@ -0,0 +1,324 @@
+"""
+Incrementally maintained progress aggregates (per student, per text, per word)
+
+Each correction run updates a handful of pre-aggregated rows, so the analytics
+endpoints read a few indexed rows instead of scanning every recording.
+"""
+import json
+import logging
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import case, event, func, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from models import (db, CorrectionRun, Recorder, Texte, StudentTextProgress,
+                    StudentWordStat, TextWordStat, ScoreHistory)
+
+logger = logging.getLogger(__name__)
+_PENDING_PROGRESS = "pending_progress"
+
+
+def reading_score(total_errors, original_text):
+    """Score /100 based on the number of errors relative to the text length"""
+    total_words = len(original_text.split())
+    if total_words == 0:
+        return 0
+    return max(0, 100 - (total_errors / total_words * 100))
+
+
+def reading_wpm(word_timings):
+    """Measured words per minute from the stored word timings JSON, if any"""
+    if not word_timings:
+        return None
+    words = json.loads(word_timings) if isinstance(word_timings, str) else word_timings
+    if not words:
+        return None
+    duration = words[-1]["end"] - words[0]["start"]
+    return len(words) / duration * 60 if duration > 0 else None
+
+
+def _upsert(model, index_elements, rows, assignments):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE (MySQL) or ON CONFLICT DO UPDATE (SQLite, PostgreSQL)
+
+    assignments(columns, new) returns the values applied to an existing row, where new
+    refers to the values that were about to be inserted.
+    """
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(assignments(table.c, stmt.inserted))
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=assignments(table.c, stmt.excluded))
+    else:
+        raise NotImplementedError(f"No upsert for dialect {dialect}")
+    db.session.execute(stmt)
+
+
+def _word_counts(run):
+    """(error count per word, last error type per word) of a run, without the ASR-uncertain errors"""
+    if run is None:
+        return Counter(), {}
+    # Errors the ASR was unsure about are likely noise: keep them out of the word statistics
+    word_errors = [error for error in run.errors if not error.asr_uncertain]
+    return (Counter(error.original_word for error in word_errors),
+            {error.original_word: error.error_type for error in word_errors})
+
+
+def _previous_contribution(record):
+    """Score point and run of the record already folded into the aggregates, if any"""
+    previous = ScoreHistory.query.filter_by(record_id=record.id).first()
+    if previous is None:
+        return None, None
+    return previous, db.session.get(CorrectionRun, previous.run_id)
+
+
+def update_progress(record, run, original_text):
+    """
+    Fold one correction run into the aggregates (executes in the session, does not commit)
+
+    Only the latest run of each recording counts: when the recording was already folded
+    (recompute, retry, batch re-score), that run's contribution is replaced rather than
+    added to, and the attempt is not counted again. Counters are incremented in SQL with
+    upserts, so concurrent uploads of the same student or text neither lose increments
+    nor collide on the unique keys. Two first folds of the same recording both insert its
+    score point: the second one fails on the unique record_id and is retried by
+    commit_with_progress() as a replacement.
+    """
+    # Dated by the recording, not the run: a batch re-score of an old recording is not a new attempt
+    attempted_at = record.date_enregistrement or run.created_at or datetime.utcnow()
+    score = reading_score(run.total_errors, original_text)
+    wpm = reading_wpm(record.word_timings)
+
+    previous, previous_run = _previous_contribution(record)
+    if previous is not None and previous.run_id == run.id:
+        return  # Already folded (retried fold)
+
+    if previous is None:
+        db.session.add(ScoreHistory(
+            id_eleve=record.id_eleve,
+            idTexte=record.idTexte,
+            record_id=record.id,
+            run_id=run.id,
+            score=score,
+            errors=run.total_errors,
+            wpm=wpm,
+            created_at=attempted_at
+        ))
+        # Claims the recording before any counter moves: a concurrent first fold fails here
+        db.session.flush()
+        attempts, errors, score_delta, wpm_delta, wpm_count = 1, run.total_errors, score, wpm or 0.0, int(wpm is not None)
+        best_score, last_score, last_wpm = score, score, wpm
+    else:
+        # Same attempt re-scored: the point keeps its date, its values are replaced
+        attempts = 0
+        errors = run.total_errors - previous.errors
+        score_delta = score - previous.score
+        wpm_delta = (wpm or 0.0) - (previous.wpm or 0.0)
+        wpm_count = int(wpm is not None) - int(previous.wpm is not None)
+        previous.run_id, previous.score, previous.errors, previous.wpm = run.id, score, run.total_errors, wpm
+        db.session.flush()
+        # Best and last scores can go down: read them back from the history
+        best_score = (db.session.query(func.max(ScoreHistory.score))
+                      .filter_by(id_eleve=record.id_eleve, idTexte=record.idTexte)
+                      .scalar())
+        latest = (ScoreHistory.query
+                  .filter_by(id_eleve=record.id_eleve, idTexte=record.idTexte)
+                  .order_by(ScoreHistory.created_at.desc(), ScoreHistory.id.desc())
+                  .first())
+        last_score, last_wpm = latest.score, latest.wpm
+
+    # An older recording folded late (batch re-score, rebuild) must not become the last score
+    newer_attempt = (select(ScoreHistory.id)
+                     .where(ScoreHistory.id_eleve == record.id_eleve,
+                            ScoreHistory.idTexte == record.idTexte,
+                            ScoreHistory.created_at > attempted_at)
+                     .exists())
+    _upsert(StudentTextProgress, ["id_eleve", "idTexte"], {
+        "id_eleve": record.id_eleve, "idTexte": record.idTexte,
+        "attempts": attempts, "total_errors": errors,
+        "score_sum": score_delta, "best_score": best_score, "last_score": last_score,
+        "wpm_sum": wpm_delta, "wpm_count": wpm_count, "last_wpm": last_wpm,
+        "updated_at": datetime.utcnow()
+    }, lambda c, new: {
+        "attempts": c.attempts + new.attempts,
+        "total_errors": c.total_errors + new.total_errors,
+        "score_sum": c.score_sum + new.score_sum,
+        "best_score": (new.best_score if previous is not None else
+                       case((c.best_score.is_(None) | (c.best_score < new.best_score), new.best_score),
+                            else_=c.best_score)),
+        "last_score": (new.last_score if previous is not None else
+                       case((newer_attempt, c.last_score), else_=new.last_score)),
+        "wpm_sum": c.wpm_sum + new.wpm_sum,
+        "wpm_count": c.wpm_count + new.wpm_count,
+        "last_wpm": (new.last_wpm if previous is not None else
+                     case((newer_attempt, c.last_wpm), else_=func.coalesce(new.last_wpm, c.last_wpm))),
+        "updated_at": new.updated_at
+    })
+
+    counts, last_types = _word_counts(run)
+    previous_counts, _ = _word_counts(previous_run)
+    delta = Counter(counts)
+    delta.subtract(previous_counts)
+    increments = {word: count for word, count in delta.items() if count > 0}
+    decrements = {word: count for word, count in delta.items() if count < 0}
+
+    if increments:
+        _upsert(StudentWordStat, ["id_eleve", "word"], [
+            {"id_eleve": record.id_eleve, "word": word, "error_count": count,
+             "last_error_type": last_types[word], "last_seen": attempted_at}
+            for word, count in increments.items()
+        ], lambda c, new: {
+            "error_count": c.error_count + new.error_count,
+            "last_error_type": new.last_error_type,
+            "last_seen": new.last_seen
+        })
+        _upsert(TextWordStat, ["idTexte", "word"], [
+            {"idTexte": record.idTexte, "word": word, "error_count": count, "last_seen": attempted_at}
+            for word, count in increments.items()
+        ], lambda c, new: {
+            "error_count": c.error_count + new.error_count,
+            "last_seen": new.last_seen
+        })
+    if decrements:
+        # Words the superseded run counted and the new one does not (or less often)
+        for model, key, value in ((StudentWordStat, StudentWordStat.id_eleve, record.id_eleve),
+                                  (TextWordStat, TextWordStat.idTexte, record.idTexte)):
+            db.session.execute(
+                update(model)
+                .where(key == value, model.word.in_(decrements))
+                .values(error_count=model.error_count + case(decrements, value=model.word, else_=0))
+                .execution_options(synchronize_session=False)
+            )
+
+
+def queue_progress(record, run, original_text):
+    """
+    Defer folding a run into the aggregates until the session is committed
+
+    The recording and its correction run are committed first; the aggregates are
+    written afterwards by commit_with_progress(), so a failed aggregate write never
+    rolls back a student's recording.
+    """
+    db.session.info.setdefault(_PENDING_PROGRESS, []).append((record, run, original_text))
+
+
+def commit_with_progress(retries=3):
+    """Commit the session, then fold the queued runs, each in its own retried transaction"""
+    db.session.commit()
+    pending = db.session.info.pop(_PENDING_PROGRESS, [])
+    folded = 0
+    for record, run, original_text in pending:
+        for attempt in range(1, retries + 1):
+            try:
+                update_progress(record, run, original_text)
+                db.session.commit()
+                folded += 1
+                break
+            except (IntegrityError, OperationalError) as e:
+                # Deadlock or lock timeout: the run itself is already stored, retry the fold only
+                db.session.rollback()
+                if attempt == retries:
+                    logger.error(f"Progress aggregates not updated for run {run.id} "
+                                 f"(run `flask rebuild-progress` to repair): {e}")
+    return folded
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending_progress(session, previous_transaction):
+    # Runs rolled back with their recording must not be folded by a later commit
+    session.info.pop(_PENDING_PROGRESS, None)
+
+
+def student_progress(id_eleve, history_limit=20):
+    texts = StudentTextProgress.query.filter_by(id_eleve=id_eleve).all()
+    history = (ScoreHistory.query
+               .filter_by(id_eleve=id_eleve)
+               .order_by(ScoreHistory.created_at.desc())
+               .limit(history_limit)
+               .all())
+    return {
+        "id_eleve": id_eleve,
+        "texts": [progress.to_dict() for progress in texts],
+        "recent_scores": [point.to_dict() for point in reversed(history)]
+    }
+
+
+def student_weak_words(id_eleve, limit=10):
+    stats = (StudentWordStat.query
+             .filter_by(id_eleve=id_eleve)
+             .order_by(StudentWordStat.error_count.desc())
+             .limit(limit)
+             .all())
+    return [
+        {"word": stat.word, "error_count": stat.error_count,
+         "last_error_type": stat.last_error_type,
+         "last_seen": stat.last_seen.isoformat() if stat.last_seen else None}
+        for stat in stats
+    ]
+
+
+def text_analytics(idTexte, limit=20):
+    """Class-wide view of one text: attempts, average score and most misread words"""
+    totals = (db.session.query(
+                  func.count(StudentTextProgress.id),
+                  func.sum(StudentTextProgress.attempts),
+                  func.sum(StudentTextProgress.score_sum),
+                  func.sum(StudentTextProgress.wpm_sum),
+                  func.sum(StudentTextProgress.wpm_count))
+              .filter(StudentTextProgress.idTexte == idTexte)
+              .one())
+    students, attempts, score_sum, wpm_sum, wpm_count = totals
+    words = (TextWordStat.query
+             .filter_by(idTexte=idTexte)
+             .order_by(TextWordStat.error_count.desc())
+             .limit(limit)
+             .all())
+    return {
+        "idTexte": idTexte,
+        "students": students or 0,
+        "attempts": attempts or 0,
+        "average_score": score_sum / attempts if attempts else None,
+        "average_wpm": wpm_sum / wpm_count if wpm_count else None,
+        "most_misread_words": [{"word": stat.word, "error_count": stat.error_count} for stat in words]
+    }
+
+
+def rebuild_progress(batch_size=500):
+    """Recompute every aggregate from the latest correction run of each recording"""
+    for model in (ScoreHistory, StudentWordStat, TextWordStat, StudentTextProgress):
+        model.query.delete()
+    db.session.flush()
+
+    textes = {texte.idTexte: texte.texteContent for texte in Texte.query.all()}
+    latest_runs = select(func.max(CorrectionRun.id)).group_by(CorrectionRun.record_id)
+    processed = 0
+    last_id = 0
+    while True:
+        # Keyset pagination: each batch is one short query, then written back in one flush
+        batch = (db.session.query(CorrectionRun, Recorder)
+                 .join(Recorder, CorrectionRun.record_id == Recorder.id)
+                 .filter(CorrectionRun.id > last_id, CorrectionRun.id.in_(latest_runs))
+                 .order_by(CorrectionRun.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        for run, record in batch:
+            texte = textes.get(run.idTexte)
+            if texte is not None:
+                update_progress(record, run, texte)
+                processed += 1
+        last_id = batch[-1][0].id
+        db.session.flush()
+    db.session.commit()
+    return processed
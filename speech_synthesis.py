@@ -0,0 +1,540 @@
+import io
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape, unescape
+
+import numpy as np
+
+import metrics
+
+# Format PCM commun à tous les backends: 16 kHz, 16 bits, mono
+SAMPLE_RATE = 16000
+
+# Débit relatif des valeurs de <prosody rate> d'Azure, pour les reproduire par étirement temporel
+PROSODY_RATES = {"x-slow": 0.5, "slow": 0.64, "medium": 1.0, "fast": 1.55, "x-fast": 2.0}
+
+# Formats des fichiers servis: extension et encodage local (soundfile)
+AUDIO_FORMATS = {
+    "wav": {"extension": "wav", "soundfile": ("WAV", "PCM_16")},
+    "ogg": {"extension": "ogg", "soundfile": ("OGG", "OPUS")},
+    "mp3": {"extension": "mp3", "soundfile": ("MP3", "MPEG_LAYER_III")},
+}
+
+
+@dataclass
+class SynthesisResult:
+    """Audio PCM d'une synthèse et positions (en secondes) des signets et des mots"""
+    pcm: np.ndarray  # int16, mono
+    sample_rate: int = SAMPLE_RATE
+    bookmarks: Dict[str, float] = field(default_factory=dict)
+    word_boundaries: List[Dict] = field(default_factory=list)  # {"text", "offset", "duration"}
+    cacheable: bool = True  # False si produit par le moteur local (espeak): à ne pas garder en cache
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / self.sample_rate
+
+    def slice(self, start: float, end: Optional[float] = None) -> np.ndarray:
+        """Extrait [start, end[ (secondes) sans copie: vue sur le tampon PCM"""
+        first = max(0, int(round(start * self.sample_rate)))
+        last = len(self.pcm) if end is None else min(len(self.pcm), int(round(end * self.sample_rate)))
+        return self.pcm[first:max(first, last)]
+
+
+def pcm_to_wav_bytes(pcm: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.ascontiguousarray(pcm, dtype=np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def write_wav(path: str, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE):
+    with open(path, "wb") as f:
+        f.write(pcm_to_wav_bytes(pcm, sample_rate))
+
+
+def write_audio(path: str, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, audio_format: str = "wav",
+                compression_level: Optional[float] = None):
+    """
+    Écrit du PCM int16 dans le format demandé (WAV sans dépendance, Opus/OGG ou MP3 via soundfile)
+
+    compression_level (0-1) est transmis à libsndfile: plus il est élevé, plus le débit est bas.
+    """
+    if audio_format == "wav":
+        write_wav(path, pcm, sample_rate)
+        return
+    import soundfile as sf
+
+    container, subtype = AUDIO_FORMATS[audio_format]["soundfile"]
+    kwargs = {} if compression_level is None else {"compression_level": compression_level}
+    sf.write(path, np.asarray(pcm, dtype=np.int16), sample_rate, format=container, subtype=subtype, **kwargs)
+
+
+def check_audio_format(audio_format: str):
+    """
+    Vérifie que le format peut être encodé localement (ValueError sinon): le libsndfile installé
+    doit connaître le conteneur et l'encodage (MP3: libsndfile 1.1 ou plus récent)
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Format audio non supporté: {audio_format} ({', '.join(AUDIO_FORMATS)})")
+    if audio_format == "wav":
+        return
+    try:
+        import soundfile as sf
+    except (ImportError, OSError) as e:
+        raise ValueError(f"Format audio {audio_format}: soundfile indisponible ({e})")
+    container, subtype = AUDIO_FORMATS[audio_format]["soundfile"]
+    if container not in sf.available_formats() or subtype not in sf.available_subtypes(container):
+        raise ValueError(f"Format audio {audio_format}: {container}/{subtype} non pris en charge "
+                         f"par libsndfile {sf.__libsndfile_version__}")
+
+
+def time_stretch(pcm: np.ndarray, rate: float) -> np.ndarray:
+    """
+    Change le débit de la parole sans changer sa hauteur (vocodeur de phase de librosa, STFT
+    vectorisée): rate > 1 accélère, rate < 1 ralentit
+    """
+    import librosa
+
+    audio = np.asarray(pcm, dtype=np.float32) / 32768
+    stretched = librosa.effects.time_stretch(audio, rate=rate)
+    return (np.clip(stretched, -1, 1) * 32767).astype(np.int16)
+
+
+def read_wav_pcm(path: str):
+    """
+    PCM int16 d'un fichier WAV mono projeté en mémoire (np.memmap): les découpes sont des vues,
+    rien n'est lu avant l'écriture des extraits. Retourne (pcm, sample_rate).
+    """
+    with wave.open(path, "rb") as f:
+        sample_rate = f.getframerate()
+        frames = f.getnframes()
+    # Le bloc "data" est le dernier du fichier: les échantillons en occupent la fin
+    offset = os.path.getsize(path) - frames * 2
+    return np.memmap(path, dtype=np.int16, mode="r", offset=offset, shape=(frames,)), sample_rate
+
+
+def word_key(text: str) -> str:
+    """Forme de comparaison d'un mot: sans diacritiques, tatweel ni ponctuation"""
+    return re.sub(r"[\W_\u0640]", "", text)
+
+
+def word_index(words: List[str], word_boundaries: List[Dict], lookahead: int = 3) -> List[Dict]:
+    """
+    Associe les mots du texte (par position) aux événements de limite de mot de la synthèse
+
+    Returns:
+        [{"position", "text", "offset", "duration"}] pour les mots retrouvés (secondes)
+    """
+    index = []
+    next_boundary = 0
+    for position, word in enumerate(words):
+        key = word_key(word)
+        for k in range(next_boundary, min(next_boundary + lookahead, len(word_boundaries))):
+            boundary = word_boundaries[k]
+            if word_key(boundary["text"]) == key:
+                index.append({"position": position, "text": word,
+                              "offset": boundary["offset"], "duration": boundary["duration"]})
+                next_boundary = k + 1
+                break
+    return index
+
+
+def word_index_path(audio_path: str) -> str:
+    """Fichier JSON d'index des mots associé à un audio de lecture complète"""
+    return os.path.splitext(audio_path)[0] + ".words.json"
+
+
+def save_word_index(audio_path: str, index: List[Dict], sample_rate: int = SAMPLE_RATE):
+    with open(word_index_path(audio_path), "w", encoding="utf-8") as f:
+        json.dump({"sample_rate": sample_rate, "words": index}, f, ensure_ascii=False)
+
+
+def remove_word_index(audio_path: str):
+    try:
+        os.remove(word_index_path(audio_path))
+    except FileNotFoundError:
+        pass
+
+
+def load_word_index(audio_path: str) -> Optional[Dict[int, Dict]]:
+    """Index des mots par position, ou None si l'audio n'a pas d'index"""
+    path = word_index_path(audio_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return {entry["position"]: entry for entry in json.load(f)["words"]}
+
+
+def reading_pcm_path(audio_path: str) -> str:
+    """
+    Source PCM d'une lecture complète pour le découpage: le fichier lui-même s'il est en WAV,
+    sinon un fichier PCM brut à côté du fichier compressé servi
+    """
+    if audio_path.endswith(".wav"):
+        return audio_path
+    return os.path.splitext(audio_path)[0] + ".pcm"
+
+
+def save_reading_pcm(audio_path: str, pcm: np.ndarray):
+    if not audio_path.endswith(".wav"):
+        np.ascontiguousarray(pcm, dtype=np.int16).tofile(reading_pcm_path(audio_path))
+
+
+def remove_reading_pcm(audio_path: str):
+    """Supprime la source PCM brute d'une lecture compressée, une fois les extraits découpés"""
+    path = reading_pcm_path(audio_path)
+    if path != audio_path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def load_reading_pcm(audio_path: str, sample_rate: int = SAMPLE_RATE):
+    """PCM de la lecture complète projeté en mémoire; retourne (pcm, sample_rate)"""
+    path = reading_pcm_path(audio_path)
+    if path.endswith(".wav"):
+        return read_wav_pcm(path)
+    return np.memmap(path, dtype=np.int16, mode="r"), sample_rate
+
+
+def words_ssml(words: List[str], language: str, voice_name: str, rate: str = "slow",
+               break_ms: int = 500) -> str:
+    """
+    Un seul document SSML pour plusieurs mots: signets "start_i"/"end_i" autour de chaque
+    mot et une pause entre deux mots, pour découper l'audio localement
+    """
+    parts = []
+    for i, word in enumerate(words):
+        parts.append(f'<bookmark mark="start_{i}"/>{escape(word)}<bookmark mark="end_{i}"/>'
+                     f'<break time="{break_ms}ms"/>')
+    return (f'<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{language}">'
+            f'<voice name="{voice_name}"><prosody rate="{rate}" pitch="medium">'
+            f'{"".join(parts)}'
+            f'</prosody></voice></speak>')
+
+
+def word_spans(result: SynthesisResult, count: int) -> Optional[List[tuple]]:
+    """
+    (début, fin) en secondes des count mots d'un document words_ssml(): d'après les signets,
+    sinon d'après les événements de limite de mot; None si ni l'un ni l'autre ne correspond
+    """
+    marks = result.bookmarks
+    if all(f"start_{i}" in marks and f"end_{i}" in marks for i in range(count)):
+        return [(marks[f"start_{i}"], marks[f"end_{i}"]) for i in range(count)]
+    if len(result.word_boundaries) == count:
+        return [(b["offset"], b["offset"] + b["duration"]) for b in result.word_boundaries]
+    return None
+
+
+class SpeechBackend:
+    """
+    Backend de synthèse: SSML -> PCM 16 kHz avec signets et limites de mots
+
+    Chaque moteur compte ses propres appels dans external_calls_total (metrics.count_call):
+    un appel est attribué au moteur qui l'a réellement servi, pas à celui qui était demandé.
+    """
+
+    def synthesize_ssml(self, ssml: str) -> SynthesisResult:
+        raise NotImplementedError
+
+
+class SynthesizerPool:
+    """
+    Synthétiseurs réutilisés d'un appel à l'autre: la connexion au service reste ouverte
+
+    Un synthétiseur n'est utilisé que par un appel à la fois. S'il n'y en a pas de libre, un
+    nouveau est créé; au plus size synthétiseurs inactifs sont gardés. Un synthétiseur dont
+    l'appel a levé une exception n'est pas remis dans le pool.
+    """
+
+    def __init__(self, factory, size: int = 4):
+        self._factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.created = 0
+
+    @contextmanager
+    def acquire(self):
+        try:
+            synthesizer = self._idle.get_nowait()
+        except queue.Empty:
+            synthesizer = self._factory()
+            self.created += 1
+        yield synthesizer
+        try:
+            self._idle.put_nowait(synthesizer)
+        except queue.Full:
+            # Pool déjà plein: ce synthétiseur est abandonné (sa connexion se ferme)
+            pass
+
+
+class _AzureSynthesizer:
+    """SpeechSynthesizer en mémoire dont les événements remplissent les listes de l'appel en cours"""
+
+    def __init__(self, speechsdk, speech_config):
+        self.synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        self.bookmarks = {}
+        self.word_boundaries = []
+        punctuation = getattr(getattr(speechsdk, "SpeechSynthesisBoundaryType", None), "Punctuation", None)
+
+        # Les offsets Azure sont en unités de 100 ns
+        def on_bookmark(evt):
+            self.bookmarks[evt.text] = evt.audio_offset / 1e7
+
+        def on_word_boundary(evt):
+            if punctuation is not None and getattr(evt, "boundary_type", None) == punctuation:
+                return
+            self.word_boundaries.append({
+                "text": evt.text,
+                "offset": evt.audio_offset / 1e7,
+                "duration": evt.duration.total_seconds()
+            })
+
+        self.synthesizer.bookmark_reached.connect(on_bookmark)
+        self.synthesizer.synthesis_word_boundary.connect(on_word_boundary)
+        # Connexion ouverte dès la création, pas au premier appel
+        self.connection = speechsdk.Connection.from_speech_synthesizer(self.synthesizer)
+        self.connection.open(True)
+
+    def reset(self):
+        self.bookmarks = {}
+        self.word_boundaries = []
+
+
+class AzureSpeechBackend(SpeechBackend):
+    """
+    Synthèse Azure en mémoire (PCM brut), avec capture des événements bookmark_reached et
+    synthesis_word_boundary, à travers un pool de synthétiseurs déjà connectés
+
+    speech_config est partagé avec le correcteur s'il est fourni; son format de sortie est
+    alors fixé au PCM brut, l'encodage des fichiers étant fait localement.
+    """
+
+    def __init__(self, subscription_key: str, region: str, language: str = "ar-SA",
+                 voice_name: str = "ar-SA-HamedNeural", speech_config=None, pool_size: int = 4):
+        import azure.cognitiveservices.speech as speechsdk
+
+        self._speechsdk = speechsdk
+        self.speech_config = speech_config or speechsdk.SpeechConfig(subscription=subscription_key, region=region)
+        self.speech_config.speech_synthesis_language = language
+        self.speech_config.speech_synthesis_voice_name = voice_name
+        self.speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm
+        )
+        self.pool = SynthesizerPool(lambda: _AzureSynthesizer(speechsdk, self.speech_config), pool_size)
+
+    @metrics.count_call("azure_tts")
+    def synthesize_ssml(self, ssml: str) -> SynthesisResult:
+        speechsdk = self._speechsdk
+        with self.pool.acquire() as pooled:
+            pooled.reset()
+            result = pooled.synthesizer.speak_ssml_async(ssml).get()
+            if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+                raise RuntimeError(f"Erreur de synthèse: {result.reason}")
+            return SynthesisResult(
+                pcm=np.frombuffer(result.audio_data, dtype=np.int16),
+                bookmarks=pooled.bookmarks,
+                word_boundaries=pooled.word_boundaries
+            )
+
+
+# Éléments SSML reconnus par les backends locaux: signet, pause, autre balise, texte
+_SSML_TOKEN_PATTERN = re.compile(r'<bookmark\s+mark="([^"]*)"\s*/>|<break\s+time="(\d+)ms"\s*/>|<[^>]+>|([^<]+)')
+_PROSODY_RATE_PATTERN = re.compile(r'<prosody[^>]*\brate="([\w-]+)"')
+
+
+class FakeSpeechBackend(SpeechBackend):
+    """
+    Synthétiseur local sans réseau: une tonalité par mot (durée proportionnelle au nombre de
+    caractères), du silence pour les <break>, et les mêmes événements que le backend Azure
+    """
+
+    def __init__(self, seconds_per_char: float = 0.06, latency: float = 0.0, connect_latency: float = 0.0,
+                 pooled: bool = True, pool_size: int = 4):
+        """
+        Args:
+            latency: Durée simulée de chaque synthèse
+            connect_latency: Durée simulée de l'établissement d'une connexion, payée à la création
+                de chaque synthétiseur: une fois par synthétiseur du pool, ou à chaque appel si pooled=False
+        """
+        self.seconds_per_char = seconds_per_char
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.pooled = pooled
+        self.pool = SynthesizerPool(self._connect, pool_size)
+        self.calls = 0
+
+    def _connect(self):
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        return object()
+
+    @metrics.count_call("fake_tts")
+    def synthesize_ssml(self, ssml: str) -> SynthesisResult:
+        self.calls += 1
+        if self.pooled:
+            with self.pool.acquire():
+                pass
+        else:
+            self._connect()
+        if self.latency:
+            time.sleep(self.latency)
+
+        chunks, bookmarks, word_boundaries = [], {}, []
+        position = 0
+        for match in _SSML_TOKEN_PATTERN.finditer(ssml):
+            mark, break_ms, text = match.groups()
+            if mark is not None:
+                bookmarks[mark] = position / SAMPLE_RATE
+            elif break_ms is not None:
+                silence = np.zeros(int(int(break_ms) * SAMPLE_RATE / 1000), dtype=np.int16)
+                chunks.append(silence)
+                position += len(silence)
+            elif text is not None:
+                for word in unescape(text).split():
+                    samples = int(len(word) * self.seconds_per_char * SAMPLE_RATE)
+                    t = np.arange(samples) / SAMPLE_RATE
+                    tone = (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+                    word_boundaries.append({"text": word, "offset": position / SAMPLE_RATE,
+                                            "duration": samples / SAMPLE_RATE})
+                    chunks.append(tone)
+                    position += samples
+        pcm = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+        return SynthesisResult(pcm=pcm, bookmarks=bookmarks, word_boundaries=word_boundaries)
+
+
+class EspeakSpeechBackend(SpeechBackend):
+    """
+    Synthèse locale sur CPU avec espeak-ng (voix arabe "ar"), sans réseau
+
+    Le SSML est interprété localement comme pour FakeSpeechBackend: chaque segment de texte
+    entre deux signets ou pauses est synthétisé par un appel à espeak-ng, rééchantillonné à
+    16 kHz, et les signets sont placés entre les segments. espeak-ng ne donne pas la position
+    des mots: leurs limites sont estimées en répartissant la durée du segment selon le nombre
+    de caractères de chaque mot. Ses résultats sont marqués non cacheables, qu'il serve de
+    secours ou de moteur principal (TTS_ENGINE=espeak): les caches sont indexés par la voix
+    Azure et ne doivent contenir que de l'audio Azure.
+    """
+
+    def __init__(self, voice: str = "ar", words_per_minute: int = 150, executable: str = "espeak-ng",
+                 timeout: float = 30.0):
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+        self.executable = executable
+        self.timeout = timeout
+
+    @staticmethod
+    def available(executable: str = "espeak-ng") -> bool:
+        return shutil.which(executable) is not None
+
+    def _speak(self, text: str, rate: float) -> np.ndarray:
+        """PCM int16 16 kHz d'un segment de texte"""
+        completed = subprocess.run(
+            [self.executable, "-v", self.voice, "-s", str(int(self.words_per_minute * rate)), "--stdout", text],
+            capture_output=True, timeout=self.timeout, check=True
+        )
+        data = completed.stdout
+        # En-tête RIFF écrit sur un flux: les tailles ne sont pas fiables, seul le bloc "data" compte
+        sample_rate = int.from_bytes(data[24:28], "little")
+        samples = np.frombuffer(data[data.index(b"data") + 8:], dtype=np.int16)
+        if sample_rate == SAMPLE_RATE or not len(samples):
+            return samples.copy()
+        positions = np.arange(int(len(samples) * SAMPLE_RATE / sample_rate)) * (sample_rate / SAMPLE_RATE)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+
+    @metrics.count_call("espeak_tts")
+    def synthesize_ssml(self, ssml: str) -> SynthesisResult:
+        match = _PROSODY_RATE_PATTERN.search(ssml)
+        rate = PROSODY_RATES.get(match.group(1), 1.0) if match else 1.0
+
+        chunks, bookmarks, word_boundaries = [], {}, []
+        position = 0
+        for token in _SSML_TOKEN_PATTERN.finditer(ssml):
+            mark, break_ms, text = token.groups()
+            if mark is not None:
+                bookmarks[mark] = position / SAMPLE_RATE
+            elif break_ms is not None:
+                silence = np.zeros(int(int(break_ms) * SAMPLE_RATE / 1000), dtype=np.int16)
+                chunks.append(silence)
+                position += len(silence)
+            elif text is not None and unescape(text).split():
+                words = unescape(text).split()
+                pcm = self._speak(" ".join(words), rate)
+                total_chars = sum(len(word) for word in words)
+                offset = position
+                for word in words:
+                    duration = len(pcm) * len(word) / total_chars
+                    word_boundaries.append({"text": word, "offset": offset / SAMPLE_RATE,
+                                            "duration": duration / SAMPLE_RATE})
+                    offset += duration
+                chunks.append(pcm)
+                position += len(pcm)
+        pcm = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+        return SynthesisResult(pcm=pcm, bookmarks=bookmarks, word_boundaries=word_boundaries, cacheable=False)
+
+
+class FailoverSpeechBackend(SpeechBackend):
+    """
+    Backend principal (Azure) avec bascule automatique sur un moteur local
+
+    Chaque appel au principal dispose d'un budget de latence (latency_budget, plus
+    budget_per_char par caractère du SSML). S'il le dépasse ou échoue, la synthèse est refaite
+    par le moteur de secours, et le principal est évité pendant cooldown secondes. Les résultats
+    de secours sont marqués non cacheables, pour ne pas mélanger les voix dans les caches.
+    """
+
+    def __init__(self, primary: SpeechBackend, fallback: SpeechBackend, latency_budget: float = 3.0,
+                 budget_per_char: float = 0.002, cooldown: float = 60.0, max_workers: int = 8):
+        self.primary = primary
+        self.fallback = fallback
+        self.latency_budget = latency_budget
+        self.budget_per_char = budget_per_char
+        self.cooldown = cooldown
+        # Un appel au principal hors budget ne peut pas être annulé: il se termine dans ce pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-primary")
+        self._primary_down_until = 0.0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _use_fallback(self, ssml: str, reason: str) -> SynthesisResult:
+        metrics.TTS_FALLBACKS.inc(reason=reason)
+        result = self.fallback.synthesize_ssml(ssml)
+        result.cacheable = False
+        return result
+
+    def synthesize_ssml(self, ssml: str) -> SynthesisResult:
+        with self._lock:
+            primary_down = time.monotonic() < self._primary_down_until
+        if primary_down:
+            return self._use_fallback(ssml, "cooldown")
+
+        budget = self.latency_budget + self.budget_per_char * len(ssml)
+        future = self._executor.submit(self.primary.synthesize_ssml, ssml)
+        try:
+            return future.result(timeout=budget)
+        except FutureTimeoutError:
+            reason = "timeout"
+            self.logger.warning(f"Synthèse principale hors budget ({budget:.1f} s): moteur de secours")
+        except Exception as e:
+            reason = "error"
+            self.logger.warning(f"Synthèse principale en échec ({e}): moteur de secours")
+        with self._lock:
+            self._primary_down_until = time.monotonic() + self.cooldown
+        return self._use_fallback(ssml, reason)
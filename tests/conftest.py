@@ -0,0 +1,110 @@
+"""
+Shared fixtures: the Flask app on a throwaway SQLite database
+
+The wav2vec2 processor is replaced by FakeAudioProcessor (fixed ASR result, no model
+download), speech synthesis goes through FakeSpeechBackend and the Gemini evaluator
+returns a fixed evaluation, so the tests make no network call.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEXT = "ذهب الولد إلى المدرسة صباحا مع أصدقائه"
+# Two misread words ("الولد", "صباحا") and one omitted word at the end
+TRANSCRIPTION = "ذهب الولاد إلى المدرسة صباح مع"
+
+
+class FakeAudioProcessor:
+    """ArabicAudioProcessor stand-in returning a fixed transcription"""
+    model_version = "fake"
+
+    def __init__(self, *args, **kwargs):
+        self.gop_scoring = kwargs.get("gop_scoring", True)
+        self.reference_decoding = kwargs.get("reference_decoding", False)
+
+    def transcribe_audio_detailed(self, audio_path, sample_rate=16000, use_cache=True, reference_text=None):
+        words = TRANSCRIPTION.split()
+        return {
+            "transcription": TRANSCRIPTION,
+            "words": [{"word": word, "start": 0.5 * i, "end": 0.5 * i + 0.4, "confidence": 0.9}
+                      for i, word in enumerate(words)],
+            "audio_duration": 0.5 * len(words),
+            "decoding": "greedy",
+            "reference_alignment": None,
+            "pronunciation_scores": None,
+            "word_confidences": [0.9] * len(words)
+        }
+
+    def process_audio(self, audio_path, use_cache=True, reference_text=None):
+        return {
+            "success": True,
+            **self.transcribe_audio_detailed(audio_path, reference_text=reference_text),
+            "quality_analysis": {"valid": True, "errors": [], "warnings": []}
+        }
+
+
+class FakeReadingEvaluator:
+    """Fixed evaluation instead of a Gemini call"""
+
+    def evaluate_reading(self, transcription, original_text, word_timings=None):
+        from evaluator import ReadingEvaluation, ReadingLevel
+        return ReadingEvaluation(
+            overall_score=80.0, level=ReadingLevel.GOOD, pronunciation_score=80.0, fluency_score=80.0,
+            accuracy_score=80.0, comprehension_score=80.0, feedback="", detailed_feedback={},
+            suggestions=[], strengths=[], areas_to_improve=[]
+        )
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("app")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'test.db'}"
+    os.environ["TTS_FRAGMENT_CACHE_DIR"] = str(workdir / "tts_fragments")
+    os.environ["TTS_READING_CACHE_DIR"] = str(workdir / "tts_readings")
+
+    import audio_processor
+    audio_processor.ArabicAudioProcessor = FakeAudioProcessor
+    import app as app_module
+    from benchmark import fake_synthesis_corrector
+
+    app_module.app.config["UPLOAD_FOLDER"] = str(workdir / "uploads")
+    app_module.AUDIO_CORRECTIONS_FOLDER = str(workdir / "audio_corrections")
+    os.makedirs(app_module.app.config["UPLOAD_FOLDER"], exist_ok=True)
+    app_module.pronunciation_corrector = fake_synthesis_corrector()
+    app_module.reading_evaluator = FakeReadingEvaluator()
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.Texte(idTexte=1, texteContent=TEXT))
+        app_module.db.session.commit()
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def count_statements(app_module):
+    """Context manager collecting every SQL statement sent to the database"""
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app_module.app.app_context():
+            engine = app_module.db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    return counter
@@ -0,0 +1,27 @@
+"""
+Content addressing of generated audio files
+"""
+import os
+
+import pytest
+
+from audio_files import content_address, name_digest, temp_path
+
+
+def test_content_address_names_the_file_after_its_stable_name(tmp_path):
+    name = str(tmp_path / "correction_1.wav")
+    paths = [temp_path(name) for _ in range(2)]
+    assert paths[0] != paths[1]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"same bytes")
+
+    targets = [content_address(path, name) for path in paths]
+    assert targets[0] == targets[1]
+    assert os.path.basename(targets[0]) == f"correction_1.{name_digest(targets[0])}.wav"
+    assert os.listdir(tmp_path) == [os.path.basename(targets[0])]
+
+
+def test_content_address_raises_when_the_source_is_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        content_address(temp_path(str(tmp_path / "correction_1.wav")), str(tmp_path / "correction_1.wav"))
@@ -0,0 +1,71 @@
+"""
+Decoded audio handed over in shared memory: the segment is unlinked on every path
+"""
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+import audio_pipeline
+from audio_pipeline import DecodedAudio, _decode_and_analyze
+
+SIGNAL = np.linspace(-1, 1, 1600, dtype=np.float32)
+
+
+class FakeAnalyzer:
+    def analyze_audio_array(self, speech_array, sample_rate):
+        return {"valid": True, "errors": [], "warnings": []}
+
+
+def exists(shm_name):
+    try:
+        shm = SharedMemory(name=shm_name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """_decode_and_analyze run in the test process, on a fixed signal"""
+    monkeypatch.setattr(audio_pipeline, "_analyzer", FakeAnalyzer())
+    monkeypatch.setattr(audio_pipeline.librosa, "load", lambda path, sr: (SIGNAL, sr))
+    return lambda: _decode_and_analyze("lecture.wav", 16000)
+
+
+def test_segment_is_unlinked_after_use(worker):
+    shm_name, length, quality = worker()
+
+    with DecodedAudio(shm_name, length, quality) as decoded:
+        assert np.array_equal(decoded.audio, SIGNAL)
+        assert decoded.quality_analysis["valid"]
+    assert decoded.audio is None
+    assert not exists(shm_name)
+
+
+def test_segment_is_unlinked_when_the_view_fails(worker):
+    shm_name, length, quality = worker()
+
+    # e.g. a length that does not fit the segment
+    with pytest.raises(TypeError):
+        DecodedAudio(shm_name, length + 1024, quality)
+    assert not exists(shm_name)
+
+
+def test_worker_unlinks_a_segment_it_cannot_fill(worker, monkeypatch):
+    created = []
+
+    class FailingBuffer(SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+        @property
+        def buf(self):
+            raise MemoryError("copy failed")
+
+    monkeypatch.setattr(audio_pipeline.shared_memory, "SharedMemory", FailingBuffer)
+    with pytest.raises(MemoryError):
+        worker()
+    assert created and not exists(created[0])
@@ -0,0 +1,127 @@
+"""
+CTC alignment on small hand-built log-probability fixtures
+"""
+import numpy as np
+import pytest
+
+from ctc_alignment import ctc_forced_align, frame_runs, gop_scores, greedy_word_segments, reference_word_alignment
+
+VOCAB = ["<pad>", "|", "a", "b", "c", "d"]
+CHAR_TO_ID = {token: i for i, token in enumerate(VOCAB)}
+BLANK, DELIMITER = 0, 1
+FRAME = 0.02
+
+
+def log_probs(frames, p=0.9):
+    """One frame per token: p on the token, the rest spread evenly over the vocabulary"""
+    probs = np.full((len(frames), len(VOCAB)), (1 - p) / (len(VOCAB) - 1))
+    probs[np.arange(len(frames)), [CHAR_TO_ID[token] for token in frames]] = p
+    return np.log(probs)
+
+
+def ids(tokens):
+    return [CHAR_TO_ID[token] for token in tokens]
+
+
+def test_frame_runs():
+    starts, ends, run_ids = frame_runs(ids(["<pad>", "<pad>", "a", "a", "|", "b"]))
+
+    assert starts.tolist() == [0, 2, 4, 5]
+    assert ends.tolist() == [2, 4, 5, 6]
+    assert run_ids.tolist() == ids(["<pad>", "a", "|", "b"])
+    assert all(array.size == 0 for array in frame_runs([]))
+
+
+def test_forced_align_path():
+    # Extended states: 0 blank, 1 "a", 2 blank, 3 "b", 4 blank
+    states = ctc_forced_align(log_probs(["a", "a", "<pad>", "b", "<pad>"]), ids(["a", "b"]), BLANK)
+    assert states.tolist() == [1, 1, 2, 3, 4]
+
+    # The expected token takes its frame even where another one is more likely
+    assert ctc_forced_align(log_probs(["a", "c"]), ids(["a", "b"]), BLANK).tolist() == [1, 3]
+
+
+def test_forced_align_needs_a_blank_between_repeated_tokens():
+    assert ctc_forced_align(log_probs(["a", "a"]), ids(["a", "a"]), BLANK) is None
+    assert ctc_forced_align(log_probs(["a", "<pad>", "a"]), ids(["a", "a"]), BLANK).tolist() == [1, 2, 3]
+    assert ctc_forced_align(log_probs(["a"]), [], BLANK) is None
+
+
+def test_greedy_word_spans():
+    words = greedy_word_segments(log_probs(["a", "a", "b", "|", "<pad>", "c", "d", "<pad>"], p=0.8),
+                                 VOCAB, BLANK, DELIMITER, FRAME)
+
+    assert [(word["word"], word["start"], word["end"]) for word in words] == [("ab", 0.0, 0.06), ("cd", 0.1, 0.14)]
+    # Mean probability of the emitting frames only
+    assert [word["confidence"] for word in words] == [pytest.approx(0.8, abs=1e-4)] * 2
+    assert greedy_word_segments(log_probs(["<pad>", "|"]), VOCAB, BLANK, DELIMITER, FRAME) == []
+
+
+def test_gop_scores():
+    # "b" is read as "c": its only frame gives it 0.02 against 0.9 for the most likely token
+    p, other = 0.9, 0.1 / (len(VOCAB) - 1)
+    scores = gop_scores(log_probs(["a", "a", "c", "|", "c", "d"]), ["ab", "xcd"], CHAR_TO_ID, VOCAB,
+                        BLANK, DELIMITER)
+
+    # "x" is not in the vocabulary: the second word is scored on "cd" only
+    assert [(score["reference_index"], score["expected"]) for score in scores] == [(0, "ab"), (1, "cd")]
+    ab, cd = scores
+    assert [char["char"] for char in ab["characters"]] == ["a", "b"]
+    assert ab["characters"][0]["score"] == pytest.approx(1.0)
+    assert ab["characters"][1]["score"] == pytest.approx(other / p, abs=1e-4)
+    # exp of the mean character GOP
+    assert ab["score"] == pytest.approx(np.sqrt(other / p), abs=1e-4)
+    assert cd["score"] == pytest.approx(1.0)
+    assert gop_scores(log_probs(["a"]), ["x"], CHAR_TO_ID, VOCAB, BLANK, DELIMITER) is None
+
+
+def align(text, frames):
+    return reference_word_alignment(log_probs(frames), text.split(), CHAR_TO_ID, VOCAB, BLANK, DELIMITER, FRAME)
+
+
+def statuses(result):
+    return [(entry["status"], entry["word"]) for entry in result["reference_alignment"]]
+
+
+def test_matching_reading():
+    result = align("ab cd", ["a", "a", "b", "<pad>", "|", "c", "d", "d"])
+
+    assert result["transcription"] == "ab cd"
+    assert statuses(result) == [("match", "ab"), ("match", "cd")]
+    assert [entry["expected"] for entry in result["reference_alignment"]] == ["ab", "cd"]
+    assert result["reference_alignment"][0]["start"] == 0.0
+
+
+def test_substituted_word():
+    result = align("ab ca", ["a", "b", "|", "c", "c", "b", "b"])
+
+    assert statuses(result) == [("match", "ab"), ("substituted", "cb")]
+    assert result["transcription"] == "ab cb"
+
+
+@pytest.mark.parametrize("frames", [
+    ["a", "b", "|", "c", "d", "d", "d", "d"],
+    ["a", "a", "b", "b", "|", "c", "c", "d", "d", "d", "d"],
+    ["a", "b", "|", "c", "d", "d", "<pad>", "<pad>"],
+])
+def test_unspoken_word_is_omitted(frames):
+    # The forced path gives the last "ab" frames of "cd" or of the silence: they are not a reading of it
+    result = align("ab cd ab", frames)
+
+    assert statuses(result) == [("match", "ab"), ("match", "cd"), ("omitted", "")]
+    assert result["transcription"] == "ab cd"
+    assert all(word["status"] != "inserted" for word in result["words"])
+
+
+def test_speech_between_words_is_inserted():
+    result = align("ab cd", ["a", "b", "|", "d", "d", "|", "c", "d"])
+
+    assert statuses(result) == [("match", "ab"), ("match", "cd")]
+    assert [(word["word"], word["status"]) for word in result["words"]] == [
+        ("ab", "match"), ("d", "inserted"), ("cd", "match")]
+
+
+def test_too_short_input_cannot_be_aligned():
+    # "ab|cd" needs at least five frames
+    assert align("ab cd", ["a", "b", "c", "d"]) is None
+    assert align("", ["a", "b"]) is None
@@ -0,0 +1,71 @@
+"""
+Bounded ASR inference: a saturated queue is refused with 503 and Retry-After
+"""
+import io
+import threading
+import time
+
+import pytest
+
+from model_executor import ExecutorBusyError, ModelExecutor
+
+
+@pytest.fixture
+def saturated_executor():
+    """One slot and one queued call, both blocked on an event until the test ends"""
+    executor = ModelExecutor(slots=1, threads_per_slot=1, max_queue_depth=1, retry_after=7)
+    release = threading.Event()
+    callers = [threading.Thread(target=executor.run, args=(release.wait,)) for _ in range(2)]
+    for caller in callers:
+        caller.start()
+    deadline = time.monotonic() + 5
+    while not executor.saturated():
+        assert time.monotonic() < deadline, "the blocking calls never reached the executor"
+        time.sleep(0.01)
+    yield executor
+    release.set()
+    for caller in callers:
+        caller.join()
+    executor.shutdown()
+
+
+def test_saturated_queue_raises_busy(saturated_executor):
+    assert saturated_executor.stats()["in_flight"] == 1
+    assert saturated_executor.stats()["queued"] == 1
+
+    with pytest.raises(ExecutorBusyError) as excinfo:
+        saturated_executor.run(lambda: "never run")
+    assert excinfo.value.retry_after == 7
+
+
+def test_slots_are_released_after_the_calls():
+    executor = ModelExecutor(slots=1, threads_per_slot=1, max_queue_depth=0)
+    with pytest.raises(ZeroDivisionError):
+        executor.run(lambda: 1 / 0)
+    assert executor.run(lambda: "ok") == "ok"
+    assert executor.stats()["in_flight"] == 0
+    executor.shutdown()
+
+
+def upload(client):
+    return client.post("/upload", data={
+        "file": (io.BytesIO(b"RIFF0000WAVE"), "lecture.wav"), "id_eleve": "1", "idTexte": "1"
+    }, content_type="multipart/form-data")
+
+
+def test_upload_is_refused_while_the_queue_is_full(app_module, client, saturated_executor, monkeypatch):
+    monkeypatch.setattr(app_module, "model_executor", saturated_executor)
+    response = upload(client)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+
+def test_busy_error_during_the_request_maps_to_503(app_module, client, saturated_executor, monkeypatch):
+    # The queue fills up between the saturation check and the model pass
+    monkeypatch.setattr(app_module.processor, "process_audio",
+                        lambda *args, **kwargs: saturated_executor.run(lambda: None))
+    response = upload(client)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
@@ -0,0 +1,46 @@
+"""
+Request profiling: admin-only /profiles, and overlapping profiled requests
+"""
+import flask
+import pytest
+
+import profiling
+
+
+def make_app(tmp_path, **kwargs):
+    app = flask.Flask("profiled")
+
+    @app.route("/work", endpoint="work")
+    def work():
+        return "ok"
+
+    profiling.init_app(app, {"work"}, store=profiling.ProfileStore(str(tmp_path)), **kwargs)
+    return app.test_client()
+
+
+@pytest.mark.parametrize("kwargs", [{"enabled": False, "admin_token": "secret"}, {"enabled": True}])
+def test_profiles_are_not_served_without_profiling_and_a_token(tmp_path, kwargs):
+    client = make_app(tmp_path, **kwargs)
+    assert client.get("/profiles", headers={"X-Admin-Token": "secret"}).status_code == 404
+
+
+def test_profiles_require_the_admin_token(tmp_path):
+    client = make_app(tmp_path, enabled=True, admin_token="secret")
+    name = client.get("/work", headers={"X-Profile": "1"}).headers["X-Profile-Name"]
+
+    assert client.get("/profiles").status_code == 403
+    assert client.get(f"/profiles/{name}", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/profiles", headers={"X-Admin-Token": "secret"}).get_json()["profiles"][0]["name"] == name
+    assert client.get(f"/profiles/{name}", headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_overlapping_profiled_request_runs_unprofiled(tmp_path, monkeypatch):
+    def already_active(self):
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling._RequestProfiler, "start", already_active)
+    client = make_app(tmp_path, enabled=True, admin_token="secret")
+    response = client.get("/work", headers={"X-Profile": "1"})
+
+    assert response.status_code == 200
+    assert "X-Profile-Name" not in response.headers
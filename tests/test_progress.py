@@ -0,0 +1,181 @@
+"""
+Progress aggregates: each recording counts once, with its latest correction run
+"""
+import pytest
+
+from conftest import TEXT
+
+
+def corrections(words):
+    return {
+        "total_errors": len(words),
+        "errors": [{"position": i, "original_word": word, "error_type": "wrong_pronunciation"}
+                   for i, word in enumerate(words)]
+    }
+
+
+@pytest.fixture
+def fold(app_module):
+    """Store a correction run for a record and fold it, as the endpoints do"""
+    def fold(record, words):
+        app_module.save_corrections(record, corrections(words), TEXT)
+        app_module.progress_analytics.commit_with_progress()
+    return fold
+
+
+def aggregates(app_module, id_eleve):
+    from models import StudentTextProgress, StudentWordStat
+    progress = StudentTextProgress.query.filter_by(id_eleve=id_eleve, idTexte=1).one()
+    words = {stat.word: stat.error_count for stat in StudentWordStat.query.filter_by(id_eleve=id_eleve)}
+    return progress.to_dict(), words
+
+
+def test_recompute_replaces_the_previous_run(app_module, fold):
+    from models import Recorder, ScoreHistory
+    with app_module.app.app_context():
+        record = Recorder(id_eleve=101, idTexte=1, file_path="a.wav")
+        app_module.db.session.add(record)
+        app_module.db.session.flush()
+        fold(record, ["الولد", "صباحا"])
+        fold(record, ["الولد"])
+        fold(record, ["الولد"])  # e.g. /recompute_corrections with the same result
+
+        progress, words = aggregates(app_module, 101)
+        assert progress["attempts"] == 1
+        assert progress["total_errors"] == 1
+        assert progress["last_score"] == progress["average_score"]
+        assert words == {"الولد": 1, "صباحا": 0}
+        assert ScoreHistory.query.filter_by(record_id=record.id).count() == 1
+
+
+def test_rebuild_counts_the_latest_run_of_each_recording(app_module, fold):
+    from progress_analytics import rebuild_progress
+    from models import Recorder
+    with app_module.app.app_context():
+        records = [Recorder(id_eleve=102, idTexte=1, file_path=f"{i}.wav") for i in range(2)]
+        app_module.db.session.add_all(records)
+        app_module.db.session.flush()
+        fold(records[0], ["الولد", "صباحا"])
+        fold(records[0], ["صباحا"])
+        fold(records[1], ["صباحا"])
+        before = aggregates(app_module, 102)
+
+        rebuild_progress()
+        progress, words = aggregates(app_module, 102)
+        assert progress["attempts"] == 2
+        assert words == {"صباحا": 2}
+        assert before[1] == {"الولد": 0, "صباحا": 2}
+        assert progress["average_score"] == before[0]["average_score"]
+
+
+def test_rescoring_an_older_recording_is_not_a_new_attempt(app_module, fold):
+    from datetime import datetime
+    from models import Recorder, StudentWordStat
+    with app_module.app.app_context():
+        older = Recorder(id_eleve=103, idTexte=1, file_path="old.wav", date_enregistrement=datetime(2024, 1, 1))
+        newer = Recorder(id_eleve=103, idTexte=1, file_path="new.wav", date_enregistrement=datetime(2024, 6, 1))
+        app_module.db.session.add_all([older, newer])
+        app_module.db.session.flush()
+        fold(newer, [])
+        fold(older, ["الولد", "صباحا"])  # archived recording folded by batch_score
+        fold(older, ["الولد", "صباحا"])  # and re-scored again
+
+        progress, words = aggregates(app_module, 103)
+        assert progress["attempts"] == 2
+        assert progress["last_score"] == 100
+        assert progress["best_score"] == 100
+        assert words == {"الولد": 1, "صباحا": 1}
+        assert StudentWordStat.query.filter_by(id_eleve=103, word="الولد").one().last_seen == datetime(2024, 1, 1)
+
+
+def test_evaluating_another_text_is_not_stored(app_module, client):
+    from models import CorrectionRun, Recorder
+    with app_module.app.app_context():
+        record = Recorder(id_eleve=104, idTexte=1, file_path="a.wav", transcription="ذهب الولاد إلى المدرسة")
+        app_module.db.session.add(record)
+        app_module.db.session.commit()
+        record_id = record.id
+
+    for original_text, stored in (("نص آخر لا علاقة له بالتسجيل", 0), (TEXT, 1)):
+        response = client.post(f"/test_evaluate_reading/{record_id}", json={"original_text": original_text})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        with app_module.app.app_context():
+            assert CorrectionRun.query.filter_by(record_id=record_id).count() == stored
+
+
+def test_rescore_without_audio_is_synthesized_on_first_read(app_module, client):
+    from models import CorrectionRun, Recorder
+    with app_module.app.app_context():
+        record = Recorder(id_eleve=105, idTexte=1, file_path="a.wav", transcription="ذهب الولاد إلى المدرسة",
+                          transcription_version=2)
+        app_module.db.session.add(record)
+        app_module.db.session.flush()
+        # batch_score.py without --synthesize
+        app_module.save_corrections(record, corrections(["الولد"]), TEXT, audio_pending=True)
+        app_module.progress_analytics.commit_with_progress()
+        record_id = record.id
+
+    response = client.get(f"/evaluer_lecture_diacritisee/{record_id}")
+    assert response.status_code == 200
+    assert response.get_json()["pronunciation_corrections"]["corrected_text_audio"]
+    response = client.get(f"/get_audio_feedback/{record_id}")
+    assert response.status_code == 200
+    with app_module.app.app_context():
+        runs = CorrectionRun.query.filter_by(record_id=record_id).order_by(CorrectionRun.id).all()
+        assert [run.audio_pending for run in runs] == [True, False]
+        progress, _ = aggregates(app_module, 105)
+        assert progress["attempts"] == 1
+
+
+def test_racing_first_folds_count_one_attempt(app_module, fold, monkeypatch):
+    import progress_analytics
+    from models import Recorder, ScoreHistory
+    previous_contribution = progress_analytics._previous_contribution
+    reads = []
+
+    def racing_previous_contribution(record):
+        # The first read happens before the concurrent fold's score point is committed
+        reads.append(record.id)
+        return (None, None) if len(reads) == 1 else previous_contribution(record)
+
+    with app_module.app.app_context():
+        record = Recorder(id_eleve=106, idTexte=1, file_path="a.wav")
+        app_module.db.session.add(record)
+        app_module.db.session.flush()
+        fold(record, ["الولد", "صباحا"])  # the concurrent fold, committed first
+        monkeypatch.setattr(progress_analytics, "_previous_contribution", racing_previous_contribution)
+        fold(record, ["الولد"])
+
+        # The duplicate score point failed on the unique key; the retry replaced the first run
+        assert len(reads) == 2
+        progress, words = aggregates(app_module, 106)
+        assert progress["attempts"] == 1
+        assert progress["total_errors"] == 1
+        assert words == {"الولد": 1, "صباحا": 0}
+        assert ScoreHistory.query.filter_by(record_id=record.id).count() == 1
+
+
+def test_failed_retry_leaves_the_record_unchanged(app_module, client, monkeypatch):
+    from models import CorrectionRun, Recorder
+    with app_module.app.app_context():
+        record = Recorder(id_eleve=107, idTexte=1, file_path="a.wav", transcription="ذهب", transcription_version=1)
+        app_module.db.session.add(record)
+        app_module.db.session.commit()
+        record_id = record.id
+
+    def failing_correction(*args, **kwargs):
+        raise RuntimeError("synthesis failed")
+
+    rollbacks = []
+    rollback = app_module.db.session.rollback
+    monkeypatch.setattr(app_module.pronunciation_corrector, "correct_pronunciation", failing_correction)
+    monkeypatch.setattr(app_module.db.session, "rollback", lambda: rollbacks.append(1) or rollback())
+    response = client.post(f"/retry_transcription/{record_id}")
+
+    assert response.status_code == 500
+    # The new transcription was set on the record before the failure: it is discarded
+    assert rollbacks
+    with app_module.app.app_context():
+        record = app_module.db.session.get(Recorder, record_id)
+        assert (record.transcription, record.transcription_version) == ("ذهب", 1)
+        assert CorrectionRun.query.filter_by(record_id=record_id).count() == 0
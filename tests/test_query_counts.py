@@ -0,0 +1,53 @@
+"""
+Number of SQL statements per request on the hot endpoints
+
+The texts are served from TexteCache, and each endpoint reads the record together with
+its text in one query. A change that adds a query per word or per error fails here.
+"""
+import io
+
+import pytest
+
+
+def upload(client):
+    response = client.post("/upload", data={
+        "file": (io.BytesIO(b"RIFF0000WAVE"), "lecture.wav"),
+        "id_eleve": "1",
+        "idTexte": "1"
+    }, content_type="multipart/form-data")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()["record_id"]
+
+
+@pytest.fixture
+def warm_texte_cache(app_module):
+    with app_module.app.app_context():
+        assert app_module.texte_cache.get(1) is not None
+
+
+def test_upload(client, count_statements, warm_texte_cache):
+    with count_statements() as statements:
+        upload(client)
+    # Recording transaction (5): INSERT recorder (flush for its id), INSERT correction_run,
+    # UPDATE recorder (transcription), INSERT word_error for each of the 2 errors.
+    # Aggregates transaction (8): reload of the run, the record and the run's errors (expired by
+    # the commit), lookup of the record's previous score point, INSERT score_history,
+    # student_text_progress upsert, two word stat upserts.
+    assert len(statements) == 13, statements
+
+
+def test_evaluer_lecture_diacritisee(client, count_statements, warm_texte_cache):
+    record_id = upload(client)
+    with count_statements() as statements:
+        response = client.get(f"/evaluer_lecture_diacritisee/{record_id}")
+    assert response.status_code == 200
+    # The record, then its stored correction run joined with its errors: nothing is recomputed
+    assert len(statements) == 2, statements
+
+
+def test_evaluate_reading(client, count_statements, warm_texte_cache):
+    record_id = upload(client)
+    with count_statements() as statements:
+        response = client.post(f"/evaluate_reading/{record_id}")
+    assert response.status_code == 200
+    assert len(statements) == 2, statements
@@ -0,0 +1,353 @@
+"""
+Batched correction synthesis on FakeSpeechBackend: SSML splitting and per-word fallback
+"""
+import os
+import wave
+
+import numpy as np
+import pytest
+
+import metrics
+from conftest import TEXT, TRANSCRIPTION
+from speech_synthesis import SAMPLE_RATE, FakeSpeechBackend, SynthesisResult, word_spans, words_ssml
+
+WORDS = ["الْوَلَدُ", "صَبَاحًا", "أَصْدِقَائِهِ"]
+SECONDS_PER_CHAR = 0.06
+
+
+class FailingBatchBackend(FakeSpeechBackend):
+    """Fails every batched (bookmarked) document, synthesizes single words"""
+
+    def synthesize_ssml(self, ssml):
+        if "<bookmark" in ssml:
+            self.calls += 1
+            raise RuntimeError("batch synthesis failed")
+        return super().synthesize_ssml(ssml)
+
+
+def corrector(backend, **kwargs):
+    from AzurePronunciationCorrector import AzurePronunciationCorrector
+    kwargs.setdefault("content_addressed", False)
+    return AzurePronunciationCorrector(subscription_key="test", region="test", speech_backend=backend, **kwargs)
+
+
+def duration(path):
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def test_word_spans_from_bookmarks():
+    result = FakeSpeechBackend(SECONDS_PER_CHAR).synthesize_ssml(words_ssml(WORDS, "ar-SA", "voice"))
+    spans = word_spans(result, len(WORDS))
+
+    assert spans == [(result.bookmarks[f"start_{i}"], result.bookmarks[f"end_{i}"]) for i in range(len(WORDS))]
+    for word, (start, end) in zip(WORDS, spans):
+        assert end - start == pytest.approx(len(word) * SECONDS_PER_CHAR, abs=1 / SAMPLE_RATE)
+    # The <break> between two words is not part of either clip
+    assert all(spans[i][1] < spans[i + 1][0] for i in range(len(WORDS) - 1))
+
+
+def test_word_spans_fall_back_to_word_boundaries():
+    result = FakeSpeechBackend(SECONDS_PER_CHAR).synthesize_ssml(words_ssml(WORDS, "ar-SA", "voice"))
+    with_bookmarks = word_spans(result, len(WORDS))
+    # e.g. a backend that drops the bookmark events
+    without_bookmarks = SynthesisResult(pcm=result.pcm, bookmarks={"start_0": 0.0},
+                                        word_boundaries=result.word_boundaries)
+
+    assert word_spans(without_bookmarks, len(WORDS)) == pytest.approx(with_bookmarks)
+    assert word_spans(without_bookmarks, len(WORDS) + 1) is None
+
+
+def test_batch_slices_one_clip_per_word(tmp_path):
+    backend = FakeSpeechBackend(SECONDS_PER_CHAR)
+    paths = [str(tmp_path / f"correction_{i}.wav") for i in range(len(WORDS))]
+
+    assert corrector(backend).generate_audio_feedback_batch(WORDS, paths) == paths
+    assert backend.calls == 1
+    for word, path in zip(WORDS, paths):
+        assert duration(path) == pytest.approx(len(word) * SECONDS_PER_CHAR, abs=1 / SAMPLE_RATE)
+
+
+def test_failed_batch_falls_back_to_one_call_per_word(tmp_path):
+    backend = FailingBatchBackend(SECONDS_PER_CHAR)
+    paths = [str(tmp_path / f"correction_{i}.wav") for i in range(len(WORDS))]
+    assert corrector(backend).generate_audio_feedback_batch(WORDS, paths) == []
+
+    backend = FailingBatchBackend(SECONDS_PER_CHAR)
+    results = corrector(backend, clips_from_reading=False).correct_pronunciation(
+        TEXT, TRANSCRIPTION, audio_output_dir=str(tmp_path))
+
+    errors = [error for error in results["errors"] if not error["asr_uncertain"]]
+    assert len(errors) > 1
+    assert sorted(results["audio_files"]) == sorted(error["audio_file"] for error in errors)
+    for error in errors:
+        assert duration(error["audio_file"]) == pytest.approx(
+            len(error["correct_pronunciation"]) * SECONDS_PER_CHAR, abs=1 / SAMPLE_RATE)
+
+
+def test_unsupported_encoder_is_rejected_at_init(monkeypatch):
+    import soundfile
+    monkeypatch.setattr(soundfile, "available_subtypes", lambda container=None: {"VORBIS": "Vorbis"})
+    with pytest.raises(ValueError):
+        corrector(FakeSpeechBackend(), audio_format="ogg")
+
+
+def test_compressed_output_survives_a_failed_clip(tmp_path, monkeypatch):
+    import AzurePronunciationCorrector as module
+    write_audio = module.write_audio
+
+    def failing_write_audio(path, *args, **kwargs):
+        if "الولد" in path:
+            raise RuntimeError("encoder failed")
+        write_audio(path, *args, **kwargs)
+
+    monkeypatch.setattr(module, "write_audio", failing_write_audio)
+    results = corrector(FakeSpeechBackend(SECONDS_PER_CHAR), audio_format="ogg").correct_pronunciation(
+        TEXT, TRANSCRIPTION, audio_output_dir=str(tmp_path))
+
+    clips = {error["original_word"]: error["audio_file"] for error in results["errors"]}
+    assert clips["الولد"] is None
+    assert all(path and path.endswith(".ogg") for word, path in clips.items() if word != "الولد")
+    assert results["corrected_text_audio"].endswith(".ogg")
+    # The reading's raw PCM copy is only needed while the clips are cut
+    assert not list(tmp_path.glob("*.pcm"))
+
+
+def test_full_reading_is_written_under_a_unique_name(tmp_path):
+    results = corrector(FakeSpeechBackend(SECONDS_PER_CHAR), content_addressed=True).correct_pronunciation(
+        TEXT, TRANSCRIPTION, audio_output_dir=str(tmp_path))
+
+    assert os.path.basename(results["corrected_text_audio"]).startswith("corrected_reading_complete.")
+    assert os.path.exists(results["corrected_text_audio"])
+    # Concurrent uploads never share the file, its word index or its PCM copy; none is left behind
+    assert not list(tmp_path.glob("*.tmp.*"))
+    assert not list(tmp_path.glob("*.words.json"))
+
+
+def test_full_reading_is_reused_across_runs(tmp_path):
+    from fragment_cache import ReadingCache
+    backend = FakeSpeechBackend(SECONDS_PER_CHAR)
+    reading_corrector = corrector(backend, reading_cache=ReadingCache(str(tmp_path / "readings")),
+                                  content_addressed=True)
+
+    runs = []
+    for run in range(2):
+        calls = backend.calls
+        runs.append(reading_corrector.correct_pronunciation(
+            TEXT, TRANSCRIPTION, audio_output_dir=str(tmp_path / f"run{run}")))
+        runs[-1]["calls"] = backend.calls - calls
+
+    # Second run: the reading comes from the reading cache (clips and feedback from the fragment cache)
+    assert runs[0]["calls"] > 0
+    assert runs[1]["calls"] == 0
+    assert os.path.basename(runs[0]["corrected_text_audio"]) == os.path.basename(runs[1]["corrected_text_audio"])
+    assert ([os.path.basename(path) for path in runs[0]["audio_files"]]
+            == [os.path.basename(path) for path in runs[1]["audio_files"]])
+
+
+def test_espeak_engine_output_is_never_cached(tmp_path, monkeypatch):
+    import numpy as np
+    from fragment_cache import FragmentCache, ReadingCache
+    from speech_synthesis import EspeakSpeechBackend
+
+    # No espeak-ng binary needed: one tone per segment, as long as its text
+    monkeypatch.setattr(EspeakSpeechBackend, "_speak",
+                        lambda self, text, rate: np.full(int(len(text) * SECONDS_PER_CHAR * SAMPLE_RATE), 1000,
+                                                         dtype=np.int16))
+    fragments, readings = tmp_path / "tts_fragments", tmp_path / "tts_readings"
+    # TTS_ENGINE=espeak: the local engine is the speech backend itself, without failover
+    results = corrector(EspeakSpeechBackend(), fragment_cache=FragmentCache(str(fragments)),
+                        reading_cache=ReadingCache(str(readings))).correct_pronunciation(
+        TEXT, TRANSCRIPTION, audio_output_dir=str(tmp_path / "out"))
+
+    assert results["corrected_text_audio"] and results["audio_files"] and results["feedback_audio"]
+    assert not os.listdir(fragments)
+    assert not os.listdir(readings)
+
+
+def feedback_errors(omitted="أَصْدِقَائِهِ"):
+    from AzurePronunciationCorrector import PronunciationError
+    return [PronunciationError("الولد", "الولاد", "الْوَلَدُ", 0.5, "wrong_pronunciation", 1),
+            PronunciationError("أصدقائه", "", omitted, 0.0, "omitted_word", 6)]
+
+
+def test_feedback_is_assembled_from_cached_fragments(tmp_path):
+    from fragment_cache import FragmentCache
+    backend = FakeSpeechBackend(SECONDS_PER_CHAR)
+    cache = FragmentCache()
+    feedback = corrector(backend, fragment_cache=cache)
+    voice_name = feedback.speech_config.speech_synthesis_voice_name
+    segments = feedback.feedback_segments(feedback_errors())
+
+    # Every missing fragment (fixed phrases and words) in a single call
+    assert feedback.generate_comprehensive_feedback_audio(feedback_errors(), str(tmp_path / "first.wav"))
+    assert backend.calls == 1
+    fragments = [cache.get(text, voice_name) for text, _ in segments]
+    assert all(pcm is not None for pcm in fragments)
+    samples = sum(len(pcm) for pcm in fragments) + sum(int(pause * SAMPLE_RATE / 1000) for _, pause in segments)
+    assert duration(str(tmp_path / "first.wav")) == pytest.approx(samples / SAMPLE_RATE)
+
+    assert feedback.generate_comprehensive_feedback_audio(feedback_errors(), str(tmp_path / "second.wav"))
+    assert backend.calls == 1
+    # Another omitted word: only that word is synthesized, in one more call
+    assert feedback.generate_comprehensive_feedback_audio(feedback_errors("صَبَاحًا"), str(tmp_path / "third.wav"))
+    assert backend.calls == 2
+
+
+def test_feedback_falls_back_to_one_synthesis_of_the_whole_message(tmp_path):
+    from fragment_cache import FragmentCache
+    backend = FailingBatchBackend(SECONDS_PER_CHAR)
+    cache = FragmentCache()
+    feedback = corrector(backend, fragment_cache=cache)
+
+    assert feedback.generate_comprehensive_feedback_audio(feedback_errors(), str(tmp_path / "feedback.wav"))
+    # The fragment call failed, then the full message was synthesized without bookmarks
+    assert backend.calls == 2
+    assert duration(str(tmp_path / "feedback.wav")) > 0
+    assert cache.get(feedback.feedback_segments(feedback_errors())[0][0],
+                     feedback.speech_config.speech_synthesis_voice_name) is None
+
+
+def test_instructions_are_synthesized_once(tmp_path):
+    from fragment_cache import FragmentCache
+    backend = FakeSpeechBackend(SECONDS_PER_CHAR)
+    instructions = corrector(backend, fragment_cache=FragmentCache(str(tmp_path / "fragments")))
+
+    for run in range(2):
+        assert instructions.generate_instructions_audio(str(tmp_path / f"instructions{run}.wav"))
+    assert backend.calls == 1
+
+    # After a restart, from the fragment files
+    restarted_backend = FakeSpeechBackend(SECONDS_PER_CHAR)
+    restarted = corrector(restarted_backend, fragment_cache=FragmentCache(str(tmp_path / "fragments")))
+    assert restarted.generate_instructions_audio(str(tmp_path / "instructions2.wav"))
+    assert restarted_backend.calls == 0
+    assert duration(str(tmp_path / "instructions2.wav")) == duration(str(tmp_path / "instructions0.wav"))
+
+
+@pytest.mark.parametrize("rate", [0.64, 1.55])
+def test_time_stretch_changes_the_length_only(rate):
+    from speech_synthesis import time_stretch
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    pcm = (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+
+    stretched = time_stretch(pcm, rate)
+
+    assert stretched.dtype == np.int16
+    assert len(stretched) == pytest.approx(len(pcm) / rate, rel=0.01)
+
+
+class RecordingBackend(FakeSpeechBackend):
+    """Keeps the SSML of every call"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.documents = []
+
+    def synthesize_ssml(self, ssml):
+        self.documents.append(ssml)
+        return super().synthesize_ssml(ssml)
+
+
+def reading_rates(backend):
+    """Prosody rate of each full reading (fragment calls are bookmarked)"""
+    return [document.split('prosody rate="', 1)[1].split('"', 1)[0]
+            for document in backend.documents if "<bookmark" not in document]
+
+
+def test_learning_sequence_is_stretched_from_one_reading(tmp_path):
+    from speech_synthesis import PROSODY_RATES
+    backend = RecordingBackend(SECONDS_PER_CHAR)
+    files = corrector(backend).generate_learning_sequence_audio(TEXT, str(tmp_path))
+
+    assert set(files) == {"slow_reading", "normal_reading", "fast_reading", "instructions"}
+    # One reading, at the normal rate
+    assert reading_rates(backend) == ["medium"]
+    normal = duration(files["normal_reading"])
+    for key, speed in (("slow_reading", "slow"), ("fast_reading", "fast")):
+        assert duration(files[key]) == pytest.approx(normal / PROSODY_RATES[speed], rel=0.01)
+
+
+def test_learning_sequence_falls_back_to_prosody_when_the_stretch_fails(tmp_path, monkeypatch):
+    import AzurePronunciationCorrector as module
+
+    def failing_time_stretch(pcm, rate):
+        raise RuntimeError("stretch failed")
+
+    monkeypatch.setattr(module, "time_stretch", failing_time_stretch)
+    backend = RecordingBackend(SECONDS_PER_CHAR)
+    files = corrector(backend).generate_learning_sequence_audio(TEXT, str(tmp_path))
+
+    assert set(files) == {"slow_reading", "normal_reading", "fast_reading", "instructions"}
+    # The slow and fast readings are synthesized with the Azure prosody rate instead
+    assert sorted(reading_rates(backend)) == ["fast", "medium", "slow"]
+    assert all(os.path.exists(path) for path in files.values())
+    assert not list(tmp_path.glob("*.pcm"))
+
+
+def test_pool_drops_a_synthesizer_whose_call_failed():
+    from speech_synthesis import SynthesizerPool
+    pool = SynthesizerPool(object, size=2)
+
+    with pool.acquire() as first:
+        pass
+    with pytest.raises(RuntimeError):
+        with pool.acquire() as synthesizer:
+            assert synthesizer is first
+            raise RuntimeError("synthesis failed")
+
+    # The failed one is not reused: a new connection is opened
+    with pool.acquire() as synthesizer:
+        assert synthesizer is not first
+    assert pool.created == 2
+
+
+def test_pool_keeps_at_most_size_idle_synthesizers():
+    from contextlib import ExitStack
+    from speech_synthesis import SynthesizerPool
+    pool = SynthesizerPool(object, size=2)
+
+    # Four concurrent calls, then all released: only two synthesizers are kept
+    for burst in range(2):
+        with ExitStack() as stack:
+            synthesizers = [stack.enter_context(pool.acquire()) for _ in range(4)]
+        assert len(set(map(id, synthesizers))) == 4
+    assert pool.created == 4 + 2
+
+
+class DownPrimary(FakeSpeechBackend):
+    """Primary engine whose every call fails"""
+
+    @metrics.count_call("azure_tts")
+    def synthesize_ssml(self, ssml):
+        raise RuntimeError("service unavailable")
+
+
+def calls(service):
+    return {outcome: metrics.EXTERNAL_CALLS.value(service=service, outcome=outcome) for outcome in ("ok", "error")}
+
+
+def test_external_calls_are_counted_under_the_serving_engine():
+    from speech_synthesis import FailoverSpeechBackend
+    before = {service: calls(service) for service in ("azure_tts", "fake_tts")}
+    backend = FailoverSpeechBackend(DownPrimary(), FakeSpeechBackend(SECONDS_PER_CHAR), cooldown=0)
+
+    assert corrector(backend).synthesize_word(WORDS[0]) is not None
+
+    assert calls("azure_tts") == {"ok": before["azure_tts"]["ok"], "error": before["azure_tts"]["error"] + 1}
+    assert calls("fake_tts") == {"ok": before["fake_tts"]["ok"] + 1, "error": before["fake_tts"]["error"]}
+
+
+def test_external_call_outcome_is_whether_the_call_raised():
+    before = calls("gemini")
+
+    @metrics.external_call("gemini")
+    def generate(fail):
+        if fail:
+            raise RuntimeError("quota exceeded")
+        return ""  # An empty answer is still an answer
+
+    generate(False)
+    with pytest.raises(RuntimeError):
+        generate(True)
+    assert calls("gemini") == {"ok": before["ok"] + 1, "error": before["error"] + 1}
@@ -0,0 +1,86 @@
+"""
+Reading texts served from memory: invalidated on ORM changes, revalidated against other processes
+"""
+import pytest
+from sqlalchemy import text
+
+import texte_cache
+from texte_cache import TexteCache
+
+
+@pytest.fixture
+def texte(app_module):
+    """A text of its own, removed after the test"""
+    from models import Texte
+    with app_module.app.app_context():
+        app_module.db.session.add(Texte(idTexte=50, texteContent="ذهب الولد"))
+        app_module.db.session.commit()
+        yield app_module.db.session.get(Texte, 50)
+        app_module.db.session.rollback()
+        app_module.db.session.execute(text("DELETE FROM texte WHERE idTexte = 50"))
+        app_module.db.session.commit()
+        app_module.texte_cache.invalidate(50)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_update_through_the_orm_invalidates_the_entry(app_module, texte):
+    cache = app_module.texte_cache
+    assert cache.get(50).texteContent == "ذهب الولد"
+
+    texte.texteContent = "ذهب الولد إلى المدرسة"
+    app_module.db.session.commit()
+
+    entry = cache.get(50)
+    assert entry.texteContent == "ذهب الولد إلى المدرسة"
+    assert entry.tokens == ("ذهب", "الولد", "إلى", "المدرسة")
+    assert entry.version == 2
+
+
+def test_delete_through_the_orm_invalidates_the_entry(app_module, texte):
+    cache = app_module.texte_cache
+    assert cache.get(50) is not None
+
+    app_module.db.session.delete(texte)
+    app_module.db.session.commit()
+
+    assert cache.get(50) is None
+
+
+def test_edits_by_other_processes_are_picked_up_on_revalidation(app_module, texte, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(texte_cache.time, "monotonic", clock)
+    cache = TexteCache(revalidate_after=60)
+    assert cache.get(50).version == 1
+
+    # Another process edits the text: no ORM event here
+    app_module.db.session.execute(
+        text("UPDATE texte SET texteContent = 'ذهب', version = version + 1 WHERE idTexte = 50"))
+    app_module.db.session.commit()
+
+    clock.now += 59
+    assert cache.get(50).texteContent == "ذهب الولد"
+    clock.now += 2
+    entry = cache.get(50)
+    assert (entry.texteContent, entry.version) == ("ذهب", 2)
+    assert cache.stats()["misses"] == 2
+
+
+def test_revalidation_keeps_unchanged_entries(app_module, texte, count_statements, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(texte_cache.time, "monotonic", clock)
+    cache = TexteCache(revalidate_after=60)
+    cache.get(50)
+
+    clock.now += 61
+    with count_statements() as statements:
+        assert cache.get(50).version == 1
+    # The version check only, the entry is still served from memory
+    assert len(statements) == 1
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
@@ -0,0 +1,94 @@
+"""
+On-disk transcription cache: hits, invalidation on a model or schema change, LRU eviction
+"""
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+import audio_processor
+from transcription_cache import TranscriptionCache
+
+# Imported at collection, before the app fixture swaps in FakeAudioProcessor
+ArabicAudioProcessor = audio_processor.ArabicAudioProcessor
+
+VERSION = "model@abc|torch-2|cpu|schema-5"
+AUDIO = np.zeros(1000, dtype=np.float32)
+
+
+def cache_files(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = TranscriptionCache(str(tmp_path), VERSION)
+    assert cache.get("a" * 64) is None
+
+    cache.put("a" * 64, {"quality_analysis": {"valid": True}}, audio=AUDIO)
+    assert cache.get("a" * 64)["quality_analysis"] == {"valid": True}
+    assert cache.get_audio("a" * 64).shape == AUDIO.shape
+
+    # A successful transcription completes the entry and drops the decoded signal
+    cache.put("a" * 64, {"transcription": "ذهب"}, arrays={"frame_confidence": np.ones(3, dtype=np.float16)})
+    entry = cache.get("a" * 64)
+    assert entry["transcription"] == "ذهب" and entry["quality_analysis"] == {"valid": True}
+    assert cache.get_audio("a" * 64) is None
+    assert cache.get_arrays("a" * 64)["frame_confidence"].tolist() == [1.0, 1.0, 1.0]
+    assert cache.get("b" * 64) is None
+
+
+def test_entry_of_another_model_is_invalidated(tmp_path):
+    TranscriptionCache(str(tmp_path), VERSION).put("a" * 64, {"transcription": "ذهب"}, arrays={"x": np.ones(2)})
+
+    cache = TranscriptionCache(str(tmp_path), "model@def|torch-2|cpu|schema-5")
+    assert cache.get("a" * 64) is None
+    assert cache_files(tmp_path) == []
+
+
+def test_schema_version_is_part_of_the_model_version(tmp_path, monkeypatch):
+    # Only what _get_model_version reads: no model download
+    processor = SimpleNamespace(model_name="model", asr_model=torch.nn.Linear(1, 1))
+    processor.asr_model.config = SimpleNamespace(_commit_hash="abc")
+
+    before = ArabicAudioProcessor._get_model_version(processor)
+    TranscriptionCache(str(tmp_path), before).put("a" * 64, {"transcription": "ذهب"})
+    monkeypatch.setattr(audio_processor, "CACHE_SCHEMA_VERSION", audio_processor.CACHE_SCHEMA_VERSION + 1)
+    after = ArabicAudioProcessor._get_model_version(processor)
+
+    assert after != before
+    assert TranscriptionCache(str(tmp_path), before).get("a" * 64) is not None
+    assert TranscriptionCache(str(tmp_path), after).get("a" * 64) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TranscriptionCache(str(tmp_path), VERSION, max_bytes=10_000)
+    for audio_hash in ("a" * 64, "b" * 64):
+        cache.put(audio_hash, {"quality_analysis": {}}, audio=AUDIO)
+        for name in cache_files(tmp_path):
+            if name.startswith(audio_hash):
+                os.utime(tmp_path / name, (1000, 1000))
+    cache.get("a" * 64)  # "a" is now more recently used than "b"
+
+    cache.put("c" * 64, {"quality_analysis": {}}, audio=AUDIO)
+
+    assert cache.get("b" * 64) is None
+    assert cache.get_audio("b" * 64) is None
+    assert cache.get("a" * 64) is not None and cache.get("c" * 64) is not None
+    assert sum(os.path.getsize(tmp_path / name) for name in cache_files(tmp_path)) <= 10_000
+
+
+def test_failed_write_leaves_no_partial_file(tmp_path, monkeypatch):
+    cache = TranscriptionCache(str(tmp_path), VERSION)
+
+    def failing_savez(file, **arrays):
+        file.write(b"PK partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "savez", failing_savez)
+    with pytest.raises(OSError):
+        cache.put("a" * 64, {"transcription": "ذهب"}, arrays={"x": np.ones(2)})
+
+    assert cache_files(tmp_path) == []
+    assert cache.get_arrays("a" * 64) == {}
@@ -0,0 +1,139 @@
+"""
+Off-peak pre-synthesis of misread words: time window, call budget, yielding to requests
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from fragment_cache import FragmentCache
+from speech_synthesis import FakeSpeechBackend
+from tts_prefetcher import TTSPrefetcher, parse_hours
+
+WORDS = ["الولد", "صباحا", "أصدقائه"]
+DIACRITIZED = ["الْوَلَدُ", "صَبَاحًا", "أَصْدِقَائِهِ"]
+
+
+class FakeClock:
+    """Sleeping only moves the clock forward; on_wait runs at each sleep"""
+
+    def __init__(self, hour=3):
+        self.time = 1000.0
+        self.hour = hour
+        self.waits = 0
+        self.on_wait = None
+
+    def now(self):
+        return datetime(2026, 1, 5, self.hour, 0)
+
+    def monotonic(self):
+        return self.time
+
+    def wait(self, event, timeout):
+        self.waits += 1
+        self.time += timeout
+        if self.on_wait:
+            self.on_wait()
+        return event.is_set()
+
+
+class TimedBackend(FakeSpeechBackend):
+    """Records the clock time of every synthesis call"""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.call_times = []
+
+    def synthesize_ssml(self, ssml):
+        self.call_times.append(self.clock.monotonic())
+        return super().synthesize_ssml(ssml)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def backend(clock):
+    return TimedBackend(clock)
+
+
+@pytest.fixture
+def make_prefetcher(clock, backend, monkeypatch):
+    """Prefetcher of the three misread words of text 1, on a fresh fragment cache"""
+    def make(app=None, **kwargs):
+        corrector = SimpleNamespace(fragment_cache=FragmentCache(), speech_backend=backend, language="ar-SA",
+                                    speech_config=SimpleNamespace(speech_synthesis_voice_name="voice"))
+        texte_cache = SimpleNamespace(get=lambda idTexte: SimpleNamespace(
+            tokens=tuple(WORDS), diacritized=" ".join(DIACRITIZED)))
+        kwargs.setdefault("rates", ("slow",))
+        prefetcher = TTSPrefetcher(app or Flask(__name__), corrector, texte_cache, clock=clock, **kwargs)
+        monkeypatch.setattr(prefetcher, "ranked_words", lambda: {1: list(WORDS)})
+        return prefetcher
+    return make
+
+
+def test_parse_hours():
+    assert parse_hours("22-6") == {22, 23, 0, 1, 2, 3, 4, 5}
+    assert parse_hours("1-3") == {1, 2}
+    assert parse_hours("") == parse_hours("5-5") == set(range(24))
+
+
+def test_nothing_is_synthesized_outside_the_window(make_prefetcher, clock, backend):
+    clock.hour = 12
+    prefetcher = make_prefetcher(off_peak_hours="0-6")
+
+    assert not prefetcher.off_peak()
+    assert prefetcher.run_once() == 0
+    assert backend.calls == 0
+    # The CLI command ignores the window
+    assert prefetcher.run_once(ignore_window=True) == len(WORDS)
+
+
+def test_window_words_are_synthesized_once(make_prefetcher, backend):
+    prefetcher = make_prefetcher(off_peak_hours="0-6", rates=("slow", "medium"))
+
+    assert prefetcher.run_once() == 2 * len(WORDS)
+    assert backend.calls == 2
+    # Already in the fragment cache
+    assert prefetcher.run_once() == 0
+    assert backend.calls == 2
+
+
+def test_calls_are_spaced_by_the_budget(make_prefetcher, backend):
+    prefetcher = make_prefetcher(calls_per_minute=6, batch_words=1)
+
+    assert prefetcher.run_once() == len(WORDS)
+    assert [time - backend.call_times[0] for time in backend.call_times] == [0, 10, 20]
+
+
+def test_prefetching_waits_while_a_request_is_in_flight(make_prefetcher, clock, backend):
+    app = Flask(__name__)
+    prefetcher = make_prefetcher(app)
+    prefetcher.track_requests()
+    finished = []
+
+    def finish_request_after_a_few_waits():
+        if clock.waits == 3:
+            context.pop()
+            finished.append(clock.time)
+
+    context = app.test_request_context()
+    context.push()
+    app.preprocess_request()  # before_request hooks: the request is now in flight
+    clock.on_wait = finish_request_after_a_few_waits
+
+    assert prefetcher.run_once() == len(WORDS)
+    assert finished and backend.call_times[0] >= finished[0]
+    assert clock.waits == 3
+
+
+def test_stopped_prefetcher_makes_no_call(make_prefetcher, backend):
+    prefetcher = make_prefetcher()
+    prefetcher.stop()
+
+    assert prefetcher.run_once() == 0
+    assert backend.calls == 0
@@ -0,0 +1,107 @@
+"""
+Process-local cache of reading texts and their derived forms
+
+Texts are few and rarely edited, so hot endpoints read them from memory. Entries are
+invalidated immediately when a text is updated through SQLAlchemy in this process
+(Texte.version is bumped on every UPDATE), and all entries are re-validated against
+the stored versions at most every `revalidate_after` seconds to pick up edits made by
+other processes.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import event
+
+import metrics
+from models import db, Texte
+
+
+@dataclass(frozen=True)
+class CachedTexte:
+    idTexte: int
+    texteContent: str
+    version: int
+    normalized: str
+    diacritized: str
+    tokens: Tuple[str, ...]
+
+
+class TexteCache:
+    def __init__(self, diacritizer: Optional[Callable[[str], str]] = None,
+                 normalizer: Optional[Callable[[str], str]] = None, revalidate_after: float = 60.0):
+        self.diacritizer = diacritizer
+        self.normalizer = normalizer
+        self.revalidate_after = revalidate_after
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_validation = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def listen(self, model=Texte):
+        """Invalidate entries as soon as a text is updated or deleted in this process"""
+        event.listen(model, "after_update", self._on_change)
+        event.listen(model, "after_delete", self._on_change)
+
+    def _on_change(self, mapper, connection, target):
+        self.invalidate(target.idTexte)
+
+    def _build(self, texte):
+        content = texte.texteContent
+        return CachedTexte(
+            idTexte=texte.idTexte,
+            texteContent=content,
+            version=texte.version,
+            normalized=self.normalizer(content) if self.normalizer else content,
+            diacritized=self.diacritizer(content) if self.diacritizer else content,
+            tokens=tuple(content.split())
+        )
+
+    def get(self, idTexte):
+        """Cached text, loaded from the database on first use (None if it does not exist)"""
+        self._revalidate_if_due()
+        with self._lock:
+            entry = self._entries.get(idTexte)
+            if entry is not None:
+                self.hits += 1
+                metrics.cache_lookup("texte", True)
+                return entry
+            self.misses += 1
+        metrics.cache_lookup("texte", False)
+
+        texte = db.session.get(Texte, idTexte)
+        if texte is None:
+            return None
+        entry = self._build(texte)
+        with self._lock:
+            self._entries[idTexte] = entry
+        return entry
+
+    def invalidate(self, idTexte=None):
+        with self._lock:
+            if idTexte is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(idTexte, None)
+
+    def _revalidate_if_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_validation < self.revalidate_after or not self._entries:
+                return
+            self._last_validation = now
+            cached_ids = list(self._entries)
+
+        # One small query for the versions of the cached texts only
+        current = dict(db.session.query(Texte.idTexte, Texte.version).filter(Texte.idTexte.in_(cached_ids)))
+        with self._lock:
+            for idTexte in cached_ids:
+                entry = self._entries.get(idTexte)
+                if entry is not None and current.get(idTexte) != entry.version:
+                    del self._entries[idTexte]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
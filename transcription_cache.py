@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+
+def hash_audio_file(audio_path, chunk_size=1 << 20):
+    """Calcule l'empreinte SHA-256 du contenu brut d'un fichier audio"""
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _json_default(obj):
+    """Convertit les types NumPy présents dans les résultats d'analyse"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Type non sérialisable: {type(obj).__name__}")
+
+
+def _write_atomic(path, write):
+    """
+    Écrit un fichier sous un nom temporaire unique puis le renomme: un lecteur (ou un autre
+    processus partageant le répertoire) ne voit jamais de fichier à moitié écrit
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class TranscriptionCache:
+    """
+    Index sur disque: empreinte du fichier audio -> décodage, analyse de qualité et transcription.
+
+    Chaque entrée est marquée avec la version du modèle ASR; une entrée produite par
+    un autre modèle ou un autre backend est considérée comme périmée et supprimée.
+
+    Le signal décodé (.npy, bien plus gros que le fichier d'origine) n'est gardé que jusqu'à
+    ce que la transcription réussisse: il ne sert qu'à relancer une transcription échouée ou
+    refusée (503). Si max_bytes est fourni, les entrées les moins récemment utilisées sont
+    supprimées dès que le cache dépasse cette taille.
+    """
+
+    def __init__(self, cache_dir, model_version, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.model_version = model_version
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size in self._scan().values())
+
+    def _entry_path(self, audio_hash):
+        return os.path.join(self.cache_dir, f"{audio_hash}.json")
+
+    def _audio_path(self, audio_hash):
+        return os.path.join(self.cache_dir, f"{audio_hash}.npy")
+
+    def _arrays_path(self, audio_hash):
+        return os.path.join(self.cache_dir, f"{audio_hash}.arrays.npz")
+
+    def get(self, audio_hash):
+        """Retourne l'entrée associée à l'empreinte, ou None si absente ou périmée"""
+        entry_path = self._entry_path(audio_hash)
+        with self._lock:
+            if not os.path.exists(entry_path):
+                return None
+            try:
+                with open(entry_path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(audio_hash)
+                return None
+
+            if entry.get("model_version") != self.model_version:
+                # Modèle ou backend différent: invalider l'entrée
+                self._remove(audio_hash)
+                return None
+            # La date de modification de l'entrée sert d'ordre LRU pour l'éviction
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+            return entry
+
+    def get_audio(self, audio_hash):
+        """Retourne le signal décodé (float32) mis en cache, ou None"""
+        audio_path = self._audio_path(audio_hash)
+        if not os.path.exists(audio_path):
+            return None
+        try:
+            return np.load(audio_path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def get_arrays(self, audio_hash):
+        """Retourne les tableaux compacts (postérieurs ASR...) mis en cache, ou un dict vide"""
+        arrays_path = self._arrays_path(audio_hash)
+        if not os.path.exists(arrays_path):
+            return {}
+        try:
+            with np.load(arrays_path, allow_pickle=False) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return {}
+
+    def put(self, audio_hash, entry, audio=None, arrays=None):
+        """Enregistre (ou complète) l'entrée d'une empreinte"""
+        with self._lock:
+            size_before = self._hash_size(audio_hash)
+            existing = {}
+            entry_path = self._entry_path(audio_hash)
+            if os.path.exists(entry_path):
+                try:
+                    with open(entry_path, "r", encoding="utf-8") as f:
+                        existing = json.load(f)
+                except (OSError, ValueError):
+                    existing = {}
+                if existing.get("model_version") != self.model_version:
+                    existing = {}
+
+            existing.update(entry)
+            existing["model_version"] = self.model_version
+            existing["updated_at"] = datetime.utcnow().isoformat()
+
+            if existing.get("transcription") is not None:
+                # Transcription réussie: le signal décodé n'est plus utile
+                self._remove_file(self._audio_path(audio_hash))
+            elif audio is not None:
+                _write_atomic(self._audio_path(audio_hash),
+                              lambda f: np.save(f, np.asarray(audio, dtype=np.float32), allow_pickle=False))
+            if arrays:
+                _write_atomic(self._arrays_path(audio_hash), lambda f: np.savez(f, **arrays))
+
+            data = json.dumps(existing, ensure_ascii=False, default=_json_default).encode("utf-8")
+            _write_atomic(entry_path, lambda f: f.write(data))
+
+            self._size += self._hash_size(audio_hash) - size_before
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict(keep=audio_hash)
+            return existing
+
+    def invalidate(self, audio_hash):
+        with self._lock:
+            self._remove(audio_hash)
+
+    def _paths(self, audio_hash):
+        return self._entry_path(audio_hash), self._audio_path(audio_hash), self._arrays_path(audio_hash)
+
+    def _hash_size(self, audio_hash):
+        size = 0
+        for path in self._paths(audio_hash):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, audio_hash):
+        size = self._hash_size(audio_hash)
+        for path in self._paths(audio_hash):
+            self._remove_file(path)
+        self._size -= size
+
+    def _scan(self):
+        """{empreinte: (dernière utilisation, taille totale)} des fichiers présents sur disque"""
+        entries = {}
+        for item in os.scandir(self.cache_dir):
+            if not item.is_file():
+                continue
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            audio_hash = item.name.split(".", 1)[0]
+            last_used, size = entries.get(audio_hash, (0.0, 0))
+            entries[audio_hash] = (max(last_used, stat.st_mtime), size + stat.st_size)
+        return entries
+
+    def _evict(self, keep=None):
+        """Supprime les entrées les moins récemment utilisées jusqu'à 90 % de max_bytes"""
+        entries = self._scan()
+        # Recalcul depuis le disque: d'autres processus peuvent partager le répertoire
+        self._size = sum(size for _, size in entries.values())
+        target = self.max_bytes * 0.9
+        for audio_hash, _ in sorted(entries.items(), key=lambda item: item[1][0]):
+            if self._size <= target:
+                break
+            if audio_hash != keep:
+                self._remove(audio_hash)
@@ -0,0 +1,179 @@
+"""
+Background pre-synthesis of the words students are most likely to misread
+
+The same hard words of a text are misread by most students. During off-peak hours, the
+prefetcher ranks each text's words by error_count in text_word_stat. It synthesizes the
+top-N words that are not cached yet, at the correction-clip rate (slow) and the feedback
+rate (medium), into the corrector's fragment cache. Interactive correction runs then cut
+those clips from the cache instead of calling the synthesis service.
+
+Synthesis calls are spaced to stay within calls_per_minute, and no call is made
+while a request is being served.
+"""
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from models import db, TextWordStat
+
+
+def parse_hours(window):
+    """'22-6' -> set of hours 22..23 and 0..5 (the end hour is excluded); '' -> every hour"""
+    if not window:
+        return set(range(24))
+    start, end = (int(hour) % 24 for hour in window.split("-"))
+    if start == end:
+        return set(range(24))
+    if start < end:
+        return set(range(start, end))
+    return set(range(start, 24)) | set(range(0, end))
+
+
+class SystemClock:
+    """Wall-clock hour, monotonic time and interruptible sleep of the prefetcher"""
+
+    def now(self):
+        return datetime.now()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def wait(self, event, timeout):
+        """Sleep up to timeout seconds; True if event was set"""
+        return event.wait(timeout)
+
+
+class TTSPrefetcher:
+    def __init__(self, app, corrector, texte_cache, top_n=20, min_errors=2, batch_words=10,
+                 calls_per_minute=6, off_peak_hours="0-6", interval=600, rates=("slow", "medium"),
+                 clock=None):
+        """
+        Args:
+            top_n: Words prefetched per text, by decreasing error count
+            min_errors: Words misread fewer times than this are not prefetched
+            batch_words: Words synthesized per call (one bookmarked SSML document)
+            calls_per_minute: Synthesis budget of the prefetcher
+            off_peak_hours: Hours (server local time) when prefetching may run, e.g. "22-6"
+            interval: Seconds between two passes
+            clock: Source of the hour, of monotonic time and of sleeps (SystemClock by default)
+        """
+        self.app = app
+        self.corrector = corrector
+        self.texte_cache = texte_cache
+        self.top_n = top_n
+        self.min_errors = min_errors
+        self.batch_words = batch_words
+        self.seconds_per_call = 60.0 / calls_per_minute
+        self.hours = parse_hours(off_peak_hours)
+        self.interval = interval
+        self.rates = tuple(rates)
+        self.clock = clock or SystemClock()
+        self.synthesized = 0
+        self._active_requests = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_call = 0.0
+
+    def track_requests(self):
+        """Count in-flight requests so that prefetching yields to interactive traffic"""
+        @self.app.before_request
+        def _request_started():
+            with self._lock:
+                self._active_requests += 1
+
+        @self.app.teardown_request
+        def _request_finished(exc):
+            with self._lock:
+                self._active_requests -= 1
+
+    def start(self):
+        self.track_requests()
+        self._thread = threading.Thread(target=self._run, name="tts-prefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def off_peak(self):
+        return self.clock.now().hour in self.hours
+
+    def _run(self):
+        while not self.clock.wait(self._stop, self.interval):
+            if not self.off_peak():
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                self.app.logger.error(f"TTS prefetch failed: {e}")
+
+    def ranked_words(self):
+        """{idTexte: [word, ...]} most misread first, top_n per text"""
+        rows = (db.session.query(TextWordStat.idTexte, TextWordStat.word)
+                .filter(TextWordStat.error_count >= self.min_errors)
+                .order_by(TextWordStat.idTexte, TextWordStat.error_count.desc())
+                .all())
+        ranked = {}
+        for idTexte, word in rows:
+            words = ranked.setdefault(idTexte, [])
+            if len(words) < self.top_n:
+                words.append(word)
+        return ranked
+
+    def diacritized_words(self, idTexte, words):
+        """Diacritized form of each word, taken at its position in the cached text"""
+        texte = self.texte_cache.get(idTexte)
+        if texte is None:
+            return []
+        diacritized = texte.diacritized.split()
+        forms = []
+        for word in words:
+            if word not in texte.tokens:
+                continue
+            position = texte.tokens.index(word)
+            forms.append(diacritized[position] if position < len(diacritized) else word)
+        return forms
+
+    def run_once(self, ignore_window=False):
+        """One pass over all texts; returns the number of words synthesized"""
+        with self.app.app_context():
+            ranked = self.ranked_words()
+            work = [self.diacritized_words(idTexte, words) for idTexte, words in ranked.items()]
+
+        cache = self.corrector.fragment_cache
+        voice_name = self.corrector.speech_config.speech_synthesis_voice_name
+        synthesized = 0
+        for words in work:
+            for rate in self.rates:
+                missing = [word for word in dict.fromkeys(words) if cache.get(word, voice_name, rate) is None]
+                for start in range(0, len(missing), self.batch_words):
+                    if not (ignore_window or self.off_peak()) or not self._wait_for_budget():
+                        return synthesized
+                    batch = missing[start:start + self.batch_words]
+                    try:
+                        with metrics.span("tts_prefetch"):
+                            fragments = cache.synthesize(batch, self.corrector.speech_backend,
+                                                         self.corrector.language, voice_name, rate)
+                    except Exception as e:
+                        self.app.logger.error(f"TTS prefetch synthesis failed: {e}")
+                        fragments = None
+                    if fragments:
+                        synthesized += len(fragments)
+                        self.synthesized += len(fragments)
+        return synthesized
+
+    def _wait_for_budget(self):
+        """
+        Sleep until the rate budget allows a call and no request is in flight;
+        False if the prefetcher was stopped meanwhile
+        """
+        while not self._stop.is_set():
+            now = self.clock.monotonic()
+            with self._lock:
+                busy = self._active_requests > 0
+            if not busy and now >= self._next_call:
+                self._next_call = now + self.seconds_per_call
+                return True
+            self.clock.wait(self._stop, 0.5 if busy else self._next_call - now)
+        return False